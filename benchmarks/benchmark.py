@@ -0,0 +1,376 @@
+"""
+Benchmarks for the ingestion, querying and answer-parsing paths
+
+Data comes from the in-process fake MTurk backend (mturk.fake), seeded so
+that every run sees identical inputs. For each data size, every benchmark
+reports its throughput (items per second) and its peak memory allocation.
+
+Usage:
+    python benchmarks/benchmark.py --sizes 1000,10000 --save baseline.json
+    python benchmarks/benchmark.py --sizes 1000,10000 --compare baseline.json
+
+Sizes are numbers of assignments; HITs are generated with
+ASSIGNMENTS_PER_HIT assignments each. When comparing, the script exits with
+status 1 if any benchmark's throughput dropped by more than --threshold.
+
+Ingestion is measured twice: inserting rows into an emptied database (every run),
+and saving the same rows again over the ones already there, which only updates them.
+--features enables optional features (e.g. changes,worker_stats,fingerprints),
+to measure what their save hooks cost.
+"""
+
+import argparse
+import csv
+import gc
+import io
+import json
+import logging
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+import mturk
+import mturk.fake
+import objective_turk
+
+logger = logging.getLogger("benchmark")
+
+ASSIGNMENTS_PER_HIT = 50
+SEED = 1234
+
+EXPORT_FIELDS = [
+    "AssignmentId",
+    "WorkerId",
+    "HITId",
+    "AssignmentStatus",
+    "AcceptTime",
+    "SubmitTime",
+]
+
+
+class Dataset:
+    """
+    A deterministic synthetic account, plus the raw API responses for it
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.client = mturk.fake.FakeMTurkClient(mturk.fake.FakeConfig(seed=SEED))
+        self.hit_ids = self.client.populate(
+            hits=max(size // ASSIGNMENTS_PER_HIT, 1),
+            assignments_per_hit=min(size, ASSIGNMENTS_PER_HIT),
+        )
+        self.hits = list(mturk.get_pages(self.client.list_hits, "HITs", MaxResults=100))
+        self.assignments = [
+            assignment
+            for hit_id in self.hit_ids
+            for assignment in mturk.get_pages(
+                self.client.list_assignments_for_hit,
+                "Assignments",
+                HITId=hit_id,
+                MaxResults=100,
+            )
+        ]
+
+
+def bench_get_pages(dataset: Dataset) -> int:
+    count = 0
+    for hit_id in dataset.hit_ids:
+        for _ in mturk.get_pages(
+            dataset.client.list_assignments_for_hit,
+            "Assignments",
+            HITId=hit_id,
+            MaxResults=100,
+        ):
+            count += 1
+    return count
+
+
+def bench_ingest_hits(dataset: Dataset) -> int:
+    # pylint: disable=protected-access
+    with objective_turk.get_database().atomic():
+        for hit in dataset.hits:
+            objective_turk.Hit._new_from_response(hit)
+    return len(dataset.hits)
+
+
+def bench_ingest_assignments(dataset: Dataset) -> int:
+    # pylint: disable=protected-access
+    with objective_turk.get_database().atomic():
+        for assignment in dataset.assignments:
+            objective_turk.Assignment._new_from_response(assignment)
+    return len(dataset.assignments)
+
+
+def empty_database(dataset: Dataset) -> None:
+    """
+    Delete every row (except which features are enabled), so the next run inserts them again
+    """
+    database = objective_turk.get_database()
+    kept = objective_turk.objective_turk.Feature._meta.table_name
+    # Emptied in any order, so foreign keys are only checked again afterwards
+    database.pragma("foreign_keys", 0)
+    try:
+        with database.atomic():
+            for table in database.get_tables():
+                if table != kept:
+                    database.execute_sql(f'DELETE FROM "{table}"')
+    finally:
+        database.pragma("foreign_keys", 1)
+
+
+def hits_only(dataset: Dataset) -> None:
+    """
+    Empty the database but for the HITs, so the next run inserts the assignments again
+    """
+    empty_database(dataset)
+    bench_ingest_hits(dataset)
+
+
+def bench_answers(dataset: Dataset) -> int:
+    count = 0
+    for assignment in objective_turk.Assignment.select():
+        count += len(assignment.answers) > 0
+    return count
+
+
+def bench_hit_completed(dataset: Dataset) -> int:
+    count = 0
+    for hit in objective_turk.Hit.select():
+        hit.completed  # pylint: disable=pointless-statement
+        count += 1
+    return count
+
+
+def bench_hit_assignments(dataset: Dataset) -> int:
+    count = 0
+    for hit in objective_turk.Hit.select():
+        for assignment in hit.assignments:
+            count += 1
+    return count
+
+
+def bench_worker_assignments(dataset: Dataset) -> int:
+    count = 0
+    for worker in objective_turk.Worker.select():
+        for assignment in worker.assignments:
+            count += 1
+    return count
+
+
+def bench_export(dataset: Dataset) -> int:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for assignment in objective_turk.Assignment.select():
+        writer.writerow([assignment.details[field] for field in EXPORT_FIELDS])
+        count += 1
+    return count
+
+
+Setup = typing.Optional[typing.Callable[[Dataset], None]]
+
+# Each with the setup run (untimed) before every run of it, if any.
+# The order matters: ingestion populates the database the later benchmarks read.
+BENCHMARKS: typing.List[typing.Tuple[str, typing.Callable[[Dataset], int], Setup]] = [
+    ("get_pages", bench_get_pages, None),
+    ("insert_hits", bench_ingest_hits, empty_database),
+    ("insert_assignments", bench_ingest_assignments, hits_only),
+    ("update_hits", bench_ingest_hits, None),
+    ("update_assignments", bench_ingest_assignments, None),
+    ("answers", bench_answers, None),
+    ("hit_completed", bench_hit_completed, None),
+    ("hit_assignments", bench_hit_assignments, None),
+    ("worker_assignments", bench_worker_assignments, None),
+    ("export", bench_export, None),
+]
+
+
+def measure(
+    benchmark,
+    dataset: Dataset,
+    trace_memory: bool,
+    repeat: int = 3,
+    setup: Setup = None,
+) -> typing.Dict:
+    """
+    Run one benchmark and return its throughput (and optionally peak memory)
+
+    The fastest of `repeat` runs is reported, to reduce noise.
+    Timing and memory are measured in separate runs,
+    because tracemalloc slows down allocation-heavy code considerably.
+    """
+    elapsed = float("inf")
+    count = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup(dataset)
+        gc.collect()
+        start = time.perf_counter()
+        count = benchmark(dataset)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    result = {
+        "items": count,
+        "seconds": elapsed,
+        "per_second": count / elapsed if elapsed > 0 else float("inf"),
+    }
+
+    if trace_memory:
+        if setup is not None:
+            setup(dataset)
+        gc.collect()
+        tracemalloc.start()
+        benchmark(dataset)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_bytes"] = peak
+
+    return result
+
+
+def run(
+    sizes: typing.Iterable[int],
+    trace_memory: bool = True,
+    repeat: int = 3,
+    features: typing.Iterable[str] = (),
+) -> typing.Dict:
+    """
+    Run every benchmark at each of the given sizes, each against a fresh database
+    with the given optional features enabled
+    """
+    results: typing.Dict[str, typing.Dict] = {}
+    for size in sizes:
+        logger.info("generating data set with %d assignments", size)
+        dataset = Dataset(size)
+        with tempfile.TemporaryDirectory() as directory:
+            session = objective_turk.Session(
+                objective_turk.Environment.sandbox,
+                db_path=pathlib.Path(directory) / "benchmark.db",
+                client=dataset.client,
+            )
+            with session.activate():
+                for feature in features:
+                    objective_turk.enable_feature(feature)
+                for name, benchmark, setup in BENCHMARKS:
+                    logger.info("running %s (size %d)", name, size)
+                    results.setdefault(str(size), {})[name] = measure(
+                        benchmark, dataset, trace_memory, repeat, setup
+                    )
+            session.close()
+    return results
+
+
+def print_results(
+    results: typing.Dict, baseline: typing.Optional[typing.Dict] = None
+) -> None:
+    print(
+        f"{'size':>8} {'benchmark':<20} {'items/s':>12} {'peak MiB':>9} {'vs baseline':>12}"
+    )
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            peak = result.get("peak_bytes")
+            peak_str = f"{peak / 2 ** 20:.1f}" if peak is not None else "-"
+            change = ""
+            if baseline is not None and name in baseline.get(size, {}):
+                before = baseline[size][name]["per_second"]
+                change = f"{(result['per_second'] - before) / before:+.1%}"
+            print(
+                f"{size:>8} {name:<20} {result['per_second']:>12.0f} {peak_str:>9} {change:>12}"
+            )
+
+
+def regressions(
+    results: typing.Dict, baseline: typing.Dict, threshold: float
+) -> typing.List[str]:
+    """
+    Return a description of every benchmark that got slower than the threshold allows
+    """
+    slower = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            if name not in baseline.get(size, {}):
+                continue
+            before = baseline[size][name]["per_second"]
+            if result["per_second"] < before * (1 - threshold):
+                slower.append(
+                    f"{name} at size {size}: {before:.0f} -> {result['per_second']:.0f} items/s"
+                )
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000",
+        help="Comma-separated numbers of assignments to benchmark with",
+    )
+    parser.add_argument("--save", help="Save results as a JSON baseline to this file")
+    parser.add_argument("--compare", help="Compare results against this JSON baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Fractional throughput drop that counts as a regression (default 0.1)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Run each benchmark this many times and report the fastest (default 3)",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Skip peak memory measurement"
+    )
+    parser.add_argument(
+        "--features",
+        default="",
+        help="Comma-separated optional features to enable (e.g. changes,worker_stats)",
+    )
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    # Importing mturk configures the root logger; keep per-row debug output off the console.
+    for root_handler in logging.getLogger().handlers:
+        root_handler.setLevel(logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    features = [feature for feature in args.features.split(",") if feature]
+    results = run(
+        sizes, trace_memory=not args.no_memory, repeat=args.repeat, features=features
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        for regression in slower:
+            logger.error("regression: %s", regression)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,961 @@
+"""
+An in-process stand-in for the MTurk API
+
+FakeMTurkClient implements the parts of the boto3 MTurk client used by this
+project (HITs, assignments, qualifications, bonuses and notifications),
+including pagination, throttling, configurable latency and error injection.
+It can also generate synthetic accounts with millions of assignments, which
+are materialized lazily so that they don't need to be held in memory.
+
+Use it by setting MTURK_FAKE=true (see mturk.get_client), or by passing a
+FakeMTurkClient wherever a boto3 client is expected.
+"""
+
+import datetime
+import logging
+import random
+import threading
+import time
+import uuid
+from xml.sax.saxutils import escape
+
+import botocore.hooks
+from botocore.exceptions import ClientError
+
+LOGGER = logging.getLogger(__name__)
+
+SERVICE_ID = 'mturk'
+
+DEFAULT_MAX_RESULTS = 10
+MAX_MAX_RESULTS = 100
+
+SYNTHETIC_PREFIX = 'SYN'
+
+ANSWER_NAMESPACE = 'http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd'
+
+FEEDBACK_PHRASES = [
+    'Thanks, this was an interesting study.',
+    'No problems.',
+    'The instructions were clear.',
+    'good',
+    'It took longer than expected.',
+    'none',
+    'The second page did not load at first, but it worked after a refresh.',
+    'I enjoyed this task and would do more like it.',
+]
+
+
+def now_utc():
+    """
+    Return a timezone-aware datetime of the current moment (in UTC)
+    """
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def new_id(prefix=''):
+    """
+    Return a random MTurk-style identifier (30 uppercase alphanumeric characters)
+    """
+    return (prefix + uuid.uuid4().hex.upper())[:30].ljust(30, '0')
+
+
+def answer_xml(answers):
+    """
+    Serialize a dict of answers in the QuestionFormAnswers format used by MTurk
+    """
+    fields = ''.join(
+        '<Answer><QuestionIdentifier>{}</QuestionIdentifier><FreeText>{}</FreeText></Answer>'.format(
+            escape(str(field)), escape(str(value)))
+        for field, value in answers.items())
+    return '<?xml version="1.0" encoding="ASCII"?><QuestionFormAnswers xmlns="{}">{}</QuestionFormAnswers>'.format(
+        ANSWER_NAMESPACE, fields)
+
+
+class FakeConfig:
+    """
+    Behavior of the fake backend
+
+    latency: seconds to sleep per call (a number, or a (min, max) tuple for jitter)
+    error_rate: probability that any call fails with a ServiceFault
+    throttle_rate: sustained calls per second allowed before ThrottlingException (None: unlimited)
+    throttle_burst: number of calls that can be made at once before throttling kicks in
+    max_attempts: total attempts per call, emulating boto3's built-in retries
+    retry_backoff: base delay in seconds between retries (doubles with every attempt)
+    seed: seed for error injection and synthetic data
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=None,
+                 throttle_burst=10, max_attempts=5, retry_backoff=0.05, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.throttle_burst = throttle_burst
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.seed = seed
+
+
+class _OperationModel:
+    """
+    The part of botocore's OperationModel that event handlers commonly use
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _ServiceModel:
+    def __init__(self):
+        self.service_name = SERVICE_ID
+
+
+class _ClientMeta:
+    """
+    Mirrors boto3's client.meta, so event hooks can be registered the same way
+    """
+
+    def __init__(self):
+        self.events = botocore.hooks.HierarchicalEmitter()
+        self.service_model = _ServiceModel()
+        self.region_name = 'us-east-1'
+        self.endpoint_url = 'fake://mturk'
+
+
+class _SyntheticHit:
+    """
+    Bookkeeping for a generated HIT whose assignments are materialized on demand
+    """
+
+    def __init__(self, number, assignment_count, worker_offset):
+        self.number = number
+        self.assignment_count = assignment_count
+        self.worker_offset = worker_offset
+
+
+class FakeMTurkClient:
+    """
+    A boto3-compatible MTurk client backed by in-memory state
+
+    Only the operations this project uses are implemented.
+    Calling any other MTurk operation raises AttributeError.
+    """
+
+    OPERATIONS = {
+        'approve_assignment': 'ApproveAssignment',
+        'associate_qualification_with_worker': 'AssociateQualificationWithWorker',
+        'create_additional_assignments_for_hit': 'CreateAdditionalAssignmentsForHIT',
+        'create_hit': 'CreateHIT',
+        'create_hit_type': 'CreateHITType',
+        'create_hit_with_hit_type': 'CreateHITWithHITType',
+        'create_qualification_type': 'CreateQualificationType',
+        'delete_hit': 'DeleteHIT',
+        'delete_qualification_type': 'DeleteQualificationType',
+        'disassociate_qualification_from_worker': 'DisassociateQualificationFromWorker',
+        'get_account_balance': 'GetAccountBalance',
+        'get_assignment': 'GetAssignment',
+        'get_hit': 'GetHIT',
+        'get_qualification_score': 'GetQualificationScore',
+        'get_qualification_type': 'GetQualificationType',
+        'list_assignments_for_hit': 'ListAssignmentsForHIT',
+        'list_bonus_payments': 'ListBonusPayments',
+        'list_hits': 'ListHITs',
+        'list_qualification_types': 'ListQualificationTypes',
+        'list_reviewable_hits': 'ListReviewableHITs',
+        'list_workers_with_qualification_type': 'ListWorkersWithQualificationType',
+        'notify_workers': 'NotifyWorkers',
+        'reject_assignment': 'RejectAssignment',
+        'send_bonus': 'SendBonus',
+        'send_test_event_notification': 'SendTestEventNotification',
+        'update_expiration_for_hit': 'UpdateExpirationForHIT',
+        'update_hit_review_status': 'UpdateHITReviewStatus',
+        'update_notification_settings': 'UpdateNotificationSettings',
+    }
+
+    def __init__(self, config=None, balance='10000.00'):
+        self.config = config if config is not None else FakeConfig()
+        self.meta = _ClientMeta()
+        self.balance = balance
+
+        self._lock = threading.RLock()
+        self._random = random.Random(self.config.seed)
+        self._tokens = float(self.config.throttle_burst)
+        self._last_refill = time.monotonic()
+
+        self._hits = {}
+        self._hit_ids = []
+        self._hit_types = {}
+        self._synthetic_hits = {}
+        self._synthetic_worker_count = 1
+        self._assignments = {}
+        self._hit_assignments = {}
+        self._qualification_types = {}
+        self._qualifications = {}
+        self._bonuses = []
+        self._request_tokens = {}
+        self._notification_settings = {}
+        self._listeners = []
+
+        self.call_counts = {}
+
+    # ------------------------------------------------------------------
+    # Call machinery
+
+    def __getattr__(self, name):
+        operation = self.OPERATIONS.get(name)
+        handler = getattr(type(self), '_' + name, None)
+        if operation is None or handler is None:
+            raise AttributeError('FakeMTurkClient does not implement %s' % name)
+
+        def call(**kwargs):
+            return self._call(name, operation, handler, kwargs)
+
+        call.__name__ = name
+        return call
+
+    def _call(self, name, operation, handler, kwargs):
+        model = _OperationModel(operation)
+        context = {'client_region': self.meta.region_name}
+        self.meta.events.emit('before-call.{}.{}'.format(SERVICE_ID, operation),
+                              model=model, params=kwargs, context=context)
+
+        attempts = 0
+        while True:
+            attempts += 1
+            self._sleep_latency()
+            try:
+                with self._lock:
+                    self.call_counts[name] = self.call_counts.get(name, 0) + 1
+                    self._check_throttle(operation)
+                    self._check_injected_error(operation)
+                    response = handler(self, **kwargs)
+                break
+            except ClientError as error:
+                self.meta.events.emit('needs-retry.{}.{}'.format(SERVICE_ID, operation),
+                                      response=(None, error.response), endpoint=None,
+                                      operation=model, attempts=attempts,
+                                      caught_exception=None, request_dict=kwargs)
+                retryable = error.response['Error']['Code'] in ('ThrottlingException', 'ServiceFault')
+                if not retryable or attempts >= self.config.max_attempts:
+                    # Like botocore, after-call also fires for error responses
+                    error.response['ResponseMetadata']['RetryAttempts'] = attempts - 1
+                    self.meta.events.emit('after-call.{}.{}'.format(SERVICE_ID, operation),
+                                          http_response=None, parsed=error.response,
+                                          model=model, context=context)
+                    raise
+                if self.config.retry_backoff:
+                    time.sleep(self.config.retry_backoff * 2 ** (attempts - 1))
+
+        response['ResponseMetadata'] = {
+            'RequestId': str(uuid.uuid4()),
+            'HTTPStatusCode': 200,
+            'RetryAttempts': attempts - 1,
+        }
+        self.meta.events.emit('after-call.{}.{}'.format(SERVICE_ID, operation),
+                              http_response=None, parsed=response, model=model,
+                              context=context)
+        return response
+
+    def _sleep_latency(self):
+        latency = self.config.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _check_throttle(self, operation):
+        if self.config.throttle_rate is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(float(self.config.throttle_burst),
+                           self._tokens + (now - self._last_refill) * self.config.throttle_rate)
+        self._last_refill = now
+        if self._tokens < 1:
+            raise self._error(operation, 'ThrottlingException', 'Rate exceeded', 400)
+        self._tokens -= 1
+
+    def _check_injected_error(self, operation):
+        if self.config.error_rate and self._random.random() < self.config.error_rate:
+            raise self._error(operation, 'ServiceFault', 'Injected service failure', 500)
+
+    @staticmethod
+    def _error(operation, code, message, status=400):
+        return ClientError({
+            'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': status},
+        }, operation)
+
+    def _request_error(self, operation, message):
+        return self._error(operation, 'RequestError', message)
+
+    @staticmethod
+    def _page(items, kwargs, keyword):
+        """
+        Return a page of items, starting at the position encoded in NextToken
+        """
+        start = int(kwargs.get('NextToken') or 0)
+        size = min(kwargs.get('MaxResults', DEFAULT_MAX_RESULTS), MAX_MAX_RESULTS)
+        page = items[start:start + size]
+        response = {keyword: page, 'NumResults': len(page)}
+        if start + size < len(items):
+            response['NextToken'] = str(start + size)
+        return response
+
+    @staticmethod
+    def _filtered_page(keys, kwargs, keyword, lookup):
+        """
+        Return a page of items from keys whose lookup is not None
+
+        The NextToken encodes the position in keys, so paging through a
+        filtered listing costs O(n) overall rather than O(n) per page.
+        """
+        position = int(kwargs.get('NextToken') or 0)
+        size = min(kwargs.get('MaxResults', DEFAULT_MAX_RESULTS), MAX_MAX_RESULTS)
+        page = []
+        while position < len(keys) and len(page) < size:
+            item = lookup(keys[position])
+            position += 1
+            if item is not None:
+                page.append(item)
+        response = {keyword: page, 'NumResults': len(page)}
+        if position < len(keys):
+            response['NextToken'] = str(position)
+        return response
+
+    # ------------------------------------------------------------------
+    # Notifications
+
+    def add_listener(self, callback):
+        """
+        Register a callable that receives every notification message the fake
+        would deliver (in the format MTurk sends to SQS/SNS destinations)
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, event_type, hit, assignment_id=None):
+        settings = self._notification_settings.get(hit['HITTypeId'])
+        if not self._listeners or settings is None or not settings['Active']:
+            return
+        if event_type not in settings['Notification'].get('EventTypes', []):
+            return
+        event = {
+            'EventType': event_type,
+            'EventTimestamp': now_utc().isoformat(),
+            'HITId': hit['HITId'],
+            'HITTypeId': hit['HITTypeId'],
+        }
+        if assignment_id is not None:
+            event['AssignmentId'] = assignment_id
+        message = {
+            'Events': [event],
+            'EventDocId': str(uuid.uuid4()),
+            'SourceAccount': 'fake',
+            'CustomerId': 'fake',
+            'EventDocVersion': '2014-08-15',
+        }
+        for listener in self._listeners:
+            listener(message)
+
+    # ------------------------------------------------------------------
+    # HITs
+
+    def _new_hit(self, hit_type, max_assignments, lifetime, question=None,
+                 annotation=None, creation_time=None, hit_id=None):
+        creation_time = creation_time or now_utc()
+        hit = {
+            'HITId': hit_id or new_id(),
+            'HITTypeId': hit_type['HITTypeId'],
+            'HITGroupId': hit_type['HITTypeId'],
+            'CreationTime': creation_time,
+            'Title': hit_type['Title'],
+            'Description': hit_type['Description'],
+            'Question': question or '',
+            'Keywords': hit_type.get('Keywords', ''),
+            'HITStatus': 'Assignable',
+            'MaxAssignments': max_assignments,
+            'Reward': hit_type['Reward'],
+            'AutoApprovalDelayInSeconds': hit_type.get('AutoApprovalDelayInSeconds', 2592000),
+            'Expiration': creation_time + datetime.timedelta(seconds=lifetime),
+            'AssignmentDurationInSeconds': hit_type['AssignmentDurationInSeconds'],
+            'QualificationRequirements': hit_type.get('QualificationRequirements', []),
+            'HITReviewStatus': 'NotReviewed',
+            'NumberOfAssignmentsPending': 0,
+            'NumberOfAssignmentsAvailable': max_assignments,
+            'NumberOfAssignmentsCompleted': 0,
+        }
+        if annotation is not None:
+            hit['RequesterAnnotation'] = annotation
+        self._hits[hit['HITId']] = hit
+        self._hit_ids.append(hit['HITId'])
+        self._hit_assignments[hit['HITId']] = []
+        return hit
+
+    def _get_hit_or_fail(self, operation, hit_id):
+        hit = self._hits.get(hit_id)
+        if hit is None or hit['HITStatus'] == 'Disposed':
+            raise self._request_error(operation, 'Hit {} does not exist.'.format(hit_id))
+        self._refresh_hit_status(hit)
+        return hit
+
+    def _refresh_hit_status(self, hit):
+        if hit['HITStatus'] in ('Disposed', 'Reviewing'):
+            return
+        expired = hit['Expiration'] <= now_utc()
+        if expired or hit['NumberOfAssignmentsAvailable'] == 0:
+            if hit['NumberOfAssignmentsPending'] > 0:
+                hit['HITStatus'] = 'Unassignable'
+            else:
+                hit['HITStatus'] = 'Reviewable'
+        else:
+            hit['HITStatus'] = 'Assignable'
+
+    def _register_hit_type(self, kwargs):
+        hit_type = {
+            'HITTypeId': new_id('T'),
+            'Title': kwargs['Title'],
+            'Description': kwargs['Description'],
+            'Reward': kwargs['Reward'],
+            'AssignmentDurationInSeconds': kwargs['AssignmentDurationInSeconds'],
+            'Keywords': kwargs.get('Keywords', ''),
+            'AutoApprovalDelayInSeconds': kwargs.get('AutoApprovalDelayInSeconds', 2592000),
+            'QualificationRequirements': kwargs.get('QualificationRequirements', []),
+        }
+        for existing in self._hit_types.values():
+            if all(existing[key] == hit_type[key] for key in hit_type if key != 'HITTypeId'):
+                return existing
+        self._hit_types[hit_type['HITTypeId']] = hit_type
+        return hit_type
+
+    def _create_hit_type(self, **kwargs):
+        return {'HITTypeId': self._register_hit_type(kwargs)['HITTypeId']}
+
+    def _check_request_token(self, operation, token):
+        """
+        Fail like MTurk does when a UniqueRequestToken is reused
+        """
+        if token is not None and token in self._request_tokens:
+            raise self._request_error(
+                operation,
+                'The request with UniqueRequestToken {} has already been processed '
+                '({}).'.format(token, self._request_tokens[token]))
+
+    def _create_hit(self, **kwargs):
+        self._check_request_token('CreateHIT', kwargs.get('UniqueRequestToken'))
+        hit_type = self._register_hit_type(kwargs)
+        hit = self._new_hit(hit_type, kwargs.get('MaxAssignments', 1),
+                            kwargs['LifetimeInSeconds'], kwargs.get('Question'),
+                            kwargs.get('RequesterAnnotation'))
+        if kwargs.get('UniqueRequestToken') is not None:
+            self._request_tokens[kwargs['UniqueRequestToken']] = 'HITId ' + hit['HITId']
+        return {'HIT': dict(hit)}
+
+    def _create_hit_with_hit_type(self, **kwargs):
+        self._check_request_token('CreateHITWithHITType', kwargs.get('UniqueRequestToken'))
+        hit_type = self._hit_types.get(kwargs['HITTypeId'])
+        if hit_type is None:
+            raise self._request_error('CreateHITWithHITType', 'HITType does not exist.')
+        hit = self._new_hit(hit_type, kwargs.get('MaxAssignments', 1),
+                            kwargs['LifetimeInSeconds'], kwargs.get('Question'),
+                            kwargs.get('RequesterAnnotation'))
+        if kwargs.get('UniqueRequestToken') is not None:
+            self._request_tokens[kwargs['UniqueRequestToken']] = 'HITId ' + hit['HITId']
+        return {'HIT': dict(hit)}
+
+    def _get_hit(self, HITId):
+        return {'HIT': dict(self._get_hit_or_fail('GetHIT', HITId))}
+
+    def _live_hit(self, hit_id):
+        hit = self._hits[hit_id]
+        if hit['HITStatus'] == 'Disposed':
+            return None
+        self._refresh_hit_status(hit)
+        return dict(hit)
+
+    def _list_hits(self, **kwargs):
+        return self._filtered_page(self._hit_ids, kwargs, 'HITs', self._live_hit)
+
+    def _list_reviewable_hits(self, **kwargs):
+        status = kwargs.get('Status', 'Reviewable')
+        hit_type = kwargs.get('HITTypeId')
+
+        def lookup(hit_id):
+            hit = self._live_hit(hit_id)
+            if hit is None or hit['HITStatus'] != status:
+                return None
+            if hit_type is not None and hit['HITTypeId'] != hit_type:
+                return None
+            return hit
+
+        return self._filtered_page(self._hit_ids, kwargs, 'HITs', lookup)
+
+    def _update_expiration_for_hit(self, HITId, ExpireAt):
+        hit = self._get_hit_or_fail('UpdateExpirationForHIT', HITId)
+        if ExpireAt.tzinfo is None:
+            ExpireAt = ExpireAt.astimezone(datetime.timezone.utc)
+        # Setting an expiration in the past expires the HIT immediately
+        hit['Expiration'] = max(ExpireAt, now_utc())
+        self._refresh_hit_status(hit)
+        return {}
+
+    def _update_hit_review_status(self, HITId, Revert=False):
+        hit = self._get_hit_or_fail('UpdateHITReviewStatus', HITId)
+        if Revert:
+            hit['HITStatus'] = 'Reviewable'
+        elif hit['HITStatus'] == 'Reviewable':
+            hit['HITStatus'] = 'Reviewing'
+        return {}
+
+    def _delete_hit(self, HITId):
+        hit = self._get_hit_or_fail('DeleteHIT', HITId)
+        if hit['HITStatus'] not in ('Reviewable', 'Reviewing'):
+            raise self._request_error(
+                'DeleteHIT', 'This HIT is currently in the state "{}". This operation can be called '
+                'with a status of: Reviewing, Reviewable'.format(hit['HITStatus']))
+        if self._count_submitted(hit) > 0:
+            raise self._request_error(
+                'DeleteHIT', 'This HIT has assignments that have not been approved or rejected.')
+        hit['HITStatus'] = 'Disposed'
+        return {}
+
+    def _create_additional_assignments_for_hit(self, HITId, NumberOfAdditionalAssignments,
+                                               UniqueRequestToken=None):
+        hit = self._get_hit_or_fail('CreateAdditionalAssignmentsForHIT', HITId)
+        hit['MaxAssignments'] += NumberOfAdditionalAssignments
+        hit['NumberOfAssignmentsAvailable'] += NumberOfAdditionalAssignments
+        self._refresh_hit_status(hit)
+        return {}
+
+    # ------------------------------------------------------------------
+    # Assignments
+
+    def _count_submitted(self, hit):
+        return (hit['MaxAssignments'] - hit['NumberOfAssignmentsAvailable']
+                - hit['NumberOfAssignmentsPending'] - hit['NumberOfAssignmentsCompleted'])
+
+    def _hit_assignment_ids(self, hit_id):
+        ids = []
+        synthetic = self._synthetic_hits.get(hit_id)
+        if synthetic is not None:
+            ids.extend(self._synthetic_assignment_id(synthetic.number, n)
+                       for n in range(synthetic.assignment_count))
+        ids.extend(self._hit_assignments.get(hit_id, []))
+        return ids
+
+    def _lookup_assignment(self, assignment_id):
+        assignment = self._assignments.get(assignment_id)
+        if assignment is None and assignment_id.startswith(SYNTHETIC_PREFIX):
+            assignment = self._synthetic_assignment(assignment_id)
+        return assignment
+
+    def _get_assignment_or_fail(self, operation, assignment_id):
+        assignment = self._lookup_assignment(assignment_id)
+        if assignment is None:
+            raise self._request_error(
+                operation, 'Assignment {} does not exist.'.format(assignment_id))
+        return assignment
+
+    def _list_assignments_for_hit(self, HITId, **kwargs):
+        self._get_hit_or_fail('ListAssignmentsForHIT', HITId)
+        statuses = kwargs.get('AssignmentStatuses')
+
+        def lookup(assignment_id):
+            assignment = self._lookup_assignment(assignment_id)
+            if statuses is not None and assignment['AssignmentStatus'] not in statuses:
+                return None
+            return dict(assignment)
+
+        return self._filtered_page(self._hit_assignment_ids(HITId), kwargs, 'Assignments', lookup)
+
+    def _get_assignment(self, AssignmentId):
+        assignment = self._get_assignment_or_fail('GetAssignment', AssignmentId)
+        hit = self._hits[assignment['HITId']]
+        self._refresh_hit_status(hit)
+        return {'Assignment': dict(assignment), 'HIT': dict(hit)}
+
+    def _store_assignment(self, assignment):
+        """
+        Keep a (possibly modified) assignment in memory
+        Synthetic assignments are only stored once they diverge from their generated state.
+        """
+        self._assignments[assignment['AssignmentId']] = assignment
+
+    def _review_assignment(self, operation, assignment_id, status, feedback=None,
+                           override_rejection=False):
+        assignment = dict(self._get_assignment_or_fail(operation, assignment_id))
+        current = assignment['AssignmentStatus']
+        allowed = current == 'Submitted' or (
+            current == 'Rejected' and status == 'Approved' and override_rejection)
+        if not allowed:
+            raise self._request_error(
+                operation, 'This operation can be called with a status of: Submitted')
+        hit = self._hits[assignment['HITId']]
+        if current == 'Submitted':
+            hit['NumberOfAssignmentsCompleted'] += 1
+        assignment['AssignmentStatus'] = status
+        time_field = 'ApprovalTime' if status == 'Approved' else 'RejectionTime'
+        assignment[time_field] = now_utc()
+        if feedback is not None:
+            assignment['RequesterFeedback'] = feedback
+        self._store_assignment(assignment)
+        self._refresh_hit_status(hit)
+        return {}
+
+    def _approve_assignment(self, AssignmentId, RequesterFeedback=None, OverrideRejection=False):
+        return self._review_assignment('ApproveAssignment', AssignmentId, 'Approved',
+                                       RequesterFeedback, OverrideRejection)
+
+    def _reject_assignment(self, AssignmentId, RequesterFeedback):
+        return self._review_assignment('RejectAssignment', AssignmentId, 'Rejected',
+                                       RequesterFeedback)
+
+    def accept(self, hit_id, worker_id=None):
+        """
+        Simulate a worker accepting an assignment of the given HIT
+        Returns the new AssignmentId.
+        """
+        with self._lock:
+            hit = self._get_hit_or_fail('Accept', hit_id)
+            if hit['HITStatus'] != 'Assignable':
+                raise self._request_error('Accept', 'HIT {} is not assignable.'.format(hit_id))
+            assignment = {
+                'AssignmentId': new_id('A'),
+                'WorkerId': worker_id or new_id('W')[:14],
+                'HITId': hit_id,
+                'AssignmentStatus': 'Accepted',
+                'AcceptTime': now_utc(),
+                'Deadline': now_utc() + datetime.timedelta(
+                    seconds=hit['AssignmentDurationInSeconds']),
+            }
+            self._assignments[assignment['AssignmentId']] = assignment
+            hit['NumberOfAssignmentsAvailable'] -= 1
+            hit['NumberOfAssignmentsPending'] += 1
+            self._refresh_hit_status(hit)
+            self._notify('AssignmentAccepted', hit, assignment['AssignmentId'])
+            return assignment['AssignmentId']
+
+    def submit(self, assignment_id, answers=None):
+        """
+        Simulate a worker submitting an accepted assignment
+        """
+        with self._lock:
+            assignment = self._assignments[assignment_id]
+            hit = self._hits[assignment['HITId']]
+            submit_time = now_utc()
+            assignment.update({
+                'AssignmentStatus': 'Submitted',
+                'SubmitTime': submit_time,
+                'AutoApprovalTime': submit_time + datetime.timedelta(
+                    seconds=hit['AutoApprovalDelayInSeconds']),
+                'Answer': answer_xml(answers or {}),
+            })
+            hit_assignments = self._hit_assignments.setdefault(hit['HITId'], [])
+            hit_assignments.append(assignment_id)
+            hit['NumberOfAssignmentsPending'] -= 1
+            self._refresh_hit_status(hit)
+            self._notify('AssignmentSubmitted', hit, assignment_id)
+            if hit['HITStatus'] == 'Reviewable':
+                self._notify('HITReviewable', hit)
+
+    def complete(self, hit_id, worker_id=None, answers=None):
+        """
+        Simulate a worker accepting and submitting an assignment in one step
+        """
+        assignment_id = self.accept(hit_id, worker_id)
+        self.submit(assignment_id, answers)
+        return assignment_id
+
+    # ------------------------------------------------------------------
+    # Bonuses and messages
+
+    def _send_bonus(self, WorkerId, BonusAmount, AssignmentId, Reason, UniqueRequestToken=None):
+        self._check_request_token('SendBonus', UniqueRequestToken)
+        assignment = self._get_assignment_or_fail('SendBonus', AssignmentId)
+        if assignment['WorkerId'] != WorkerId:
+            raise self._request_error('SendBonus', 'Worker does not match assignment.')
+        self._bonuses.append({
+            'WorkerId': WorkerId,
+            'BonusAmount': BonusAmount,
+            'AssignmentId': AssignmentId,
+            'Reason': Reason,
+            'GrantTime': now_utc(),
+        })
+        if UniqueRequestToken is not None:
+            self._request_tokens[UniqueRequestToken] = 'bonus for ' + AssignmentId
+        return {}
+
+    def _list_bonus_payments(self, HITId=None, AssignmentId=None, **kwargs):
+        if AssignmentId is not None:
+            bonuses = [bonus for bonus in self._bonuses if bonus['AssignmentId'] == AssignmentId]
+        else:
+            assignment_ids = set(self._hit_assignment_ids(HITId))
+            bonuses = [bonus for bonus in self._bonuses if bonus['AssignmentId'] in assignment_ids]
+        return self._page(bonuses, kwargs, 'BonusPayments')
+
+    def _notify_workers(self, Subject, MessageText, WorkerIds):
+        if len(WorkerIds) > 100:
+            raise self._request_error('NotifyWorkers', 'You can notify up to 100 workers at a time.')
+        return {'NotifyWorkersFailureStatuses': []}
+
+    def _get_account_balance(self):
+        return {'AvailableBalance': self.balance, 'OnHoldBalance': '0.00'}
+
+    def _update_notification_settings(self, HITTypeId, Notification=None, Active=True):
+        self._notification_settings[HITTypeId] = {
+            'Notification': Notification or {},
+            'Active': Active,
+        }
+        return {}
+
+    def _send_test_event_notification(self, Notification, TestEventType):
+        for listener in self._listeners:
+            listener({'Events': [{'EventType': TestEventType,
+                                  'EventTimestamp': now_utc().isoformat()}],
+                      'EventDocVersion': '2014-08-15'})
+        return {}
+
+    # ------------------------------------------------------------------
+    # Qualifications
+
+    def _create_qualification_type(self, Name, Description, QualificationTypeStatus='Active',
+                                   **kwargs):
+        for existing in self._qualification_types.values():
+            if existing['Name'] == Name:
+                raise self._request_error(
+                    'CreateQualificationType',
+                    'You have already created a QualificationType with this name.')
+        qualification_type = {
+            'QualificationTypeId': new_id('Q'),
+            'CreationTime': now_utc(),
+            'Name': Name,
+            'Description': Description,
+            'Keywords': kwargs.get('Keywords', ''),
+            'QualificationTypeStatus': QualificationTypeStatus,
+            'IsRequestable': False,
+            'AutoGranted': kwargs.get('AutoGranted', False),
+        }
+        self._qualification_types[qualification_type['QualificationTypeId']] = qualification_type
+        self._qualifications[qualification_type['QualificationTypeId']] = {}
+        return {'QualificationType': dict(qualification_type)}
+
+    def _get_qualification_type_or_fail(self, operation, qualification_type_id):
+        qualification_type = self._qualification_types.get(qualification_type_id)
+        if qualification_type is None:
+            raise self._request_error(
+                operation, 'QualificationType {} does not exist.'.format(qualification_type_id))
+        return qualification_type
+
+    def _get_qualification_type(self, QualificationTypeId):
+        return {'QualificationType': dict(self._get_qualification_type_or_fail(
+            'GetQualificationType', QualificationTypeId))}
+
+    def _list_qualification_types(self, MustBeRequestable, MustBeOwnedByCaller=True, **kwargs):
+        qualification_types = [dict(qualification_type) for qualification_type
+                               in self._qualification_types.values()]
+        return self._page(qualification_types, kwargs, 'QualificationTypes')
+
+    def _delete_qualification_type(self, QualificationTypeId):
+        self._get_qualification_type_or_fail('DeleteQualificationType', QualificationTypeId)
+        del self._qualification_types[QualificationTypeId]
+        del self._qualifications[QualificationTypeId]
+        return {}
+
+    def _associate_qualification_with_worker(self, QualificationTypeId, WorkerId,
+                                             IntegerValue=1, SendNotification=False):
+        self._get_qualification_type_or_fail('AssociateQualificationWithWorker',
+                                             QualificationTypeId)
+        self._qualifications[QualificationTypeId][WorkerId] = {
+            'QualificationTypeId': QualificationTypeId,
+            'WorkerId': WorkerId,
+            'GrantTime': now_utc(),
+            'IntegerValue': IntegerValue,
+            'Status': 'Granted',
+        }
+        return {}
+
+    def _disassociate_qualification_from_worker(self, WorkerId, QualificationTypeId, Reason=None):
+        self._get_qualification_type_or_fail('DisassociateQualificationFromWorker',
+                                             QualificationTypeId)
+        if self._qualifications[QualificationTypeId].pop(WorkerId, None) is None:
+            raise self._request_error('DisassociateQualificationFromWorker',
+                                      'Worker does not have this qualification.')
+        return {}
+
+    def _get_qualification_score(self, QualificationTypeId, WorkerId):
+        self._get_qualification_type_or_fail('GetQualificationScore', QualificationTypeId)
+        qualification = self._qualifications[QualificationTypeId].get(WorkerId)
+        if qualification is None:
+            raise self._request_error(
+                'GetQualificationScore',
+                'You requested a Qualification that does not exist.')
+        return {'Qualification': dict(qualification)}
+
+    def _list_workers_with_qualification_type(self, QualificationTypeId, Status='Granted',
+                                              **kwargs):
+        self._get_qualification_type_or_fail('ListWorkersWithQualificationType',
+                                             QualificationTypeId)
+        qualifications = [dict(qualification) for qualification
+                          in self._qualifications[QualificationTypeId].values()
+                          if qualification['Status'] == Status]
+        return self._page(qualifications, kwargs, 'Qualifications')
+
+    # ------------------------------------------------------------------
+    # Synthetic data
+
+    @staticmethod
+    def _synthetic_assignment_id(hit_number, n):
+        return '{}{:012d}{:015d}'.format(SYNTHETIC_PREFIX, hit_number, n)
+
+    @staticmethod
+    def _synthetic_hit_id(hit_number):
+        return '{}HIT{:024d}'.format(SYNTHETIC_PREFIX, hit_number)
+
+    @staticmethod
+    def _synthetic_worker_id(worker_number):
+        return 'SYNW{:010d}'.format(worker_number)
+
+    def _synthetic_key(self, hit_number, n):
+        return (self.config.seed * 1000003 + hit_number) * 1000003 + n
+
+    def _synthetic_random(self, hit_number, n):
+        return random.Random(self._synthetic_key(hit_number, n))
+
+    def _synthetic_status(self, hit_number, n):
+        """
+        Derive an assignment's generated status from a cheap integer hash
+        (seeding a Random per assignment is too slow for populating 10^6 of them)
+        """
+        # splitmix64 finalizer
+        z = (self._synthetic_key(hit_number, n) + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        draw = (z ^ (z >> 31)) / 2.0 ** 64
+        if draw < 0.7:
+            return 'Approved'
+        elif draw < 0.9:
+            return 'Submitted'
+        return 'Rejected'
+
+    def _synthetic_assignment(self, assignment_id):
+        hit_number = int(assignment_id[len(SYNTHETIC_PREFIX):len(SYNTHETIC_PREFIX) + 12])
+        n = int(assignment_id[len(SYNTHETIC_PREFIX) + 12:])
+        hit = self._hits.get(self._synthetic_hit_id(hit_number))
+        synthetic = self._synthetic_hits.get(self._synthetic_hit_id(hit_number))
+        if hit is None or synthetic is None or n >= synthetic.assignment_count:
+            return None
+
+        rng = self._synthetic_random(hit_number, n)
+        status = self._synthetic_status(hit_number, n)
+        worker_number = (synthetic.worker_offset + n) % self._synthetic_worker_count
+        accept_time = hit['CreationTime'] + datetime.timedelta(
+            seconds=rng.uniform(0, 0.5 * hit['AssignmentDurationInSeconds'] * 24))
+        submit_time = accept_time + datetime.timedelta(
+            seconds=rng.lognormvariate(6, 0.6))
+        answers = {
+            'completion_code': '{:08X}'.format(rng.getrandbits(32)),
+            'feedback': rng.choice(FEEDBACK_PHRASES),
+        }
+        assignment = {
+            'AssignmentId': assignment_id,
+            'WorkerId': self._synthetic_worker_id(worker_number),
+            'HITId': hit['HITId'],
+            'AssignmentStatus': status,
+            'AutoApprovalTime': submit_time + datetime.timedelta(
+                seconds=hit['AutoApprovalDelayInSeconds']),
+            'AcceptTime': accept_time,
+            'SubmitTime': submit_time,
+            'Deadline': accept_time + datetime.timedelta(
+                seconds=hit['AssignmentDurationInSeconds']),
+            'Answer': answer_xml(answers),
+        }
+        if status == 'Approved':
+            assignment['ApprovalTime'] = submit_time + datetime.timedelta(hours=1)
+        elif status == 'Rejected':
+            assignment['RejectionTime'] = submit_time + datetime.timedelta(hours=1)
+            assignment['RequesterFeedback'] = 'Incorrect completion code'
+        return assignment
+
+    def populate(self, hits=1000, assignments_per_hit=100, workers=None,
+                 hit_types=10, qualification_types=0, qualifications_per_type=1000,
+                 expired_fraction=0.8):
+        """
+        Generate a synthetic account
+
+        Assignments are derived deterministically from the seed when requested,
+        so even 10^6 of them use little memory until they are modified.
+        Returns the list of generated HITIds.
+        """
+        with self._lock:
+            if workers is None:
+                workers = max(assignments_per_hit * 2, hits * assignments_per_hit // 20, 1)
+            self._synthetic_worker_count = workers
+            rng = random.Random(self.config.seed)
+            types = [self._register_hit_type({
+                'Title': 'Synthetic task {}'.format(number),
+                'Description': 'A generated HIT type',
+                'Reward': '{:.2f}'.format(rng.choice([0.1, 0.25, 0.5, 1.0, 2.0])),
+                'AssignmentDurationInSeconds': 3600,
+                'Keywords': 'synthetic',
+            }) for number in range(hit_types)]
+
+            start = len(self._synthetic_hits)
+            now = now_utc()
+            hit_ids = []
+            for hit_number in range(start, start + hits):
+                expired = rng.random() < expired_fraction
+                creation_time = now - datetime.timedelta(
+                    days=rng.uniform(7, 60) if expired else rng.uniform(0, 2))
+                lifetime = (now - creation_time).total_seconds() + (
+                    -rng.uniform(3600, 86400) if expired else rng.uniform(3600, 7 * 86400))
+                hit = self._new_hit(rng.choice(types), assignments_per_hit, lifetime,
+                                    annotation=None, creation_time=creation_time,
+                                    hit_id=self._synthetic_hit_id(hit_number))
+                synthetic = _SyntheticHit(hit_number, assignments_per_hit,
+                                          rng.randrange(workers))
+                self._synthetic_hits[hit['HITId']] = synthetic
+
+                completed = 0
+                for n in range(assignments_per_hit):
+                    if self._synthetic_status(hit_number, n) != 'Submitted':
+                        completed += 1
+                hit['NumberOfAssignmentsAvailable'] = 0
+                hit['NumberOfAssignmentsCompleted'] = completed
+                self._refresh_hit_status(hit)
+                hit_ids.append(hit['HITId'])
+
+            for number in range(qualification_types):
+                response = self._create_qualification_type(
+                    Name='Synthetic qualification {}'.format(len(self._qualification_types)),
+                    Description='A generated qualification type')
+                type_id = response['QualificationType']['QualificationTypeId']
+                for worker_number in rng.sample(range(workers),
+                                                min(qualifications_per_type, workers)):
+                    worker_id = self._synthetic_worker_id(worker_number)
+                    self._qualifications[type_id][worker_id] = {
+                        'QualificationTypeId': type_id,
+                        'WorkerId': worker_id,
+                        'GrantTime': now - datetime.timedelta(days=rng.uniform(0, 60)),
+                        'IntegerValue': 1,
+                        'Status': 'Granted',
+                    }
+
+            LOGGER.info('generated %d synthetic HITs with %d assignments',
+                        hits, hits * assignments_per_hit)
+            return hit_ids
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client():
+    """
+    Return the process-wide fake client, creating it if necessary
+
+    All code that obtains a client through mturk.get_client while MTURK_FAKE
+    is set talks to this one backend, so their operations are visible to each other
+    (even if several threads ask for it at once).
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = FakeMTurkClient()
+        return _shared_client
@@ -4,6 +4,7 @@ MTurk utilities
 
 import argparse
 import logging
+import os
 
 import boto3
 
@@ -12,15 +13,36 @@ ENDPOINT_URL = 'https://mturk-requester{}.us-east-1.amazonaws.com'
 LOGGER = logging.getLogger(__name__)
 
 
-def get_client(sandbox=True):
+def use_fake():
+    """
+    Return true if the MTURK_FAKE environment variable asks for the in-process fake backend
+    """
+    return os.getenv('MTURK_FAKE', '').lower() == 'true'
+
+
+def get_client(sandbox=True, fake=None, profile=None):
     """
     Get the client that connects to the MTurk API. Uses the sandbox if the
     --debug flag was set.
+
+    profile names the AWS credentials to use (default: those of AWS_PROFILE).
+
+    If fake is true (or, when it isn't given, MTURK_FAKE=true is set),
+    returns the shared in-process fake backend instead (see mturk.fake).
     """
+    if fake is None:
+        fake = use_fake()
+    if fake:
+        from . import fake as fake_backend
+        LOGGER.info('using fake MTurk backend')
+        return fake_backend.get_shared_client()
+
     LOGGER.info(f"{'' if sandbox else 'NOT '}using MTurk sandbox")
 
     url = ENDPOINT_URL.format('-sandbox' if sandbox else '')
-    return boto3.client(
+    # A session of its own, since boto3's default session isn't safe to share between threads
+    session = boto3.session.Session(profile_name=profile)
+    return session.client(
         'mturk',
         endpoint_url=url,
         region_name='us-east-1',
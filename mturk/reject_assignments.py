@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import abc
-import logging
+import sys
 
 import mturk
 import mturk.logger as logger
@@ -22,7 +22,11 @@ class RejectAssignmentsScript(abc.ABC, mturk.MTurkScript):
         self.FEEDBACK = 'Sorry…'
     
     Then run this script, providing as an argument the name of a file with 
-    the assignmentIds to be rejected, one per line.
+    the assignmentIds to be rejected, one per line (or a SQL query against
+    the local database, see objective_turk.bulk).
+
+    Assignments the local database shows as rejected or approved already are skipped,
+    and the new status is saved to it.
     """
 
     @property
@@ -31,15 +35,13 @@ class RejectAssignmentsScript(abc.ABC, mturk.MTurkScript):
         ...
 
     def get_parser(self):
-        parser = super().get_parser()
-        parser.add_argument('--input-file', '-i',
-                            required=True, action='store')
-        return parser
+        # Imported here, because objective_turk itself imports this package
+        from objective_turk import bulk
+        return bulk.add_arguments(super().get_parser())
 
     def run(self):
-        with open(self.args.input_file) as assignment_file:
-            for line in assignment_file:
-                assignment_id = line.strip()
-                logging.info('rejecting assignment %s', assignment_id)
-                self.client.reject_assignment(AssignmentId=assignment_id,
-                                              RequesterFeedback=self.FEEDBACK)
+        from objective_turk import bulk, jobs
+        bulk.init_from_args(self.args)
+        result = jobs.run_from_args(self.args,
+                                    bulk.RejectAssignments(self.FEEDBACK))
+        sys.exit(bulk.report(result))
@@ -0,0 +1,241 @@
+"""
+Streaming set operations on large lists of IDs (or rows of several columns)
+
+Each input is sorted in bounded memory: records are collected in a buffer,
+which is sorted and spilled to a temporary file whenever it fills up,
+and the sorted files are then merged. The inputs' sorted streams are merged
+in turn to compute the result, which therefore comes out sorted, without
+duplicates, and the same on every run.
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import os
+import sys
+import tempfile
+
+DEFAULT_BUFFER_SIZE = 1000000
+
+OPERATIONS = ('union', 'intersect', 'subtract', 'dedupe')
+
+
+def read_lines(path, stdin=None):
+    """
+    Yield each line of the given file ('-' for stdin) as a one-column record
+    Blank lines are skipped.
+    """
+    if path == '-':
+        lines = stdin
+    else:
+        lines = open(path, newline='')
+    try:
+        for line in lines:
+            value = line.rstrip('\r\n')
+            if value:
+                yield (value,)
+    finally:
+        if path != '-':
+            lines.close()
+
+
+def read_csv(path, columns, stdin=None):
+    """
+    Yield the given columns of each row of the CSV file with a header ('-' for stdin)
+    """
+    csv_file = stdin if path == '-' else open(path, newline='')
+    try:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        try:
+            indexes = [header.index(column) for column in columns]
+        except ValueError as error:
+            raise ValueError('{}: {}'.format(path, error)) from None
+        for row in reader:
+            if row:
+                yield tuple(row[index] for index in indexes)
+    finally:
+        if path != '-':
+            csv_file.close()
+
+
+def read_query(cursor):
+    """
+    Yield the rows of an executed database query as records of strings
+    """
+    for row in cursor:
+        yield tuple('' if value is None else str(value) for value in row)
+
+
+def _spill(records, temp_dir):
+    spill_file = tempfile.NamedTemporaryFile(
+        'w+', newline='', dir=temp_dir, prefix='setops-', suffix='.csv', delete=False)
+    csv.writer(spill_file, lineterminator='\n').writerows(records)
+    spill_file.seek(0)
+    return spill_file
+
+
+def _unique(sorted_records):
+    for record, _ in itertools.groupby(sorted_records):
+        yield record
+
+
+def sorted_unique(records, buffer_size=DEFAULT_BUFFER_SIZE, temp_dir=None):
+    """
+    Yield the given records in sorted order, without duplicates,
+    holding at most buffer_size records in memory
+    """
+    runs = []
+    try:
+        buffer = []
+        for record in records:
+            buffer.append(record)
+            if len(buffer) >= buffer_size:
+                runs.append(_spill(_unique(sorted(buffer)), temp_dir))
+                buffer = []
+
+        if not runs:
+            yield from _unique(sorted(buffer))
+            return
+
+        if buffer:
+            runs.append(_spill(_unique(sorted(buffer)), temp_dir))
+        del buffer
+        readers = [(tuple(row) for row in csv.reader(run)) for run in runs]
+        yield from _unique(heapq.merge(*readers))
+    finally:
+        for run in runs:
+            run.close()
+            os.unlink(run.name)
+
+
+def _tag(records, index):
+    for record in records:
+        yield record, index
+
+
+def combine(operation, inputs, buffer_size=DEFAULT_BUFFER_SIZE, temp_dir=None):
+    """
+    Yield the sorted result of applying the set operation to the given inputs
+    (iterables of records, i.e., tuples of strings)
+
+    union (or dedupe): records in any input
+    intersect: records in every input
+    subtract: records in the first input, but none of the others
+
+    The buffer is shared between the inputs, so memory stays bounded
+    however many there are.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError('unknown operation {}'.format(operation))
+    if not inputs:
+        return
+
+    input_buffer = max(1, buffer_size // len(inputs))
+    streams = [_tag(sorted_unique(records, input_buffer, temp_dir), index)
+               for index, records in enumerate(inputs)]
+    for record, group in itertools.groupby(heapq.merge(*streams), key=lambda tagged: tagged[0]):
+        present = {index for _, index in group}
+        if operation == 'intersect':
+            keep = len(present) == len(inputs)
+        elif operation == 'subtract':
+            keep = present == {0}
+        else:
+            keep = True
+        if keep:
+            yield record
+
+
+def write_records(records, output):
+    """
+    Write records to the output, one per line (as CSV, if they have several columns)
+    Returns the number of records written.
+    """
+    writer = csv.writer(output, lineterminator='\n')
+    count = 0
+    for record in records:
+        if len(record) == 1:
+            output.write(record[0])
+            output.write('\n')
+        else:
+            writer.writerow(record)
+        count += 1
+    return count
+
+
+def open_input(spec, columns=None, stdin=None, run_query=None):
+    """
+    Return the records of an input given on the command line:
+    a file ('-' for stdin), read as CSV if columns are given,
+    or 'sql:' followed by a query, which run_query executes, returning a cursor
+    """
+    if spec.startswith('sql:'):
+        if run_query is None:
+            raise ValueError('SQL inputs are not supported here')
+        return read_query(run_query(spec[len('sql:'):]))
+    if columns:
+        return read_csv(spec, columns, stdin)
+    return read_lines(spec, stdin)
+
+
+def _query_local_database(args):
+    # Imported here, because objective_turk itself imports this package
+    import objective_turk
+
+    if objective_turk.get_current_environment() is None:
+        objective_turk.init(
+            objective_turk.Environment.production if args.production
+            else objective_turk.Environment.sandbox,
+            db_path=args.db_path, color_logs=False, create_database_if_missing=False)
+    return objective_turk.get_database().execute_sql
+
+
+def get_parser(description, operation=None):
+    """
+    Return the parser for the command-line arguments of a set operations script
+    (which takes the operation as its first argument, unless one is given)
+    """
+    parser = argparse.ArgumentParser(
+        description=description,
+        epilog="Inputs are files ('-' for stdin), or 'sql:' followed by a query "
+               'against the local objective_turk database. '
+               'Output is sorted and free of duplicates.')
+    if operation is None:
+        parser.add_argument('operation', choices=OPERATIONS)
+    parser.add_argument('inputs', nargs='+', metavar='input')
+    parser.add_argument('--column', '-c', action='append',
+                        help='Read files as CSV with a header, and use the given column. '
+                             '(Flag can be repeated, to compare rows of several columns)')
+    parser.add_argument('--output-file', '-o', action='store')
+    parser.add_argument('--buffer-size', type=int, default=DEFAULT_BUFFER_SIZE,
+                        help='Maximum number of records to hold in memory')
+    parser.add_argument('--temp-dir', action='store',
+                        help='Where to keep sorted records that spill from memory')
+    parser.add_argument('--db-path', action='store',
+                        help='Local database to use for sql: inputs '
+                             '(default: inferred from the environment)')
+    parser.add_argument('--production', action='store_true',
+                        help='For sql: inputs, use the production database')
+    return parser
+
+
+def main(description=__doc__, operation=None, argv=None):
+    """
+    Run a set operations script
+    """
+    args = get_parser(description, operation).parse_args(argv)
+    if operation is None:
+        operation = args.operation
+
+    run_query = None
+    if any(spec.startswith('sql:') for spec in args.inputs):
+        run_query = _query_local_database(args)
+    inputs = [open_input(spec, args.column, sys.stdin, run_query) for spec in args.inputs]
+    records = combine(operation, inputs, args.buffer_size, args.temp_dir)
+
+    if args.output_file is None:
+        write_records(records, sys.stdout)
+    else:
+        with open(args.output_file, 'w') as output_file:
+            write_records(records, output_file)
@@ -1,15 +1,24 @@
 from .objective_turk import (
     Environment,
+    IdentityMap,
+    Session,
+    current_session,
     get_current_environment,
     get_database,
     init,
     init_sandbox,
+    unit_of_work,
     create_db,
+    enable_feature,
     notify_workers,
     Worker,
     QualificationType,
     Qualification,
     Hit,
     Assignment,
+    BonusPayment,
 )
 from . import create_hit
+
+# Always loaded, so that the spending that budgets are checked against is kept up to date
+from . import ledger
@@ -0,0 +1,342 @@
+"""
+Move finished HITs out of the live database, into an archive database
+
+archive moves HITs that are completed (see Hit.completed) and were created longer
+ago than a given age, with their assignments (answers included), into a second
+SQLite file next to the live one (e.g., turk_production_archive.db), then
+compacts the live database, so daily scans and indexes only cover recent work.
+With compress, the archived details (where answers live) are stored zlib-compressed.
+
+Archived data can still be read, through the same models and queries:
+
+    with archive.including_archived():
+        Assignment.select().where(Assignment.worker == "A1B2C3")
+
+Inside the block, hit and assignment are read-only views over both databases.
+The ledger, worker statistics and answer fingerprints stay in the live database,
+so totals, statistics and duplicate checks still cover archived work; their rebuilds
+read archived HITs and assignments too (see including_archived_if_any).
+
+A HIT that is downloaded again (e.g., by Hit.download_all, while it's still on MTurk)
+returns to the live tables; the live copy is the one that's read, and the next
+archive run moves it back. Save hooks see the archived copy as the previous one,
+so the HIT and its assignments aren't counted again.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import typing
+import zlib
+
+import peewee
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "archive"
+
+DEFAULT_AGE = datetime.timedelta(days=30)
+
+# Stay well below SQLite's limit on the number of variables in a query
+CHUNK_SIZE = 500
+
+# SQL functions (de)compressing details
+COMPRESS = "objective_turk_compress"
+DECOMPRESS = "objective_turk_decompress"
+
+# Read-only connections to archives, by thread and path
+_readers = threading.local()
+
+
+class ArchiveResult(typing.NamedTuple):
+    hits: int
+    assignments: int
+    # Size of the live database file before and after compaction
+    bytes_before: int
+    bytes_after: int
+
+
+def _compress(details: typing.Optional[str]) -> typing.Optional[bytes]:
+    if details is None:
+        return None
+    return zlib.compress(details.encode(), 9)
+
+
+def _decompress(
+    details: typing.Union[bytes, str, None],
+) -> typing.Optional[str]:
+    # Details archived without compression are stored as they were
+    if isinstance(details, bytes):
+        return zlib.decompress(details).decode()
+    return details
+
+
+def _tables() -> typing.List[typing.Tuple[str, str]]:
+    # Each archived table, with the column its rows are selected by; HITs come first,
+    # since that's the order read-through views are created in
+    Hit = objective_turk.Hit
+    Assignment = objective_turk.Assignment
+    return [
+        (Hit._meta.table_name, Hit.id.column_name),
+        (Assignment._meta.table_name, Assignment.hit.column_name),
+    ]
+
+
+def _archived_models() -> typing.List[typing.Type[objective_turk.BaseModel]]:
+    return [objective_turk.Hit, objective_turk.Assignment]
+
+
+def default_path() -> pathlib.Path:
+    """
+    Return the archive file of the current database: alongside it, named <database>_archive.db
+    """
+    live = pathlib.Path(objective_turk.get_database().database)
+    return live.with_name(f"{live.stem}_archive{live.suffix}")
+
+
+def attach(path: typing.Union[str, pathlib.Path, None] = None) -> pathlib.Path:
+    """
+    Attach the archive (creating it if needed) to the current database as the "archive" schema,
+    returning its path
+    """
+    path = pathlib.Path(path) if path is not None else default_path()
+    database = objective_turk.get_database()
+    # pylint: disable=protected-access
+    if database._attached.get(SCHEMA) not in (None, str(path)):
+        database.detach(SCHEMA)
+    database.attach(str(path), SCHEMA)
+    database.register_function(_compress, COMPRESS, 1)
+    database.register_function(_decompress, DECOMPRESS, 1)
+    return path
+
+
+def _current_path() -> pathlib.Path:
+    # The archive attached to the current database, if any, or else the default one
+    # pylint: disable=protected-access
+    attached = objective_turk.get_database()._attached.get(SCHEMA)
+    return pathlib.Path(attached) if attached is not None else default_path()
+
+
+def _reader(path: pathlib.Path) -> sqlite3.Connection:
+    # Separate from the live connection, since the archive can't be attached
+    # while a transaction is open, as it is when hooks run
+    connections = getattr(_readers, "connections", None)
+    if connections is None:
+        connections = _readers.connections = {}
+    if str(path) not in connections:
+        connections[str(path)] = sqlite3.connect(f"{path.as_uri()}?mode=ro", uri=True)
+    return connections[str(path)]
+
+
+@objective_turk.register_previous_lookup
+def archived_details(
+    model: typing.Type[peewee.Model], primary_key: typing.Any
+) -> typing.Optional[typing.Dict]:
+    """
+    Return the archived details of the HIT or assignment with the given ID
+    (None if it isn't archived)
+    """
+    if model not in _archived_models():
+        return None
+    path = _current_path()
+    if not path.exists():
+        return None
+    table = model._meta.table_name
+    try:
+        row = (
+            _reader(path)
+            .execute(
+                f'SELECT "details" FROM "{table}" '
+                f'WHERE "{model._meta.primary_key.column_name}" = ?',
+                (primary_key,),
+            )
+            .fetchone()
+        )
+    except sqlite3.OperationalError:
+        return None  # nothing archived yet
+    return json.loads(_decompress(row[0])) if row is not None else None
+
+
+def _columns(database: peewee.Database, schema: str, table: str) -> typing.List[str]:
+    cursor = database.execute_sql(f'PRAGMA "{schema}".table_info("{table}")')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _prepare_tables(database: peewee.Database) -> None:
+    # Archive tables have the live tables' columns, without their constraints
+    # (their foreign keys point at tables that aren't in the archive).
+    # Columns added to the live tables since are added here too.
+    for table, key in _tables():
+        live = _columns(database, "main", table)
+        archived = _columns(database, SCHEMA, table)
+        if not archived:
+            logger.info("Creating archive table %s", table)
+            database.execute_sql(
+                f'CREATE TABLE "{SCHEMA}"."{table}" AS SELECT * FROM "main"."{table}" WHERE 0'
+            )
+            primary_key = database.get_primary_keys(table)[0]
+            database.execute_sql(
+                f'CREATE UNIQUE INDEX "{SCHEMA}"."{table}_{primary_key}" '
+                f'ON "{table}" ("{primary_key}")'
+            )
+            if key != primary_key:
+                database.execute_sql(
+                    f'CREATE INDEX "{SCHEMA}"."{table}_{key}" ON "{table}" ("{key}")'
+                )
+            continue
+        for column in live:
+            if column not in archived:
+                logger.info("Adding column %s to archive table %s", column, table)
+                database.execute_sql(
+                    f'ALTER TABLE "{SCHEMA}"."{table}" ADD COLUMN "{column}"'
+                )
+
+
+def candidates(older_than: datetime.timedelta = DEFAULT_AGE) -> typing.List[str]:
+    """
+    Return the IDs of the live HITs that are completed, and were created before the given age
+    """
+    Hit = objective_turk.Hit
+    cutoff = objective_turk.now_utc() - older_than
+    created = objective_turk.epoch_milliseconds(Hit.details["CreationTime"])
+    old_hits = Hit.select().where(created < int(cutoff.timestamp() * 1000))
+    return [hit.id for hit in old_hits.iterator() if hit.completed]
+
+
+def archive(
+    older_than: datetime.timedelta = DEFAULT_AGE,
+    compress: bool = False,
+    compact: bool = True,
+    path: typing.Union[str, pathlib.Path, None] = None,
+) -> ArchiveResult:
+    """
+    Move completed HITs created before the given age, with their assignments, to the archive,
+    then (if compact) vacuum the live database
+    """
+    database = objective_turk.get_database()
+    path = attach(path)
+    live_path = database.database
+    bytes_before = os.path.getsize(live_path)
+
+    hit_ids = candidates(older_than)
+    logger.info("Archiving %d HITs to %s", len(hit_ids), path)
+    moved = {table: 0 for table, _ in _tables()}
+    with database.atomic():
+        _prepare_tables(database)
+        for start in range(0, len(hit_ids), CHUNK_SIZE):
+            chunk = hit_ids[start : start + CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            for table, key in _tables():
+                columns = _columns(database, "main", table)
+                names = ", ".join(f'"{column}"' for column in columns)
+                values = ", ".join(
+                    (
+                        f'{COMPRESS}("{column}")'
+                        if compress and column == "details"
+                        else f'"{column}"'
+                    )
+                    for column in columns
+                )
+                where = f'WHERE "{key}" IN ({placeholders})'
+                database.execute_sql(
+                    f'INSERT OR REPLACE INTO "{SCHEMA}"."{table}" ({names}) '
+                    f'SELECT {values} FROM "main"."{table}" {where}',
+                    chunk,
+                )
+                moved[table] += database.execute_sql(
+                    f'SELECT COUNT(*) FROM "main"."{table}" {where}', chunk
+                ).fetchone()[0]
+            # Assignments first, since they refer to their HITs
+            for table, key in reversed(_tables()):
+                database.execute_sql(
+                    f'DELETE FROM "main"."{table}" WHERE "{key}" IN ({placeholders})',
+                    chunk,
+                )
+
+    if compact and hit_ids:
+        logger.info("Compacting %s", live_path)
+        database.execute_sql('VACUUM "main"')
+    hits, assignments = (moved[table] for table, _ in _tables())
+    result = ArchiveResult(hits, assignments, bytes_before, os.path.getsize(live_path))
+    logger.info("Archived %d HITs and %d assignments", hits, assignments)
+    return result
+
+
+@contextlib.contextmanager
+def including_archived(
+    path: typing.Union[str, pathlib.Path, None] = None,
+) -> typing.Iterator[None]:
+    """
+    Within the block, read HITs and assignments from both the live database and the archive
+
+    Temporary views over both shadow the live tables, for this thread's connection only,
+    so they can't be written to until the block exits.
+    """
+    database = objective_turk.get_database()
+    attach(path)
+    temporary = {
+        row[0]
+        for row in database.execute_sql(
+            "SELECT name FROM sqlite_temp_master WHERE type = 'view'"
+        ).fetchall()
+    }
+    created = []
+    try:
+        for table, _ in _tables():
+            if table in temporary:
+                # An enclosing block already made this view
+                continue
+            database.execute_sql(_view_sql(database, table))
+            created.append(table)
+        yield
+    finally:
+        for table in reversed(created):
+            database.execute_sql(f'DROP VIEW IF EXISTS "temp"."{table}"')
+
+
+@contextlib.contextmanager
+def including_archived_if_any(
+    path: typing.Union[str, pathlib.Path, None] = None,
+) -> typing.Iterator[bool]:
+    """
+    Within the block, read archived HITs and assignments too (as with including_archived),
+    if there is an archive; yields whether there is
+    """
+    path = pathlib.Path(path) if path is not None else _current_path()
+    if not path.exists():
+        yield False
+        return
+    with including_archived(path):
+        yield True
+
+
+def _view_sql(database: peewee.Database, table: str) -> str:
+    primary_key = database.get_primary_keys(table)[0]
+    live = _columns(database, "main", table)
+    archived = set(_columns(database, SCHEMA, table))
+    names = ", ".join(f'"{column}"' for column in live)
+    if not archived:
+        # Nothing archived yet
+        return f'CREATE TEMP VIEW "{table}" AS SELECT {names} FROM "main"."{table}"'
+
+    values = ", ".join(
+        (
+            f'{DECOMPRESS}("{column}") AS "{column}"'
+            if column == "details"
+            else f'"{column}"' if column in archived else f'NULL AS "{column}"'
+        )
+        for column in live
+    )
+    # The live copy of a HIT (or assignment) that was downloaded again wins
+    return (
+        f'CREATE TEMP VIEW "{table}" AS SELECT {names} FROM "main"."{table}" '
+        f'UNION ALL SELECT {values} FROM "{SCHEMA}"."{table}" '
+        f'WHERE "{primary_key}" NOT IN (SELECT "{primary_key}" FROM "main"."{table}")'
+    )
@@ -0,0 +1,1170 @@
+"""
+Bulk operations on many assignments or workers at once
+
+Each operation checks the local database first and skips items whose state
+already makes the call a no-op (e.g., approving an approved assignment).
+The remaining API calls are made concurrently, at a limited rate, and their
+results are written back to the database in batches.
+
+IDs can come from a file (or stdin), or from a SQL query against the local database;
+the helpers at the bottom of this module give scripts a common command line for that.
+"""
+
+import argparse
+import concurrent.futures
+import decimal
+import logging
+import re
+import sys
+import threading
+import time
+import typing
+import uuid
+
+import botocore.exceptions
+
+import mturk
+from objective_turk import ledger
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Stay well below SQLite's limit on the number of variables in a query
+IN_CHUNK_SIZE = 500
+
+DEFAULT_MAX_WORKERS = 8
+
+# UniqueRequestTokens can be at most 64 characters long
+MAX_TOKEN_LENGTH = 64
+
+Items = typing.Union[typing.Iterable[str], typing.Mapping[str, typing.Any]]
+
+
+class Throttle:
+    """
+    A token bucket, shared between threads, that limits calls to `rate` per second
+
+    Up to `burst` calls can be made at once after a quiet period.
+    """
+
+    def __init__(self, rate: float, burst: typing.Optional[int] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Wait until a call may be made
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class BulkResult:
+    """
+    What a bulk operation did, item by item
+
+    skipped and failed map each item to the reason or error.
+    """
+
+    def __init__(self):
+        self.succeeded: typing.List[str] = []
+        self.skipped: typing.Dict[str, str] = {}
+        self.failed: typing.Dict[str, str] = {}
+
+    def __repr__(self):
+        return (
+            f"<BulkResult {len(self.succeeded)} succeeded, "
+            f"{len(self.skipped)} skipped, {len(self.failed)} failed>"
+        )
+
+
+def _chunks(items: typing.List, size: int = IN_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def describe_error(error: Exception) -> str:
+    """
+    Return a one-line description of an API error
+    """
+    if isinstance(error, botocore.exceptions.ClientError):
+        details = error.response.get("Error", {})
+        return f"{details.get('Code')}: {details.get('Message')}"
+    return f"{type(error).__name__}: {error}"
+
+
+def _is_request_error(error: botocore.exceptions.ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") == "RequestError"
+
+
+def _is_duplicate_request(error: botocore.exceptions.ClientError) -> bool:
+    # MTurk refuses a request whose UniqueRequestToken was used before,
+    # which means the earlier request went through.
+    message = error.response.get("Error", {}).get("Message", "")
+    return _is_request_error(error) and (
+        "UniqueRequestToken" in message or "already exists" in message
+    )
+
+
+def request_token(prefix: str, item_id: str) -> str:
+    """
+    Return a UniqueRequestToken for the given item, so retrying it can't repeat its effect
+    """
+    return f"{prefix}-{item_id}"[:MAX_TOKEN_LENGTH]
+
+
+class Operation:
+    """
+    A bulk operation, applied to one item (an AssignmentId, WorkerId, etc.) at a time
+
+    Subclasses implement call, and usually no_ops and save. Items can carry a payload
+    with per-item arguments (e.g., each bonus's amount). Operations whose API call
+    takes several items at once set items_per_call, and implement call_batch instead.
+
+    Every subclass has a unique name, and returns the arguments needed to recreate it
+    from parameters, so that a journaled job (see objective_turk.jobs) can be resumed.
+    """
+
+    name = "operation"
+    items_per_call = 1
+    _registry: typing.Dict[str, typing.Type["Operation"]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Operation._registry[cls.name] = cls
+
+    @classmethod
+    def from_parameters(
+        cls, name: str, parameters: typing.Dict[str, typing.Any]
+    ) -> "Operation":
+        """
+        Recreate the operation with the given name and parameters
+        """
+        return cls._registry[name](**parameters)
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        """
+        Return the (JSON-serializable) arguments that recreate this operation
+        """
+        return {}
+
+    def prepare(self) -> None:
+        """
+        Do any setup needed before the first call (on the calling thread)
+        """
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        """
+        Return the items that the local database shows need no call, with the reason why
+        """
+        return {}
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Any:
+        """
+        Make the API call(s) for one item (on a worker thread), returning whatever save needs
+        """
+        raise NotImplementedError
+
+    def call_batch(
+        self, item_ids: typing.List[str], payloads: typing.List[typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Make the API call(s) for up to items_per_call items (on a worker thread),
+        returning, for each item, whatever save needs or the exception it failed with
+        """
+        outcomes = {}
+        for item_id, payload in zip(item_ids, payloads):
+            try:
+                outcomes[item_id] = self.call(item_id, payload)
+            except Exception as error:  # pylint: disable=broad-except
+                outcomes[item_id] = error
+        return outcomes
+
+    def save(self, item_id: str, outcome: typing.Any) -> None:
+        """
+        Record the result of a successful call in the local database (on the calling thread)
+        """
+
+    def cost(self, item_id: str, payload: typing.Any) -> decimal.Decimal:
+        """
+        Return what the call for one item will spend (including fees), to check against
+        a budget; raise ValueError if that can't be told
+        """
+        return decimal.Decimal(0)
+
+
+class ApproveAssignments(Operation):
+    """
+    Approve assignments
+
+    Rejected assignments are skipped, unless override_rejection is set.
+    """
+
+    name = "approve"
+
+    def __init__(
+        self, feedback: typing.Optional[str] = None, override_rejection: bool = False
+    ):
+        self.feedback = feedback
+        self.override_rejection = override_rejection
+        self._known: typing.Set[str] = set()
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "feedback": self.feedback,
+            "override_rejection": self.override_rejection,
+        }
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        Assignment = objective_turk.Assignment
+        skip = {}
+        for chunk in _chunks(item_ids):
+            for assignment_id, status in (
+                Assignment.select(Assignment.id, Assignment.AssignmentStatus)
+                .where(Assignment.id.in_(chunk))
+                .tuples()
+            ):
+                self._known.add(assignment_id)
+                if status == "Approved":
+                    skip[assignment_id] = "already approved"
+                elif status == "Rejected" and not self.override_rejection:
+                    skip[assignment_id] = "rejected (override_rejection not set)"
+        return skip
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Optional[typing.Dict]:
+        arguments: typing.Dict[str, typing.Any] = {"AssignmentId": item_id}
+        if self.feedback is not None:
+            arguments["RequesterFeedback"] = self.feedback
+        if self.override_rejection:
+            arguments["OverrideRejection"] = True
+        return _review(
+            objective_turk.client().approve_assignment,
+            arguments,
+            "Approved",
+            self._known,
+        )
+
+    def save(self, item_id: str, outcome: typing.Optional[typing.Dict]) -> None:
+        _save_assignment_status(
+            item_id, outcome, "Approved", "ApprovalTime", self.feedback
+        )
+
+
+class RejectAssignments(Operation):
+    """
+    Reject assignments with the given feedback
+
+    Assignments that are already rejected, or approved (which is final), are skipped.
+    """
+
+    name = "reject"
+
+    def __init__(self, feedback: str):
+        self.feedback = feedback
+        self._known: typing.Set[str] = set()
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {"feedback": self.feedback}
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        Assignment = objective_turk.Assignment
+        skip = {}
+        for chunk in _chunks(item_ids):
+            for assignment_id, status in (
+                Assignment.select(Assignment.id, Assignment.AssignmentStatus)
+                .where(Assignment.id.in_(chunk))
+                .tuples()
+            ):
+                self._known.add(assignment_id)
+                if status == "Rejected":
+                    skip[assignment_id] = "already rejected"
+                elif status == "Approved":
+                    skip[assignment_id] = "already approved"
+        return skip
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Optional[typing.Dict]:
+        return _review(
+            objective_turk.client().reject_assignment,
+            {"AssignmentId": item_id, "RequesterFeedback": self.feedback},
+            "Rejected",
+            self._known,
+        )
+
+    def save(self, item_id: str, outcome: typing.Optional[typing.Dict]) -> None:
+        _save_assignment_status(
+            item_id, outcome, "Rejected", "RejectionTime", self.feedback
+        )
+
+
+def _review(
+    action: typing.Callable,
+    arguments: typing.Dict[str, typing.Any],
+    status: str,
+    known: typing.Set[str],
+) -> typing.Optional[typing.Dict]:
+    assignment_id = arguments["AssignmentId"]
+    try:
+        action(**arguments)
+    except botocore.exceptions.ClientError as error:
+        if not _is_request_error(error):
+            raise
+        # If an earlier, interrupted run already got this far, there's nothing left to do.
+        try:
+            response = objective_turk.client().get_assignment(
+                AssignmentId=assignment_id
+            )
+        except botocore.exceptions.ClientError:
+            raise error from None
+        if response["Assignment"]["AssignmentStatus"] != status:
+            raise
+        return response
+
+    # Assignments we already have are updated in place; others (and their HIT) are fetched,
+    # since GetAssignment returns both.
+    if assignment_id in known:
+        return None
+    return objective_turk.client().get_assignment(AssignmentId=assignment_id)
+
+
+def _save_assignment_status(
+    assignment_id: str,
+    response: typing.Optional[typing.Dict],
+    status: str,
+    time_field: str,
+    feedback: typing.Optional[str],
+) -> None:
+    # pylint: disable=protected-access
+    if response is not None:
+        hit = objective_turk.Hit._new_from_response(response["HIT"])
+        objective_turk.Assignment._new_from_response(response["Assignment"], hit)
+        return
+
+    assignment = objective_turk.Assignment.get_by_id(assignment_id)
+    details = dict(assignment.details, AssignmentStatus=status)
+    details[time_field] = objective_turk.now_utc()
+    if feedback is not None:
+        details["RequesterFeedback"] = feedback
+    # Saved like a response, so save hooks see the change
+    objective_turk.Assignment._new_from_response(details, assignment.hit)
+
+
+class GrantQualification(Operation):
+    """
+    Grant a qualification (with the given value) to workers
+
+    Workers who already hold it with that value are skipped.
+    """
+
+    name = "grant"
+
+    def __init__(
+        self, qualification_type_id: str, value: int = 1, notify: bool = False
+    ):
+        self.qualification_type_id = qualification_type_id
+        self.value = value
+        self.notify = notify
+        self.qualification_type: typing.Optional[objective_turk.QualificationType] = (
+            None
+        )
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "qualification_type_id": self.qualification_type_id,
+            "value": self.value,
+            "notify": self.notify,
+        }
+
+    def prepare(self) -> None:
+        self.qualification_type = _local_qualification_type(self.qualification_type_id)
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        Qualification = objective_turk.Qualification
+        skip = {}
+        for chunk in _chunks(item_ids):
+            for worker_id, details in (
+                Qualification.select(Qualification.worker, Qualification.details)
+                .where(
+                    (Qualification.qualification_type == self.qualification_type_id)
+                    & (Qualification.worker.in_(chunk))
+                    & (Qualification.Status == "Granted")
+                )
+                .tuples()
+            ):
+                if details.get("IntegerValue") == self.value:
+                    skip[worker_id] = "already granted"
+        return skip
+
+    def call(self, item_id: str, payload: typing.Any) -> None:
+        objective_turk.client().associate_qualification_with_worker(
+            QualificationTypeId=self.qualification_type_id,
+            WorkerId=item_id,
+            IntegerValue=self.value,
+            SendNotification=self.notify,
+        )
+
+    def save(self, item_id: str, outcome: None) -> None:
+        objective_turk.Qualification.new_from_response(
+            {
+                "QualificationTypeId": self.qualification_type_id,
+                "WorkerId": item_id,
+                "GrantTime": objective_turk.now_utc(),
+                "IntegerValue": self.value,
+                "Status": "Granted",
+            },
+            self.qualification_type,
+        )
+
+
+class RevokeQualification(Operation):
+    """
+    Revoke a qualification from workers
+
+    Workers whose qualification is known to be revoked already are skipped.
+    (A worker missing from the local database may still hold the qualification,
+    so they are not skipped.)
+    """
+
+    name = "revoke"
+
+    def __init__(self, qualification_type_id: str, reason: typing.Optional[str] = None):
+        self.qualification_type_id = qualification_type_id
+        self.reason = reason
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "qualification_type_id": self.qualification_type_id,
+            "reason": self.reason,
+        }
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        Qualification = objective_turk.Qualification
+        skip = {}
+        for chunk in _chunks(item_ids):
+            for (worker_id,) in (
+                Qualification.select(Qualification.worker)
+                .where(
+                    (Qualification.qualification_type == self.qualification_type_id)
+                    & (Qualification.worker.in_(chunk))
+                    & (Qualification.Status == "Revoked")
+                )
+                .tuples()
+            ):
+                skip[worker_id] = "already revoked"
+        return skip
+
+    def call(self, item_id: str, payload: typing.Any) -> None:
+        arguments = {
+            "QualificationTypeId": self.qualification_type_id,
+            "WorkerId": item_id,
+        }
+        if self.reason is not None:
+            arguments["Reason"] = self.reason
+        objective_turk.client().disassociate_qualification_from_worker(**arguments)
+
+    def save(self, item_id: str, outcome: None) -> None:
+        Qualification = objective_turk.Qualification
+        qualification = Qualification.get_or_none(
+            (Qualification.qualification_type == self.qualification_type_id)
+            & (Qualification.worker == item_id)
+        )
+        if qualification is None:
+            return
+        # Saved like a response, so save hooks see the change
+        Qualification.new_from_response(
+            dict(qualification.details, Status="Revoked"),
+            qualification.qualification_type,
+        )
+
+
+class SendBonus(Operation):
+    """
+    Pay bonuses for assignments
+
+    Each item is an AssignmentId, and its payload can give the "amount" and "reason"
+    of its bonus (defaulting to the ones given here). Every bonus is sent with
+    a UniqueRequestToken derived from token_prefix, so a bonus is never paid twice,
+    even if a job is interrupted and resumed.
+    """
+
+    name = "bonus"
+
+    def __init__(
+        self,
+        amount: typing.Optional[str] = None,
+        reason: typing.Optional[str] = None,
+        token_prefix: typing.Optional[str] = None,
+    ):
+        self.amount = amount
+        self.reason = reason
+        self.token_prefix = (
+            token_prefix if token_prefix is not None else uuid.uuid4().hex[:16]
+        )
+        self._workers: typing.Dict[str, str] = {}
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "amount": self.amount,
+            "reason": self.reason,
+            "token_prefix": self.token_prefix,
+        }
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        # Nothing is skipped, but this is where we look up who to pay for each assignment
+        Assignment = objective_turk.Assignment
+        for chunk in _chunks(item_ids):
+            self._workers.update(
+                Assignment.select(Assignment.id, Assignment.worker)
+                .where(Assignment.id.in_(chunk))
+                .tuples()
+            )
+        return {}
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Dict[str, str]:
+        payload = payload or {}
+        amount = payload.get("amount", self.amount)
+        reason = payload.get("reason", self.reason)
+        if amount is None or reason is None:
+            raise ValueError(f"no bonus amount or reason given for {item_id}")
+
+        worker_id = self._workers.get(item_id)
+        if worker_id is None:
+            response = objective_turk.client().get_assignment(AssignmentId=item_id)
+            worker_id = response["Assignment"]["WorkerId"]
+
+        try:
+            objective_turk.client().send_bonus(
+                WorkerId=worker_id,
+                BonusAmount=amount,
+                AssignmentId=item_id,
+                Reason=reason,
+                UniqueRequestToken=request_token(self.token_prefix, item_id),
+            )
+        except botocore.exceptions.ClientError as error:
+            if not _is_duplicate_request(error):
+                raise
+            logger.info("Bonus for %s was already sent", item_id)
+        return {
+            "WorkerId": worker_id,
+            "BonusAmount": amount,
+            "AssignmentId": item_id,
+            "Reason": reason,
+            "GrantTime": objective_turk.now_utc(),
+            "UniqueRequestToken": request_token(self.token_prefix, item_id),
+        }
+
+    def save(self, item_id: str, outcome: typing.Dict) -> None:
+        # pylint: disable=protected-access
+        objective_turk.BonusPayment._new_from_response(outcome)
+
+    def cost(self, item_id: str, payload: typing.Any) -> decimal.Decimal:
+        amount = (payload or {}).get("amount", self.amount)
+        if amount is None:
+            raise ValueError(f"no bonus amount given for {item_id}")
+        return decimal.Decimal(str(amount)) + ledger.bonus_fee(amount)
+
+
+class NotificationFailed(Exception):
+    """
+    MTurk accepted a NotifyWorkers request, but couldn't notify the worker
+    """
+
+
+# Errors an item is expected to fail with: ones Operation.call raises for an item
+# it can't be applied to, and going over budget
+EXPECTED_ERRORS = (
+    botocore.exceptions.ClientError,
+    botocore.exceptions.BotoCoreError,
+    NotificationFailed,
+    ValueError,
+    ledger.BudgetExceeded,
+)
+
+
+class PartialFailure(Exception):
+    """
+    An Operation.call failed after some of its API calls took effect:
+    outcome (what took effect) is saved all the same, and the item fails with cause
+    """
+
+    def __init__(self, outcome: typing.Any, cause: Exception):
+        super().__init__(str(cause))
+        self.outcome = outcome
+        self.cause = cause
+
+
+class NotifyWorkers(Operation):
+    """
+    Send a message to workers, up to 100 per call (the most NotifyWorkers takes)
+    """
+
+    name = "notify"
+    items_per_call = 100
+
+    def __init__(self, subject: str, message: str):
+        self.subject = subject
+        self.message = message
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {"subject": self.subject, "message": self.message}
+
+    def call(self, item_id: str, payload: typing.Any) -> None:
+        outcome = self.call_batch([item_id], [payload])[item_id]
+        if isinstance(outcome, Exception):
+            raise outcome
+
+    def call_batch(
+        self, item_ids: typing.List[str], payloads: typing.List[typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        response = objective_turk.client().notify_workers(
+            Subject=self.subject, MessageText=self.message, WorkerIds=list(item_ids)
+        )
+        outcomes: typing.Dict[str, typing.Any] = dict.fromkeys(item_ids)
+        for failure in response.get("NotifyWorkersFailureStatuses", []):
+            outcomes[failure["WorkerId"]] = NotificationFailed(
+                failure.get("NotifyWorkersFailureMessage", "")
+            )
+        return outcomes
+
+
+class CreateHits(Operation):
+    """
+    Create HITs
+
+    Each item is a key of the caller's choosing (e.g., a row number or stimulus ID),
+    and its payload gives the arguments for CreateHIT (or, if it includes a HITTypeId,
+    CreateHITWithHITType). HITs are tagged with the project, if one is given
+    (see create_hit.tag_project), and created with a UniqueRequestToken,
+    so resuming an interrupted job can't create a HIT twice.
+    """
+
+    name = "create_hit"
+
+    def __init__(
+        self,
+        project: typing.Optional[str] = None,
+        token_prefix: typing.Optional[str] = None,
+    ):
+        self.project = project
+        self.token_prefix = (
+            token_prefix if token_prefix is not None else uuid.uuid4().hex[:16]
+        )
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {"project": self.project, "token_prefix": self.token_prefix}
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Dict:
+        # Imported here, because create_hit is loaded after this module
+        from objective_turk import create_hit
+
+        arguments = create_hit.tag_project(dict(payload), self.project)
+        arguments["UniqueRequestToken"] = request_token(self.token_prefix, item_id)
+        client = objective_turk.client()
+        action = (
+            client.create_hit_with_hit_type
+            if "HITTypeId" in arguments
+            else client.create_hit
+        )
+        try:
+            return action(**arguments)["HIT"]
+        except botocore.exceptions.ClientError as error:
+            if not _is_duplicate_request(error):
+                raise
+            # The HIT was created by an earlier, interrupted run; the error names it.
+            match = re.search(r"\b[A-Z0-9]{30}\b", error.response["Error"]["Message"])
+            if match is None:
+                raise
+            return client.get_hit(HITId=match.group(0))["HIT"]
+
+    def save(self, item_id: str, outcome: typing.Dict) -> None:
+        # pylint: disable=protected-access
+        objective_turk.Hit._new_from_response(outcome)
+
+    def cost(self, item_id: str, payload: typing.Any) -> decimal.Decimal:
+        reward = payload.get("Reward")
+        requirements = payload.get("QualificationRequirements")
+        if "HITTypeId" in payload:
+            # The reward and qualifications are the HIT type's, so look for a HIT we have of that type
+            Hit = objective_turk.Hit
+            details = (
+                Hit.select(Hit.details)
+                .where(Hit.hit_type == payload["HITTypeId"])
+                .scalar()
+            )
+            if details is None:
+                raise ValueError(
+                    f"can't tell the cost of {item_id}: no local HIT of type "
+                    f"{payload['HITTypeId']}"
+                )
+            reward = details["Reward"]
+            requirements = details.get("QualificationRequirements")
+        if reward is None:
+            raise ValueError(f"no Reward given for {item_id}")
+        rewards, fees = ledger.hit_cost(
+            reward, int(payload.get("MaxAssignments", 1)), requirements
+        )
+        return rewards + fees
+
+
+class TeardownHits(Operation):
+    """
+    Take HITs down for good: expire them, approve their submitted assignments (if approve
+    is set), and delete them, then mark them deleted in the local database
+
+    HITs the local database shows as deleted are skipped, and ones it shows as expired
+    aren't expired again. A HIT can't be deleted while workers are still on it, or
+    (without approve) while it has assignments waiting for review; those HITs fail,
+    and can be retried later (e.g., with jobs.retry_failed). Their new expiration,
+    and any approvals, are saved all the same.
+    """
+
+    name = "teardown"
+
+    def __init__(self, approve: bool = False, feedback: typing.Optional[str] = None):
+        self.approve = approve
+        self.feedback = feedback
+        self._expired: typing.Set[str] = set()
+
+    def parameters(self) -> typing.Dict[str, typing.Any]:
+        return {"approve": self.approve, "feedback": self.feedback}
+
+    def no_ops(self, item_ids: typing.List[str]) -> typing.Dict[str, str]:
+        Hit = objective_turk.Hit
+        skip = {}
+        for chunk in _chunks(item_ids):
+            for hit in Hit.select(Hit.id, Hit.details).where(Hit.id.in_(chunk)):
+                if hit.deleted:
+                    skip[hit.id] = "already deleted"
+                elif hit.expired:
+                    self._expired.add(hit.id)
+        return skip
+
+    def call(self, item_id: str, payload: typing.Any) -> typing.Dict[str, typing.Any]:
+        client = objective_turk.client()
+        outcome: typing.Dict[str, typing.Any] = {
+            "expired_at": None,
+            "approved": [],
+            "deleted": True,
+        }
+        try:
+            if item_id not in self._expired:
+                expire_at = objective_turk.now_utc()
+                client.update_expiration_for_hit(HITId=item_id, ExpireAt=expire_at)
+                outcome["expired_at"] = expire_at
+            if self.approve:
+                self._approve_submitted(client, item_id, outcome["approved"])
+            client.delete_hit(HITId=item_id)
+        except botocore.exceptions.ClientError as error:
+            # If an earlier, interrupted run already deleted it, there's nothing left to do.
+            if _is_request_error(error) and _hit_deleted(client, item_id):
+                return outcome
+            if outcome["expired_at"] is None and not outcome["approved"]:
+                raise
+            outcome["deleted"] = False
+            raise PartialFailure(outcome, error) from error
+        return outcome
+
+    def _approve_submitted(
+        self, client, hit_id: str, approved: typing.List[typing.Dict]
+    ) -> None:
+        # Approved assignments are added to approved as they go, so they're saved
+        # even if a later call fails
+        submitted = list(
+            mturk.get_pages(
+                client.list_assignments_for_hit,
+                "Assignments",
+                HITId=hit_id,
+                AssignmentStatuses=["Submitted"],
+            )
+        )
+        for assignment in submitted:
+            arguments = {"AssignmentId": assignment["AssignmentId"]}
+            if self.feedback is not None:
+                arguments["RequesterFeedback"] = self.feedback
+            # Listed already, so there's no need to fetch them again afterwards
+            _review(
+                client.approve_assignment,
+                arguments,
+                "Approved",
+                {assignment["AssignmentId"]},
+            )
+            approved.append(assignment)
+
+    def save(self, item_id: str, outcome: typing.Dict[str, typing.Any]) -> None:
+        # pylint: disable=protected-access
+        Hit = objective_turk.Hit
+        hit = Hit.get_or_none(Hit.id == item_id)
+        if hit is None:
+            logger.debug("Not saving %s: it isn't in the local database", item_id)
+            return
+        for assignment in outcome["approved"]:
+            details = dict(assignment, AssignmentStatus="Approved")
+            details["ApprovalTime"] = objective_turk.now_utc()
+            if self.feedback is not None:
+                details["RequesterFeedback"] = self.feedback
+            objective_turk.Assignment._new_from_response(details, hit)
+        # Saved like a response, so save hooks see the change
+        details = dict(hit.details)
+        if outcome["deleted"]:
+            details["HITStatus"] = objective_turk.DELETED_HIT_STATUS
+        if outcome["expired_at"] is not None:
+            details["Expiration"] = outcome["expired_at"]
+        Hit._new_from_response(details)
+
+
+def _hit_deleted(client, hit_id: str) -> bool:
+    try:
+        response = client.get_hit(HITId=hit_id)
+    except botocore.exceptions.ClientError as error:
+        return _is_request_error(error)
+    return response["HIT"]["HITStatus"] == objective_turk.DELETED_HIT_STATUS
+
+
+def _local_qualification_type(
+    qualification_type_id: str,
+) -> objective_turk.QualificationType:
+    QualificationType = objective_turk.QualificationType
+    qualification_type = QualificationType.get_or_none(
+        QualificationType.id == qualification_type_id
+    )
+    if qualification_type is None:
+        response = objective_turk.client().get_qualification_type(
+            QualificationTypeId=qualification_type_id
+        )
+        # pylint: disable=protected-access
+        QualificationType._new_from_response(response["QualificationType"])
+        qualification_type = QualificationType.get_by_id(qualification_type_id)
+    return qualification_type
+
+
+def unique(item_ids: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Return the given IDs without blanks, surrounding whitespace or repeats, in their original order
+    """
+    return list(dict.fromkeys(item.strip() for item in item_ids if item.strip()))
+
+
+def with_payloads(items: Items) -> typing.Dict[str, typing.Any]:
+    """
+    Return the given items as a dictionary of item IDs to payloads
+    (None, for items given as a plain list of IDs)
+    """
+    if isinstance(items, typing.Mapping):
+        return dict(items)
+    return dict.fromkeys(unique(items))
+
+
+# Called as on_item(item_id, status, detail) for every item that a run finishes with;
+# status is "succeeded", "skipped" or "failed", and detail is the reason or error.
+ItemCallback = typing.Callable[[str, str, typing.Optional[str]], None]
+
+
+def run(
+    operation: Operation,
+    items: Items,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    rate: typing.Optional[float] = None,
+    batch_size: int = 100,
+    on_item: typing.Optional[ItemCallback] = None,
+    budget: typing.Optional[ledger.Budget] = None,
+) -> BulkResult:
+    """
+    Apply the operation to every item (a list of IDs, or a dictionary of IDs to payloads),
+    skipping no-ops
+
+    Calls are made by max_workers threads, at most `rate` per second (if given),
+    each for up to operation.items_per_call items.
+    Results are saved on the calling thread, batch_size at a time, as they come in.
+    A failed call, whatever the error, is recorded in the result rather than stopping
+    the run (after saving what took effect, if it raised PartialFailure).
+    If the run is stopped anyway (e.g., by KeyboardInterrupt or a failed save),
+    calls that haven't started are cancelled, and the results of ones that have
+    are saved before it stops.
+    If given, on_item is called for each finished item, in the same transaction
+    as its result is saved.
+
+    With a budget, items are run batch_size at a time, and before each batch,
+    the ledger (which includes everything saved so far) is checked for what's left:
+    the run stops at the first item that would exceed it, and that item and the rest
+    fail as over budget (so a journaled job can be resumed with a larger budget).
+    """
+    result = BulkResult()
+    payloads = with_payloads(items)
+    item_ids = list(payloads)
+    database = objective_turk.get_database()
+    result.skipped = operation.no_ops(item_ids)
+    if on_item is not None:
+        with database.atomic():
+            for item_id, reason in result.skipped.items():
+                on_item(item_id, "skipped", reason)
+    todo = [item for item in item_ids if item not in result.skipped]
+    logger.info(
+        "Running %s on %d items (%d skipped as no-ops)",
+        operation.name,
+        len(todo),
+        len(result.skipped),
+    )
+    if not todo:
+        return result
+
+    objective_turk.production_confirmation()
+    operation.prepare()
+    throttle = Throttle(rate) if rate is not None else None
+
+    # Calls run on other threads, so they need to be told which session to use
+    session = objective_turk.current_session()
+
+    def call(item_ids):
+        if throttle is not None:
+            throttle.acquire()
+        with session.activate():
+            return operation.call_batch(
+                item_ids, [payloads[item_id] for item_id in item_ids]
+            )
+
+    started = time.monotonic()
+    pending: typing.List[typing.Tuple[str, typing.Any]] = []
+
+    def flush():
+        with database.atomic():
+            for item_id, outcome in pending:
+                operation.save(item_id, outcome)
+                if on_item is not None:
+                    on_item(item_id, "succeeded", None)
+        result.succeeded.extend(item_id for item_id, _ in pending)
+        pending.clear()
+
+    def fail(item_id, error):
+        result.failed[item_id] = describe_error(error)
+        logger.error(
+            "Failed to %s %s: %s",
+            operation.name,
+            item_id,
+            error,
+            # An error calls aren't expected to raise is likely a bug, so show where
+            exc_info=None if isinstance(error, EXPECTED_ERRORS) else error,
+        )
+        if on_item is not None:
+            on_item(item_id, "failed", result.failed[item_id])
+
+    # The current batch's calls whose results haven't been collected yet, with their items
+    futures: typing.Dict[concurrent.futures.Future, typing.List[str]] = {}
+
+    def collect(future):
+        item_ids = futures.pop(future)
+        try:
+            outcomes = future.result()
+        except Exception as error:  # pylint: disable=broad-except
+            outcomes = dict.fromkeys(item_ids, error)
+        for item_id in item_ids:
+            outcome = outcomes[item_id]
+            if isinstance(outcome, PartialFailure):
+                with database.atomic():
+                    operation.save(item_id, outcome.outcome)
+                    fail(item_id, outcome.cause)
+            elif isinstance(outcome, Exception):
+                fail(item_id, outcome)
+            else:
+                pending.append((item_id, outcome))
+
+    # Without a budget, every call is submitted at once
+    batches = [todo] if budget is None else list(_chunks(todo, batch_size))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for number, batch in enumerate(batches):
+                if budget is not None:
+                    batch, over = _within_budget(
+                        operation, batch, payloads, budget, fail
+                    )
+                    if over:
+                        over.extend(
+                            item_id
+                            for later in batches[number + 1 :]
+                            for item_id in later
+                        )
+                        with database.atomic():
+                            for item_id in over:
+                                fail(item_id, ledger.BudgetExceeded(f"over {budget}"))
+                futures.update(
+                    (executor.submit(call, item_ids), item_ids)
+                    for item_ids in _chunks(batch, operation.items_per_call)
+                )
+                for future in concurrent.futures.as_completed(list(futures)):
+                    collect(future)
+                    if len(pending) >= batch_size:
+                        flush()
+                # So the ledger includes this batch before the next is checked
+                flush()
+                if budget is not None and over:
+                    logger.error(
+                        "Stopped %s: %d items would exceed %s",
+                        operation.name,
+                        len(over),
+                        budget,
+                    )
+                    break
+        finally:
+            # Stopped early: calls that haven't started are left for a later run,
+            # but ones that have may have taken effect, so their results are saved
+            for future in [future for future in futures if future.cancel()]:
+                del futures[future]
+            if futures:
+                logger.warning(
+                    "Stopping %s: saving the results of %d calls already started",
+                    operation.name,
+                    len(futures),
+                )
+            for future in concurrent.futures.as_completed(list(futures)):
+                collect(future)
+            flush()
+
+    logger.info(
+        "Finished %s in %.1fs: %s", operation.name, time.monotonic() - started, result
+    )
+    return result
+
+
+def _within_budget(
+    operation: Operation,
+    batch: typing.List[str],
+    payloads: typing.Dict[str, typing.Any],
+    budget: ledger.Budget,
+    fail: typing.Callable[[str, Exception], None],
+) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """
+    Split the batch into the items that fit in what's left of the budget, in order,
+    and the rest (from the first item that doesn't fit)
+    """
+    remaining = budget.remaining()
+    admitted = []
+    for index, item_id in enumerate(batch):
+        try:
+            cost = operation.cost(item_id, payloads[item_id])
+        except ValueError as error:
+            fail(item_id, error)
+            continue
+        if cost > remaining:
+            return admitted, batch[index:]
+        remaining -= cost
+        admitted.append(item_id)
+    return admitted, []
+
+
+def ids_from_file(path: str) -> typing.List[str]:
+    """
+    Read IDs, one per line, from the given file ("-" for stdin)
+    """
+    if path == "-":
+        return unique(sys.stdin)
+    with open(path) as id_file:
+        return unique(id_file)
+
+
+def ids_from_query(sql: str, params: typing.Sequence = ()) -> typing.List[str]:
+    """
+    Return the first column of a SQL query against the local database, as IDs
+
+    For example: SELECT AssignmentId FROM assignment WHERE AssignmentStatus = 'Submitted'
+    """
+    cursor = objective_turk.get_database().execute_sql(sql, params)
+    return unique(str(row[0]) for row in cursor.fetchall())
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """
+    Add the common command-line arguments of bulk scripts to the given parser
+    """
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--input-file",
+        "-i",
+        action="store",
+        help='File with one ID per line ("-" for stdin)',
+    )
+    source.add_argument(
+        "--sql",
+        action="store",
+        help="SQL query against the local database whose first column gives the IDs",
+    )
+    source.add_argument(
+        "--resume",
+        type=int,
+        metavar="JOB_ID",
+        help="Continue an interrupted job (see objective_turk.jobs)",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="With --resume, also retry the items that failed",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of concurrent API calls",
+    )
+    parser.add_argument(
+        "--rate", type=float, help="Maximum number of API calls per second"
+    )
+    parser.add_argument(
+        "--db-path",
+        action="store",
+        help="Local database to use (default: inferred from the environment)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=decimal.Decimal,
+        metavar="DOLLARS",
+        help="Stop before total spending (as recorded in the local ledger) would exceed this",
+    )
+    return parser
+
+
+def init_from_args(args: argparse.Namespace) -> None:
+    """
+    Initialize objective_turk according to the common command-line arguments
+    """
+    objective_turk.init(
+        (
+            objective_turk.Environment.production
+            if args.production
+            else objective_turk.Environment.sandbox
+        ),
+        db_path=args.db_path,
+        color_logs=False,
+    )
+
+
+def ids_from_args(args: argparse.Namespace) -> typing.List[str]:
+    """
+    Return the IDs selected by the common command-line arguments
+    """
+    if args.sql is not None:
+        return ids_from_query(args.sql)
+    return ids_from_file(args.input_file)
+
+
+def report(result: BulkResult) -> int:
+    """
+    Log a summary of the result, and return the exit status for a script
+    """
+    for item_id, reason in result.skipped.items():
+        logger.debug("Skipped %s: %s", item_id, reason)
+    for item_id, error in result.failed.items():
+        logger.error("Failed %s: %s", item_id, error)
+    logger.info("%s", result)
+    return 1 if result.failed else 0
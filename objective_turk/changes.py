@@ -0,0 +1,234 @@
+"""
+A log of the changes made to HITs, assignments, qualifications and bonuses
+
+Rows are replaced in place whenever they're downloaded again, and updated_at moves
+on every save, so neither tells what actually changed. Instead, save hooks append
+a Change to a log whenever a HIT, assignment or qualification is saved with details
+that differ from the ones saved before (new rows, status transitions, and any
+other difference), whenever a bonus is recorded, and whenever a row is deleted
+because it's gone from MTurk (e.g., a disassociated qualification). Saves that change
+nothing, such as repeated syncs of a finished HIT, leave no trace.
+
+Each change gets a sequence number, which only ever increases: changes are
+logged in the transaction that saves the row, and SQLite runs one write transaction
+at a time, so changes become visible in sequence order, even with several threads
+or processes writing. A consumer remembers how far it has read, so each downstream
+job only processes what changed since its last run:
+
+    consumer = changes.Consumer("payments", kinds=["assignment", "bonuspayment"])
+    for batch in consumer.batches():
+        for change in batch:
+            reconcile(change.kind, change.key, change.status)
+
+A batch is acknowledged (the consumer's position moves past it) once the loop asks
+for the next one, so if processing fails, the same batch is read again next time.
+
+Archiving moves rows between databases without changing them, so it isn't logged.
+prune deletes changes that every consumer has read.
+
+Logging is optional, since it adds a write to every save: enable it once for a database
+(changes.enable(), after init), and from then on every session using it logs changes.
+"""
+
+import logging
+import typing
+
+import peewee
+import playhouse.sqlite_ext as peewee_sqlite
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Operations
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+# The fields identifying a row, and the field holding its status (if any), by model
+_LOGGED = {
+    objective_turk.Hit: (("HITId",), "HITStatus"),
+    objective_turk.Assignment: (("AssignmentId",), "AssignmentStatus"),
+    objective_turk.Qualification: (("QualificationTypeId", "WorkerId"), "Status"),
+    objective_turk.BonusPayment: (("AssignmentId", "WorkerId"), None),
+}
+
+BATCH_SIZE = 1000
+
+
+class Change(objective_turk.BaseModel):
+    """
+    A change to one row: its kind (the table it's in), its key (the fields identifying it),
+    the details fields that changed (None for a new or deleted row), and its status
+    before and after
+    """
+
+    # Unlike a plain primary key, never reuses the numbers of deleted (pruned) changes
+    sequence = peewee_sqlite.AutoIncrementField()
+    kind = peewee.CharField(max_length=64, index=True)
+    key = objective_turk.SerializableJSONField()
+    operation = peewee.CharField(
+        max_length=16, choices=((INSERT, INSERT), (UPDATE, UPDATE), (DELETE, DELETE))
+    )
+    fields = objective_turk.SerializableJSONField(null=True)
+    previous_status = peewee.CharField(max_length=64, null=True)
+    status = peewee.CharField(max_length=64, null=True)
+
+    def __str__(self):
+        key = ", ".join(str(value) for value in self.key.values())
+        return f"#{self.sequence}: {self.operation} {self.kind} {key}"
+
+
+class ChangeCursor(objective_turk.BaseModel):
+    """
+    The sequence number of the last change a consumer has processed
+    """
+
+    id = peewee.CharField(max_length=256, primary_key=True, column_name="consumer")
+    sequence = peewee.IntegerField(default=0)
+
+
+objective_turk.register_feature("changes", Change, ChangeCursor)
+
+
+def enable() -> None:
+    """
+    Start logging changes to the current session's database (see enable_feature)
+    """
+    objective_turk.enable_feature("changes")
+
+
+def _loggers_for(model: typing.Type[objective_turk.BaseModel]):
+    key_fields, status_field = _LOGGED[model]
+
+    def log_change(
+        previous: typing.Optional[typing.Dict], current: typing.Dict
+    ) -> None:
+        current = objective_turk.stored_json(current)
+        if previous is None:
+            operation = INSERT
+            fields = None
+            previous_status = None
+        else:
+            changed = set(previous) | set(current)
+            fields = sorted(
+                field for field in changed if previous.get(field) != current.get(field)
+            )
+            if not fields:
+                return
+            operation = UPDATE
+            previous_status = previous.get(status_field) if status_field else None
+        Change.insert(
+            kind=model._meta.table_name,
+            key={field: current.get(field) for field in key_fields},
+            operation=operation,
+            fields=fields,
+            previous_status=previous_status,
+            status=current.get(status_field) if status_field else None,
+        ).execute()
+
+    def log_delete(previous: typing.Dict) -> None:
+        Change.insert(
+            kind=model._meta.table_name,
+            key={field: previous.get(field) for field in key_fields},
+            operation=DELETE,
+            previous_status=previous.get(status_field) if status_field else None,
+        ).execute()
+
+    return log_change, log_delete
+
+
+for _model in _LOGGED:
+    _log_change, _log_delete = _loggers_for(_model)
+    objective_turk.on_save(_model, _log_change, feature="changes")
+    objective_turk.on_delete(_model, _log_delete, feature="changes")
+
+
+def latest() -> int:
+    """
+    Return the sequence number of the most recent change (0 if none were logged)
+    """
+    objective_turk.require_feature("changes")
+    return Change.select(peewee.fn.MAX(Change.sequence)).scalar() or 0
+
+
+def since(
+    sequence: int = 0,
+    kinds: typing.Optional[typing.Iterable[str]] = None,
+    limit: typing.Optional[int] = None,
+) -> peewee.ModelSelect:
+    """
+    Return a query for the changes after the given sequence number, in order,
+    optionally only those of the given kinds (table names, e.g. "hit")
+    """
+    objective_turk.require_feature("changes")
+    query = Change.select().where(Change.sequence > sequence)
+    if kinds is not None:
+        query = query.where(Change.kind.in_(list(kinds)))
+    return query.order_by(Change.sequence).limit(limit)
+
+
+class Consumer:
+    """
+    A named reader of the change log, whose position is kept in the database
+    """
+
+    def __init__(self, name: str, kinds: typing.Optional[typing.Iterable[str]] = None):
+        self.name = name
+        self.kinds = list(kinds) if kinds is not None else None
+
+    def __repr__(self):
+        return f"<Consumer {self.name} at {self.position}>"
+
+    @property
+    def position(self) -> int:
+        """
+        The sequence number of the last change this consumer has processed
+        """
+        objective_turk.require_feature("changes")
+        cursor = ChangeCursor.get_or_none(ChangeCursor.id == self.name)
+        return cursor.sequence if cursor is not None else 0
+
+    def pending(self, limit: typing.Optional[int] = None) -> peewee.ModelSelect:
+        """
+        Return a query for the changes this consumer hasn't processed yet
+        """
+        return since(self.position, self.kinds, limit)
+
+    def acknowledge(self, sequence: int) -> None:
+        """
+        Record that this consumer has processed the changes up to the given sequence number
+        (which may also move it back, to process changes again)
+        """
+        objective_turk.require_feature("changes")
+        ChangeCursor.insert(
+            id=self.name, sequence=sequence, updated_at=objective_turk.now_utc()
+        ).on_conflict_replace().execute()
+
+    def batches(self, size: int = BATCH_SIZE) -> typing.Iterator[typing.List[Change]]:
+        """
+        Yield the pending changes in batches, acknowledging each batch
+        when the next one is asked for (or the last one is done)
+        """
+        while True:
+            batch = list(self.pending(size))
+            if not batch:
+                return
+            yield batch
+            self.acknowledge(batch[-1].sequence)
+
+
+def prune(up_to: typing.Optional[int] = None) -> int:
+    """
+    Delete changes up to the given sequence number (by default, all that every consumer
+    has processed), returning how many were deleted
+    """
+    objective_turk.require_feature("changes")
+    if up_to is None:
+        up_to = ChangeCursor.select(peewee.fn.MIN(ChangeCursor.sequence)).scalar()
+        if up_to is None:
+            logger.info("No consumers, so not pruning any changes")
+            return 0
+    deleted = Change.delete().where(Change.sequence <= up_to).execute()
+    logger.info("Pruned %d changes", deleted)
+    return deleted
@@ -2,13 +2,15 @@ import logging
 
 import colorlog
 
-import objective_turk.objective_turk
-import objective_turk.create_hit
+import objective_turk.log_queue
 
 
 def color_logs():
     """
     Enable colorful logs
+
+    Records are formatted and written on a background thread (see log_queue),
+    so logging doesn't slow down the code that emits it.
     """
     handler = colorlog.StreamHandler()
     handler.setFormatter(
@@ -23,13 +25,17 @@ def color_logs():
             },
         )
     )
+    queue_handler = objective_turk.log_queue.start([handler])
 
-    objective_turk.objective_turk.logger.addHandler(handler)
-    objective_turk.objective_turk.logger.propagate = False
-
-    objective_turk.create_hit.logger.addHandler(handler)
-    objective_turk.create_hit.logger.propagate = False
+    package_logger = logging.getLogger("objective_turk")
+    for existing in list(package_logger.handlers):
+        if isinstance(
+            existing, objective_turk.log_queue.DeferredFormattingQueueHandler
+        ):
+            package_logger.removeHandler(existing)
+    package_logger.addHandler(queue_handler)
+    package_logger.propagate = False
 
     if len(logging.getLogger().handlers) > 0:
         logging.getLogger().handlers.pop()
-    logging.getLogger().addHandler(handler)
+    logging.getLogger().addHandler(queue_handler)
@@ -1,4 +1,6 @@
 import logging
+import os
+import typing
 
 from objective_turk import objective_turk
 
@@ -102,7 +104,34 @@ def get_qualifications(exclude: str = None, include: str = None):
     return qualifications
 
 
-def create_hit_with_hit_type(**kwargs):
+MAX_ANNOTATION_LENGTH = 255
+
+
+def tag_project(
+    kwargs: typing.Dict, project: typing.Optional[str] = None
+) -> typing.Dict:
+    """
+    Tag HIT creation arguments with the given project (default: MTURK_PROJECT)
+    by setting the RequesterAnnotation, which is how we recognize a project's HITs.
+    """
+    if project is None:
+        project = os.getenv("MTURK_PROJECT")
+    if project is None:
+        return kwargs
+
+    if "RequesterAnnotation" in kwargs:
+        raise ValueError(
+            "RequesterAnnotation is used to record the project; pass one or the other"
+        )
+    annotation = objective_turk.PROJECT_ANNOTATION_PREFIX + project
+    if len(annotation) > MAX_ANNOTATION_LENGTH:
+        raise ValueError("project ID too long to fit in the RequesterAnnotation")
+
+    logger.debug("tagging HIT with project %s", project)
+    return dict(kwargs, RequesterAnnotation=annotation)
+
+
+def create_hit_with_hit_type(project: typing.Optional[str] = None, **kwargs):
     """
     Create HIT using provided HITTypeId.
 
@@ -113,6 +142,8 @@ def create_hit_with_hit_type(**kwargs):
 
     Other fields will be ignored:
     Title, Description, Reward, and Keywords
+
+    If a project is given (or MTURK_PROJECT is set), the HIT is tagged with it.
     """
     if 'HITTypeId' not in kwargs:
         raise ValueError('missing required argument HITTypeId')
@@ -126,20 +157,24 @@ def create_hit_with_hit_type(**kwargs):
         'creating HIT using HITTypeId %s. Title, Description, Reward, and Keywords from calling script will be ignored.',
         hit_type,
     )
-    response = objective_turk.client().create_hit_with_hit_type(**kwargs)
+    response = objective_turk.client().create_hit_with_hit_type(
+        **tag_project(kwargs, project)
+    )
     logger.debug(response)
     #pylint: disable=protected-access
     return objective_turk.Hit._new_from_response(response['HIT'])
 
 
-def create_hit(**kwargs):
+def create_hit(project: typing.Optional[str] = None, **kwargs):
     """
     Create a HIT with the given arguments.
     
     For arguments, see:
     https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/mturk.html#MTurk.Client.create_hit
+
+    If a project is given (or MTURK_PROJECT is set), the HIT is tagged with it.
     """
-    response = objective_turk.client().create_hit(**kwargs)
+    response = objective_turk.client().create_hit(**tag_project(kwargs, project))
     logger.debug(response)
     #pylint: disable=protected-access
     return objective_turk.Hit._new_from_response(response['HIT'])
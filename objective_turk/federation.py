@@ -0,0 +1,224 @@
+"""
+Query several accounts' databases at once
+
+Each AWS profile and environment has its own database file (see init).
+A Federation attaches several of them, read-only, to one SQLite connection,
+and unions their HITs, assignments and workers into views with an extra
+account column, so a question about every account is a single SQL statement,
+and no data is copied. For example, all assignments by one worker, anywhere:
+
+    with Federation.from_directory("~/mturk") as federation:
+        Assignment = federation.Assignment
+        Assignment.select().where(Assignment.worker == "A1B2C3").order_by(Assignment.AcceptTime)
+
+The views are named after the tables (hit, assignment and worker), so raw SQL
+works too, through federation.database.execute_sql. Databases created by older
+versions are fine: columns they lack read as NULL.
+
+SQLite attaches at most 10 databases to a connection (unless compiled otherwise).
+"""
+
+import logging
+import pathlib
+import typing
+
+import peewee
+import playhouse.sqlite_ext as peewee_sqlite
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+DatabasePath = typing.Union[str, pathlib.Path]
+
+
+class FederatedModel(objective_turk.BaseModel):
+    """
+    A row of one of the federated views, from the database of the given account
+    """
+
+    account = peewee.CharField(max_length=256)
+
+
+class FederatedWorker(FederatedModel):
+    id = peewee.CharField(max_length=256, column_name="WorkerId")
+
+    class Meta:
+        table_name = objective_turk.Worker._meta.table_name
+        primary_key = peewee.CompositeKey("account", "id")
+
+
+class FederatedHit(FederatedModel):
+    id = peewee.CharField(max_length=256, column_name="HITId")
+    hit_type = peewee.CharField(max_length=256, column_name="HITTypeId")
+    project = peewee.CharField(max_length=256, null=True)
+    details = objective_turk.SerializableJSONField()
+
+    class Meta:
+        table_name = objective_turk.Hit._meta.table_name
+        primary_key = peewee.CompositeKey("account", "id")
+
+
+class FederatedAssignment(FederatedModel):
+    id = peewee.CharField(max_length=256, column_name="AssignmentId")
+    # Plain IDs rather than foreign keys, since IDs are only unique within an account
+    worker = peewee.CharField(max_length=256, column_name="WorkerId")
+    hit = peewee.CharField(max_length=256, column_name="HITId")
+    AssignmentStatus = peewee.CharField(max_length=256)
+    AcceptTime = peewee.TimestampField(
+        null=True, default=None, resolution=1000, utc=True
+    )
+    SubmitTime = peewee.TimestampField(
+        null=True, default=None, resolution=1000, utc=True
+    )
+    details = objective_turk.SerializableJSONField()
+
+    class Meta:
+        table_name = objective_turk.Assignment._meta.table_name
+        primary_key = peewee.CompositeKey("account", "id")
+
+
+FEDERATED_MODELS = (FederatedWorker, FederatedHit, FederatedAssignment)
+
+
+class _FederatedDatabase(peewee_sqlite.SqliteExtDatabase):
+    """
+    An in-memory database that recreates the federated views on every new connection
+    """
+
+    def __init__(self, federation: "Federation"):
+        super().__init__(":memory:", uri=True)
+        self._federation = federation
+
+    def _add_conn_hooks(self, conn):
+        super()._add_conn_hooks(conn)
+        for schema, uri in self._federation.schemas().items():
+            conn.execute(f'ATTACH DATABASE ? AS "{schema}"', (uri,))
+        # Temporary views can use attached databases, and vanish with the connection
+        for model in FEDERATED_MODELS:
+            # pylint: disable=protected-access
+            conn.execute(self._federation._view_sql(conn, model))
+
+
+class Federation:
+    """
+    Several accounts' databases, attached read-only to one connection
+
+    accounts maps each account's label to its database file; given just a list of files,
+    accounts are labelled with the file names (e.g., "turk_production").
+    """
+
+    def __init__(
+        self,
+        accounts: typing.Union[
+            typing.Mapping[str, DatabasePath], typing.Sequence[DatabasePath]
+        ],
+    ):
+        if not isinstance(accounts, typing.Mapping):
+            accounts = {pathlib.Path(path).stem: path for path in accounts}
+        if not accounts:
+            raise ValueError("no databases to federate")
+
+        self.accounts: typing.Dict[str, pathlib.Path] = {}
+        for label, path in accounts.items():
+            path = pathlib.Path(path).expanduser().resolve()
+            if not path.exists():
+                raise FileNotFoundError(f"no database for {label} at {path}")
+            self.accounts[label] = path
+
+        # Schema names are generated, since labels needn't be valid identifiers
+        self._schemas = {
+            label: f"account{number}" for number, label in enumerate(self.accounts)
+        }
+        self.database = _FederatedDatabase(self)
+        self.Worker = self._bind(FederatedWorker)
+        self.Hit = self._bind(FederatedHit)
+        self.Assignment = self._bind(FederatedAssignment)
+        logger.debug("Federated %s", ", ".join(self.accounts))
+
+    def __repr__(self):
+        return f"<Federation of {', '.join(self.accounts)}>"
+
+    def __enter__(self) -> "Federation":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @classmethod
+    def from_directory(
+        cls,
+        directory: DatabasePath = ".",
+        environment: typing.Optional[objective_turk.Environment] = None,
+    ) -> "Federation":
+        """
+        Federate the databases that init created in the given directory
+        (named <profile>_<environment>.db), optionally only those of one environment
+        """
+        environments = (
+            [environment]
+            if environment is not None
+            else list(objective_turk.Environment)
+        )
+        paths = sorted(
+            path
+            for env in environments
+            for path in pathlib.Path(directory).expanduser().glob(f"*_{env.value}.db")
+        )
+        if not paths:
+            raise FileNotFoundError(f"no objective_turk databases in {directory}")
+        return cls(paths)
+
+    def _bind(self, model: typing.Type[FederatedModel]) -> typing.Type[FederatedModel]:
+        # A subclass per federation, so several federations can be open at once
+        meta = type(
+            "Meta",
+            (),
+            {"database": self.database, "table_name": model._meta.table_name},
+        )
+        return type(model.__name__[len("Federated") :], (model,), {"Meta": meta})
+
+    def schemas(self) -> typing.Dict[str, str]:
+        """
+        Return the URI (opening it read-only) of each attached database, by schema name
+        """
+        return {
+            self._schemas[label]: f"{path.as_uri()}?mode=ro"
+            for label, path in self.accounts.items()
+        }
+
+    def _view_sql(self, conn, model: typing.Type[FederatedModel]) -> str:
+        """
+        Return the statement creating the view that unions the model's table across accounts
+        """
+        table = model._meta.table_name
+        columns = [
+            field.column_name
+            for field in model._meta.sorted_fields
+            if field.name != "account"
+        ]
+        selects = []
+        for label, schema in self._schemas.items():
+            existing = {
+                row[1]
+                for row in conn.execute(f'PRAGMA "{schema}".table_info("{table}")')
+            }
+            if not existing:
+                logger.warning("%s has no %s table", label, table)
+                continue
+            selected = ", ".join(
+                f'"{column}"' if column in existing else f'NULL AS "{column}"'
+                for column in columns
+            )
+            account = label.replace("'", "''")
+            selects.append(
+                f'SELECT \'{account}\' AS account, {selected} FROM "{schema}"."{table}"'
+            )
+        if not selects:
+            # No account has the table, so the view is empty
+            empty = ", ".join(f'NULL AS "{column}"' for column in columns)
+            selects.append(f"SELECT NULL AS account, {empty} WHERE 0")
+        return f'CREATE TEMP VIEW "{table}" AS ' + " UNION ALL ".join(selects)
+
+    def close(self) -> None:
+        self.database.close()
@@ -0,0 +1,519 @@
+"""
+An index of answer fingerprints, for finding duplicate and suspiciously similar submissions
+
+When an assignment is saved (or its answers change), each free-text answer is
+normalized (case, accents, punctuation and whitespace are ignored) and hashed.
+Identical answers share an exact hash, which is indexed, so duplicates are a
+single GROUP BY away. Longer answers also get a MinHash signature over their
+character shingles, split into bands for locality-sensitive hashing: answers
+that are similar enough are likely to share at least one band. Finding
+clusters of similar answers therefore only compares answers within the same
+band buckets, instead of every pair, and takes near-linear time.
+
+Indexing is optional, since it adds several writes to every new assignment saved:
+enable it once for a database (fingerprints.enable(), after init), which indexes the
+assignments already there, and from then on every session using it keeps the index
+up to date. rebuild indexes everything again from scratch.
+"""
+
+import hashlib
+import itertools
+import logging
+import re
+import struct
+import typing
+import unicodedata
+import xml.etree.ElementTree
+import zlib
+
+import peewee
+
+from objective_turk import archive
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Shorter answers (e.g., multiple choice, or "yes") are identical all the time,
+# so by default they don't count as duplicates, and get no MinHash signature
+MIN_TEXT_LENGTH = 20
+
+SHINGLE_SIZE = 5
+NUM_HASHES = 64
+# With 16 bands of 4 hashes, answers with a similarity of 0.5 share a band about
+# 64% of the time; at 0.8, more than 99.9% of the time
+BANDS = 16
+ROWS_PER_BAND = NUM_HASHES // BANDS
+
+# Shingles are hashed with CRC-32, which is plenty for estimating similarity, and
+# much faster than cryptographic hashes. The top bits of each shingle's hash pick
+# its bucket, and the rest are its value; values borrowed by empty buckets
+# (see minhash) are offset by multiples of this
+_VALUE_RANGE = 1 << (32 - (NUM_HASHES - 1).bit_length())
+_SIGNATURE_FORMAT = f"<{NUM_HASHES}I"
+
+
+class AnswerFingerprint(objective_turk.BaseModel):
+    """
+    The hashes of one answer (to the question with the given QuestionIdentifier)
+    """
+
+    id = peewee.AutoField()
+    assignment = peewee.CharField(max_length=256, column_name="AssignmentId")
+    worker = peewee.CharField(max_length=256, column_name="WorkerId")
+    hit = peewee.CharField(max_length=256, column_name="HITId")
+    question = peewee.CharField(max_length=256)
+    exact_hash = peewee.CharField(max_length=32)
+    length = peewee.IntegerField()
+    # Packed MinHash values, for answers of at least MIN_TEXT_LENGTH characters
+    signature = peewee.BlobField(null=True)
+
+    class Meta:
+        indexes = (
+            (("assignment", "question"), True),
+            (("question", "exact_hash"), False),
+        )
+
+    def __str__(self):
+        return f"Answer to {self.question} in assignment {self.assignment}"
+
+
+class AnswerBand(peewee.Model):
+    """
+    One LSH band of an answer's MinHash signature
+
+    There are BANDS of these per answer, so they skip BaseModel's timestamps.
+    """
+
+    fingerprint = peewee.ForeignKeyField(
+        AnswerFingerprint,
+        on_delete=objective_turk.CASCADE,
+        backref="bands",
+        column_name="FingerprintId",
+    )
+    band = peewee.SmallIntegerField()
+    # Hash of the band's values and the question, so only answers to the same question match
+    hash = peewee.BigIntegerField()
+
+    class Meta:
+        # The same database as the other models: the current session's
+        database = AnswerFingerprint._meta.database
+        indexes = ((("band", "hash"), False),)
+
+
+objective_turk.register_feature("fingerprints", AnswerFingerprint, AnswerBand)
+
+
+def enable() -> None:
+    """
+    Start indexing answers in the current session's database (see enable_feature)
+    """
+    objective_turk.enable_feature("fingerprints")
+
+
+class Submission(typing.NamedTuple):
+    assignment: str
+    worker: str
+    hit: str
+
+
+class Cluster:
+    """
+    Submissions whose answers to a question are identical or similar
+    """
+
+    def __init__(self, question: str, submissions: typing.List[Submission]):
+        self.question = question
+        self.submissions = submissions
+
+    def __repr__(self):
+        return (
+            f"<Cluster of {len(self.submissions)} answers to {self.question} "
+            f"by {len(self.workers)} workers>"
+        )
+
+    def __len__(self):
+        return len(self.submissions)
+
+    @property
+    def workers(self) -> typing.Set[str]:
+        return {submission.worker for submission in self.submissions}
+
+    @property
+    def hits(self) -> typing.Set[str]:
+        return {submission.hit for submission in self.submissions}
+
+
+def normalize(text: str) -> str:
+    """
+    Return the text with case, accents, punctuation and repeated whitespace removed
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+
+def exact_hash(normalized: str) -> str:
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def minhash(normalized: str) -> typing.Tuple[int, ...]:
+    """
+    Return the MinHash signature of the text's character shingles
+
+    This uses one permutation hashing: each shingle is hashed once, and the hash
+    picks the bucket whose minimum it counts towards, which is NUM_HASHES times
+    faster than hashing every shingle NUM_HASHES ways. Empty buckets borrow the
+    value of the next non-empty one, as in "Densifying One Permutation Hashing
+    via Rotation" (Shrivastava and Li, 2014), so signatures stay comparable.
+    """
+    shingles = {
+        normalized[start : start + SHINGLE_SIZE]
+        for start in range(max(len(normalized) - SHINGLE_SIZE + 1, 1))
+    }
+    buckets: typing.List[typing.Optional[int]] = [None] * NUM_HASHES
+    for shingle in shingles:
+        bucket, value = divmod(zlib.crc32(shingle.encode()), _VALUE_RANGE)
+        if buckets[bucket] is None or value < buckets[bucket]:
+            buckets[bucket] = value
+
+    signature = []
+    for bucket in range(NUM_HASHES):
+        distance = 0
+        value = buckets[bucket]
+        while value is None:
+            distance += 1
+            value = buckets[(bucket + distance) % NUM_HASHES]
+        signature.append(value + distance * _VALUE_RANGE)
+    return tuple(signature)
+
+
+def similarity(signature: typing.Sequence[int], other: typing.Sequence[int]) -> float:
+    """
+    Estimate the similarity (Jaccard index of shingles) of two answers from their signatures
+    """
+    return sum(a == b for a, b in zip(signature, other)) / NUM_HASHES
+
+
+def band_hashes(question: str, signature: typing.Sequence[int]) -> typing.List[int]:
+    prefix = question.encode() + b"\0"
+    hashes = []
+    for band in range(BANDS):
+        values = signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]
+        packed = struct.pack(f"<{ROWS_PER_BAND}I", *values)
+        # SQLite integers are signed
+        hashes.append(_hash64(prefix + packed) - (1 << 63))
+    return hashes
+
+
+def _fingerprint_rows(
+    details: typing.Dict,
+) -> typing.Iterator[typing.Tuple[typing.Dict, typing.Optional[typing.List[int]]]]:
+    """
+    Yield a fingerprint row and its band hashes (if it has a signature) for each answer
+    """
+    if not details.get("Answer"):
+        return
+    try:
+        answers = objective_turk.parse_answers(details["Answer"])
+    except xml.etree.ElementTree.ParseError:
+        logger.warning(
+            "Not fingerprinting assignment %s: can't parse its answers",
+            details["AssignmentId"],
+        )
+        return
+
+    for question, text in answers.items():
+        normalized = normalize(text or "")
+        if not normalized:
+            continue
+        row = {
+            "assignment": details["AssignmentId"],
+            "worker": details["WorkerId"],
+            "hit": details["HITId"],
+            "question": question,
+            "exact_hash": exact_hash(normalized),
+            "length": len(normalized),
+            "signature": None,
+        }
+        bands = None
+        if len(normalized) >= MIN_TEXT_LENGTH:
+            signature = minhash(normalized)
+            row["signature"] = struct.pack(_SIGNATURE_FORMAT, *signature)
+            bands = band_hashes(question, signature)
+        yield row, bands
+
+
+def _insert_sql(
+    model: typing.Type[peewee.Model], fields: typing.Sequence[str], rows: int = 1
+) -> str:
+    columns = ", ".join(f'"{model._meta.fields[name].column_name}"' for name in fields)
+    values = ", ".join([f"({', '.join('?' * len(fields))})"] * rows)
+    return f'INSERT INTO "{model._meta.table_name}" ({columns}) VALUES {values}'
+
+
+_FINGERPRINT_FIELDS = (
+    "created_at",
+    "updated_at",
+    "assignment",
+    "worker",
+    "hit",
+    "question",
+    "exact_hash",
+    "length",
+    "signature",
+)
+
+
+def _insert(
+    rows: typing.Iterable[typing.Tuple[typing.Dict, typing.Optional[typing.List[int]]]],
+) -> int:
+    # Generating these statements with peewee for every answer would take several
+    # times longer than everything else indexing does
+    database = objective_turk.get_database()
+    fingerprint_sql = _insert_sql(AnswerFingerprint, _FINGERPRINT_FIELDS)
+    band_sql = _insert_sql(AnswerBand, ("fingerprint", "band", "hash"), rows=BANDS)
+    now = AnswerFingerprint.created_at.db_value(objective_turk.now_utc())
+
+    count = 0
+    for row, bands in rows:
+        row = dict(row, created_at=now, updated_at=now)
+        cursor = database.execute_sql(
+            fingerprint_sql, [row[field] for field in _FINGERPRINT_FIELDS]
+        )
+        if bands is not None:
+            database.execute_sql(
+                band_sql,
+                [
+                    value
+                    for band, band_hash in enumerate(bands)
+                    for value in (cursor.lastrowid, band, band_hash)
+                ],
+            )
+        count += 1
+    return count
+
+
+def index_assignment(details: typing.Dict) -> int:
+    """
+    (Re)compute the fingerprints of an assignment's answers, returning how many there are
+    """
+    AnswerFingerprint.delete().where(
+        AnswerFingerprint.assignment == details["AssignmentId"]
+    ).execute()
+    return _insert(_fingerprint_rows(details))
+
+
+def _on_assignment_saved(
+    previous: typing.Optional[typing.Dict], current: typing.Dict
+) -> None:
+    if previous is not None and previous.get("Answer") == current.get("Answer"):
+        return  # e.g., only the status changed
+    index_assignment(current)
+
+
+objective_turk.on_save(
+    objective_turk.Assignment,
+    _on_assignment_saved,
+    fields=["Answer"],
+    feature="fingerprints",
+)
+
+
+# Archived HITs and assignments count too
+@archive.including_archived_if_any()
+def rebuild() -> int:
+    """
+    Recompute the fingerprints of every assignment in the database,
+    returning the number of answers indexed
+    """
+    objective_turk.require_feature("fingerprints")
+    Assignment = objective_turk.Assignment
+    count = 0
+    with objective_turk.get_database().atomic():
+        AnswerFingerprint.delete().execute()
+        for (details,) in Assignment.select(Assignment.details).tuples().iterator():
+            count += _insert(_fingerprint_rows(details))
+    logger.info("Indexed %d answers", count)
+    return count
+
+
+# Enabling the index for a database indexes the assignments already there
+objective_turk.register_backfill(AnswerFingerprint, rebuild)
+
+
+def _submissions_by_id(
+    fingerprint_ids: typing.Collection[int],
+) -> typing.Dict[int, typing.Tuple[str, Submission, typing.Tuple[int, ...]]]:
+    found = {}
+    ids = list(fingerprint_ids)
+    # Stay well below SQLite's limit on the number of variables in a query
+    for start in range(0, len(ids), 500):
+        query = AnswerFingerprint.select(
+            AnswerFingerprint.id,
+            AnswerFingerprint.question,
+            AnswerFingerprint.assignment,
+            AnswerFingerprint.worker,
+            AnswerFingerprint.hit,
+            AnswerFingerprint.signature,
+        ).where(AnswerFingerprint.id.in_(ids[start : start + 500]))
+        for (
+            fingerprint_id,
+            question,
+            assignment,
+            worker,
+            hit,
+            signature,
+        ) in query.tuples():
+            found[fingerprint_id] = (
+                question,
+                Submission(assignment, worker, hit),
+                struct.unpack(_SIGNATURE_FORMAT, signature),
+            )
+    return found
+
+
+def duplicates(
+    question: typing.Optional[str] = None,
+    min_length: int = MIN_TEXT_LENGTH,
+    min_workers: int = 2,
+) -> typing.List[Cluster]:
+    """
+    Return clusters of submissions with identical answers (after normalization)
+
+    Only answers of at least min_length characters count, and only clusters with
+    answers from at least min_workers different workers are returned
+    (pass 1 to include workers repeating their own answers).
+    """
+    objective_turk.require_feature("fingerprints")
+    groups = (
+        AnswerFingerprint.select(
+            AnswerFingerprint.question, AnswerFingerprint.exact_hash
+        )
+        .where(AnswerFingerprint.length >= min_length)
+        .group_by(AnswerFingerprint.question, AnswerFingerprint.exact_hash)
+        .having(
+            (peewee.fn.COUNT(AnswerFingerprint.id) > 1)
+            & (peewee.fn.COUNT(AnswerFingerprint.worker.distinct()) >= min_workers)
+        )
+    )
+    if question is not None:
+        groups = groups.where(AnswerFingerprint.question == question)
+    groups = groups.alias("groups")
+
+    query = (
+        AnswerFingerprint.select(
+            AnswerFingerprint.question,
+            AnswerFingerprint.exact_hash,
+            AnswerFingerprint.assignment,
+            AnswerFingerprint.worker,
+            AnswerFingerprint.hit,
+        )
+        .join(
+            groups,
+            on=(
+                (AnswerFingerprint.question == groups.c.question)
+                & (AnswerFingerprint.exact_hash == groups.c.exact_hash)
+            ),
+        )
+        .where(AnswerFingerprint.length >= min_length)
+        .order_by(
+            AnswerFingerprint.question,
+            AnswerFingerprint.exact_hash,
+            AnswerFingerprint.assignment,
+        )
+        .tuples()
+    )
+    return [
+        Cluster(key[0], [Submission(*row[2:]) for row in rows])
+        for key, rows in itertools.groupby(query.iterator(), key=lambda row: row[:2])
+    ]
+
+
+def similar(
+    threshold: float = 0.8,
+    question: typing.Optional[str] = None,
+    min_workers: int = 2,
+) -> typing.List[Cluster]:
+    """
+    Return clusters of submissions with similar answers: each answer's estimated
+    similarity to another in the cluster is at least the threshold (between 0 and 1)
+
+    Only answers of at least MIN_TEXT_LENGTH characters have signatures to compare.
+    Candidates come from shared LSH bands, so a few pairs just above a low
+    threshold may be missed.
+    """
+    objective_turk.require_feature("fingerprints")
+    buckets = (
+        AnswerBand.select(AnswerBand.band, AnswerBand.hash)
+        .group_by(AnswerBand.band, AnswerBand.hash)
+        .having(peewee.fn.COUNT(AnswerBand.id) > 1)
+        .alias("buckets")
+    )
+    query = (
+        AnswerBand.select(AnswerBand.band, AnswerBand.hash, AnswerBand.fingerprint)
+        .join(
+            buckets,
+            on=(
+                (AnswerBand.band == buckets.c.band)
+                & (AnswerBand.hash == buckets.c.hash)
+            ),
+        )
+        .order_by(AnswerBand.band, AnswerBand.hash, AnswerBand.fingerprint)
+        .tuples()
+    )
+    members = [
+        [row[2] for row in rows]
+        for _, rows in itertools.groupby(query.iterator(), key=lambda row: row[:2])
+    ]
+    found = _submissions_by_id({member for bucket in members for member in bucket})
+    if question is not None:
+        members = [
+            [member for member in bucket if found[member][0] == question]
+            for bucket in members
+        ]
+
+    # Union-find over fingerprint IDs; comparing each member of a bucket to its first
+    # keeps the number of comparisons linear in the size of the buckets
+    parent = {fingerprint_id: fingerprint_id for fingerprint_id in found}
+
+    def root(fingerprint_id: int) -> int:
+        while parent[fingerprint_id] != fingerprint_id:
+            parent[fingerprint_id] = parent[parent[fingerprint_id]]
+            fingerprint_id = parent[fingerprint_id]
+        return fingerprint_id
+
+    compared = set()
+    for bucket in members:
+        if len(bucket) < 2:
+            continue
+        first = bucket[0]
+        for other in bucket[1:]:
+            if (first, other) in compared:
+                continue
+            compared.add((first, other))
+            if root(first) == root(other):
+                continue
+            if similarity(found[first][2], found[other][2]) >= threshold:
+                parent[root(other)] = root(first)
+
+    grouped: typing.Dict[int, typing.List[int]] = {}
+    for fingerprint_id in found:
+        grouped.setdefault(root(fingerprint_id), []).append(fingerprint_id)
+    clusters = [
+        Cluster(
+            found[group[0]][0],
+            sorted(found[fingerprint_id][1] for fingerprint_id in group),
+        )
+        for group in grouped.values()
+    ]
+    clusters = [
+        cluster
+        for cluster in clusters
+        if len(cluster) > 1 and len(cluster.workers) >= min_workers
+    ]
+    clusters.sort(key=lambda cluster: (cluster.question, cluster.submissions[0]))
+    return clusters
@@ -0,0 +1,173 @@
+"""
+Query results as Arrow tables or pandas DataFrames
+
+Requires pyarrow (pip install objective-turk[dataframes]); to_pandas also needs
+pandas. Any query over our models can be converted, e.g.
+
+    Assignment.select().where(Assignment.AssignmentStatus == "Submitted").to_pandas(
+        details={"Answer": str, "AutoApprovalTime": datetime.datetime}
+    )
+
+Rows are read from SQLite in chunks, straight into columnar Arrow buffers,
+without creating a model instance or a dictionary per row. Timestamps are
+converted to milliseconds since the epoch by SQLite, and details fields are
+extracted (and cast) there too, so the raw JSON is only loaded if the query
+selects the details explicitly. polars users can call polars.from_arrow on
+the result of to_arrow.
+"""
+
+import datetime
+import typing
+
+import peewee
+import playhouse.sqlite_ext as peewee_sqlite
+import pyarrow
+
+from objective_turk import objective_turk
+
+DEFAULT_CHUNK_SIZE = 65536
+
+# Fields of details to add as columns: either a list of names (whose types are
+# inferred), or a mapping from names to one of the Python types in _DETAIL_TYPES.
+# Names can be paths into nested objects, e.g. "QualificationRequirements[0].Comparator".
+DetailColumns = typing.Union[typing.Sequence[str], typing.Mapping[str, type], None]
+
+TIMESTAMP = pyarrow.timestamp("ms", tz="UTC")
+
+_DETAIL_TYPES = {
+    str: ("TEXT", pyarrow.string()),
+    int: ("INTEGER", pyarrow.int64()),
+    float: ("REAL", pyarrow.float64()),
+    bool: ("INTEGER", pyarrow.bool_()),
+}
+
+_TIMESTAMP_UNITS = {1: "s", 1000: "ms", 1000000: "us"}
+
+
+def _field_column(
+    field: peewee.Field,
+) -> typing.Tuple[peewee.Node, typing.Optional[pyarrow.DataType]]:
+    """
+    Return the expression to select for a field, and the type of its column
+    """
+    if isinstance(field, peewee.ForeignKeyField):
+        _, data_type = _field_column(field.rel_field)
+        return field, data_type
+    if isinstance(field, peewee.TimestampField):
+        unit = _TIMESTAMP_UNITS.get(field.resolution)
+        if unit is None:
+            return field, pyarrow.int64()
+        return field, pyarrow.timestamp(unit, tz="UTC")
+    if isinstance(field, peewee.DateTimeField):
+        return objective_turk.epoch_milliseconds(field), TIMESTAMP
+    if isinstance(field, peewee.BooleanField):
+        return field, pyarrow.bool_()
+    if isinstance(field, peewee.IntegerField):
+        return field, pyarrow.int64()
+    if isinstance(field, (peewee.FloatField, peewee.DecimalField)):
+        return field, pyarrow.float64()
+    if isinstance(field, peewee.BlobField):
+        return field, pyarrow.binary()
+    # Text, including JSON
+    return field, pyarrow.string()
+
+
+def _detail_column(
+    model: typing.Type[peewee.Model], name: str, python_type: typing.Optional[type]
+) -> typing.Tuple[peewee.Node, typing.Optional[pyarrow.DataType]]:
+    if "details" not in model._meta.fields:
+        raise ValueError(f"{model.__name__} has no details to extract {name} from")
+    value = peewee.fn.json_extract(model.details, f"$.{name}")
+    if python_type is None:
+        return value, None
+    if python_type is datetime.datetime:
+        return objective_turk.epoch_milliseconds(value), TIMESTAMP
+    if python_type not in _DETAIL_TYPES:
+        raise ValueError(f"unsupported type for details column {name}: {python_type}")
+    cast, data_type = _DETAIL_TYPES[python_type]
+    return value.cast(cast), data_type
+
+
+def _columns(
+    query: peewee.ModelSelect, details: DetailColumns
+) -> typing.Tuple[
+    typing.List[peewee.Node], typing.List[typing.Optional[pyarrow.DataType]]
+]:
+    selected = []
+    types = []
+    names = set()
+    for item in query._returning:
+        if isinstance(item, peewee.Field):
+            # The raw JSON is expensive to load, so only include it if asked to
+            if query._is_default and isinstance(item, peewee_sqlite.JSONField):
+                continue
+            expression, data_type = _field_column(item)
+            selected.append(expression.alias(item.column_name))
+            types.append(data_type)
+            names.add(item.column_name)
+        else:
+            selected.append(item)
+            types.append(None)
+            if isinstance(item, peewee.Alias):
+                names.add(item._alias)
+
+    if details:
+        if not isinstance(details, typing.Mapping):
+            details = {name: None for name in details}
+        for name, python_type in details.items():
+            expression, data_type = _detail_column(query.model, name, python_type)
+            # Column names must be unique (e.g., for pandas, or the mirror's INSERT BY NAME)
+            selected.append(
+                expression.alias(f"details.{name}" if name in names else name)
+            )
+            types.append(data_type)
+    return selected, types
+
+
+def _array(
+    values: typing.Sequence, data_type: typing.Optional[pyarrow.DataType]
+) -> pyarrow.Array:
+    if data_type is None:
+        return pyarrow.array(values)
+    if pyarrow.types.is_boolean(data_type):
+        # SQLite has no booleans, only 0 and 1
+        return pyarrow.array(values, type=pyarrow.int64()).cast(data_type)
+    return pyarrow.array(values, type=data_type)
+
+
+def to_arrow(
+    query: peewee.ModelSelect,
+    details: DetailColumns = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> pyarrow.Table:
+    """
+    Run the query, returning its results as a pyarrow Table
+
+    Columns are named after the database columns (e.g., AssignmentId, WorkerId),
+    or the details fields they were extracted from (prefixed with "details.",
+    e.g. details.AcceptTime, if the query selects a column of the same name).
+    """
+    selected, types = _columns(query, details)
+    cursor = query.model._meta.database.execute(query.select(*selected))
+    names = [description[0] for description in cursor.description]
+
+    chunks: typing.List[typing.List[pyarrow.Array]] = [[] for _ in names]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for index, values in enumerate(zip(*rows)):
+            chunks[index].append(_array(values, types[index]))
+
+    columns = []
+    for index, column_chunks in enumerate(chunks):
+        data_type = types[index]
+        if data_type is None:
+            # Inferred, so chunks without any values have the null type
+            inferred = [
+                chunk.type for chunk in column_chunks if chunk.type != pyarrow.null()
+            ]
+            data_type = inferred[0] if inferred else pyarrow.null()
+            column_chunks = [chunk.cast(data_type) for chunk in column_chunks]
+        columns.append(pyarrow.chunked_array(column_chunks, type=data_type))
+    return pyarrow.Table.from_arrays(columns, names=names)
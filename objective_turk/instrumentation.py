@@ -0,0 +1,399 @@
+"""
+Per-call instrumentation of MTurk API requests and SQLite queries
+
+API calls are observed through boto3's event hooks, and SQL through the database's
+execute_sql, so no library code needs to change to be measured.
+
+For example, to find out where the time goes in a sync:
+
+    with objective_turk.instrumentation.profile() as metrics:
+        objective_turk.Hit.download_all()
+    print(metrics.to_prometheus())
+"""
+
+import bisect
+import contextlib
+import json
+import logging
+import re
+import threading
+import time
+import typing
+import uuid
+
+import peewee
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+}
+
+_WRITE_STATEMENT = re.compile(
+    r'^\s*(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO\s+"?(\w+)"?'
+    r'|^\s*UPDATE\s+"?(\w+)"?'
+    r'|^\s*DELETE\s+FROM\s+"?(\w+)"?',
+    re.IGNORECASE,
+)
+
+_START_KEY = "objective_turk_started"
+
+
+class Histogram:
+    """
+    A latency histogram with fixed bucket boundaries (in seconds)
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        Return (upper bound, cumulative count) pairs, as Prometheus expects them
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((repr(bound), total))
+        result.append(("+Inf", self.count))
+        return result
+
+    def as_dict(self) -> typing.Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class Metrics:
+    """
+    Counters and histograms collected while instrumentation is active
+
+    All recording methods are thread-safe.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.api_calls: typing.Dict[str, int] = {}
+        self.api_errors: typing.Dict[typing.Tuple[str, str], int] = {}
+        self.api_retries: typing.Dict[str, int] = {}
+        self.api_throttles: typing.Dict[str, int] = {}
+        self.api_latency: typing.Dict[str, Histogram] = {}
+        self.sql_queries: typing.Dict[str, int] = {}
+        self.sql_latency: typing.Dict[str, Histogram] = {}
+        self.rows_written: typing.Dict[str, int] = {}
+        self.wall_time: typing.Optional[float] = None
+
+    def _histogram(self, histograms: typing.Dict[str, Histogram], key: str):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self._buckets)
+        return histogram
+
+    def record_api_call(
+        self,
+        operation: str,
+        seconds: float,
+        retries: int = 0,
+        error_code: typing.Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + 1
+            self._histogram(self.api_latency, operation).observe(seconds)
+            if retries:
+                self.api_retries[operation] = (
+                    self.api_retries.get(operation, 0) + retries
+                )
+            if error_code is not None:
+                key = (operation, error_code)
+                self.api_errors[key] = self.api_errors.get(key, 0) + 1
+
+    def record_throttle(self, operation: str) -> None:
+        with self._lock:
+            self.api_throttles[operation] = self.api_throttles.get(operation, 0) + 1
+
+    def record_query(
+        self,
+        statement: str,
+        seconds: float,
+        table: typing.Optional[str] = None,
+        rows: int = 0,
+    ) -> None:
+        with self._lock:
+            self.sql_queries[statement] = self.sql_queries.get(statement, 0) + 1
+            self._histogram(self.sql_latency, statement).observe(seconds)
+            if table is not None and rows > 0:
+                self.rows_written[table] = self.rows_written.get(table, 0) + rows
+
+    def snapshot(self) -> typing.Dict:
+        """
+        Return all metrics as a JSON-serializable dict
+        """
+        with self._lock:
+            return {
+                "api": {
+                    operation: {
+                        "calls": count,
+                        "retries": self.api_retries.get(operation, 0),
+                        "throttles": self.api_throttles.get(operation, 0),
+                        "errors": {
+                            code: errors
+                            for (errored, code), errors in self.api_errors.items()
+                            if errored == operation
+                        },
+                        "latency": self.api_latency[operation].as_dict(),
+                    }
+                    for operation, count in self.api_calls.items()
+                },
+                "sql": {
+                    statement: {
+                        "queries": count,
+                        "latency": self.sql_latency[statement].as_dict(),
+                    }
+                    for statement, count in self.sql_queries.items()
+                },
+                "rows_written": dict(self.rows_written),
+                "wall_time": self.wall_time,
+            }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix: str = "objective_turk") -> str:
+        """
+        Return all metrics in the Prometheus text exposition format
+        """
+        lines: typing.List[str] = []
+
+        def counter(name, description, values, label):
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for key, value in sorted(values.items()):
+                lines.append(f'{prefix}_{name}{{{label}="{key}"}} {value}')
+
+        def histogram(name, description, histograms, label):
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for key, values in sorted(histograms.items()):
+                for bound, count in values.cumulative():
+                    lines.append(
+                        f'{prefix}_{name}_bucket{{{label}="{key}",le="{bound}"}} {count}'
+                    )
+                lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {values.sum}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {values.count}')
+
+        with self._lock:
+            counter("api_calls_total", "MTurk API calls", self.api_calls, "operation")
+            counter(
+                "api_retries_total",
+                "MTurk API retry attempts",
+                self.api_retries,
+                "operation",
+            )
+            counter(
+                "api_throttles_total",
+                "Throttled MTurk API attempts",
+                self.api_throttles,
+                "operation",
+            )
+            lines.append(f"# HELP {prefix}_api_errors_total Failed MTurk API calls")
+            lines.append(f"# TYPE {prefix}_api_errors_total counter")
+            for (operation, code), value in sorted(self.api_errors.items()):
+                lines.append(
+                    f'{prefix}_api_errors_total{{operation="{operation}",code="{code}"}} {value}'
+                )
+            histogram(
+                "api_latency_seconds",
+                "MTurk API call latency, including retries",
+                self.api_latency,
+                "operation",
+            )
+            counter(
+                "sql_queries_total", "SQL statements", self.sql_queries, "statement"
+            )
+            histogram(
+                "sql_latency_seconds",
+                "SQL statement latency",
+                self.sql_latency,
+                "statement",
+            )
+            counter(
+                "rows_written_total",
+                "Rows inserted, updated or deleted",
+                self.rows_written,
+                "table",
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        Return a one-line human-readable summary
+        """
+        with self._lock:
+            api_seconds = sum(h.sum for h in self.api_latency.values())
+            sql_seconds = sum(h.sum for h in self.sql_latency.values())
+            return (
+                f"{sum(self.api_calls.values())} API calls ({api_seconds:.2f}s, "
+                f"{sum(self.api_retries.values())} retries, "
+                f"{sum(self.api_throttles.values())} throttled), "
+                f"{sum(self.sql_queries.values())} SQL statements ({sql_seconds:.2f}s), "
+                f"{sum(self.rows_written.values())} rows written"
+            )
+
+
+def instrument_client(client, metrics: Metrics) -> typing.Callable[[], None]:
+    """
+    Record every API call made through the given boto3 client (or fake client)
+
+    Returns a function that removes the instrumentation.
+    """
+    events = client.meta.events
+    unique_id = f"objective_turk.instrumentation.{uuid.uuid4()}"
+
+    def before_call(context=None, **kwargs):
+        if context is not None:
+            context[_START_KEY] = time.perf_counter()
+
+    def elapsed(context):
+        started = (context or {}).get(_START_KEY)
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def after_call(model=None, parsed=None, context=None, **kwargs):
+        # botocore fires after-call for error responses too, before raising ClientError
+        parsed = parsed or {}
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        code = parsed.get("Error", {}).get("Code")
+        metrics.record_api_call(model.name, elapsed(context), retries, code)
+
+    def after_call_error(exception=None, context=None, event_name=None, **kwargs):
+        # Fired for exceptions raised before a response was parsed, e.g. connection errors
+        operation = event_name.rsplit(".", 1)[-1]
+        response = getattr(exception, "response", None) or {}
+        code = response.get("Error", {}).get("Code") or type(exception).__name__
+        retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        metrics.record_api_call(operation, elapsed(context), retries, code)
+
+    def needs_retry(response=None, operation=None, **kwargs):
+        if response is None:
+            return
+        code = (response[1] or {}).get("Error", {}).get("Code")
+        if code in THROTTLING_ERROR_CODES:
+            metrics.record_throttle(operation.name)
+
+    handlers = [
+        ("before-call.mturk", before_call),
+        ("after-call.mturk", after_call),
+        ("after-call-error.mturk", after_call_error),
+        ("needs-retry.mturk", needs_retry),
+    ]
+    for event_name, handler in handlers:
+        events.register(event_name, handler, unique_id=f"{unique_id}.{event_name}")
+
+    def uninstrument():
+        for event_name, handler in handlers:
+            events.unregister(
+                event_name, handler, unique_id=f"{unique_id}.{event_name}"
+            )
+
+    return uninstrument
+
+
+def instrument_database(
+    database: peewee.Database, metrics: Metrics
+) -> typing.Callable[[], None]:
+    """
+    Record every SQL statement executed through the given database
+
+    Returns a function that removes the instrumentation.
+    """
+    execute_sql = database.execute_sql
+    had_override = "execute_sql" in vars(database)
+
+    def instrumented_execute_sql(sql, *args, **kwargs):
+        started = time.perf_counter()
+        cursor = execute_sql(sql, *args, **kwargs)
+        seconds = time.perf_counter() - started
+
+        statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "?"
+        match = _WRITE_STATEMENT.match(sql)
+        if match is not None:
+            table = next(group for group in match.groups() if group is not None)
+            metrics.record_query(statement, seconds, table, max(cursor.rowcount, 0))
+        else:
+            metrics.record_query(statement, seconds)
+        return cursor
+
+    database.execute_sql = instrumented_execute_sql
+
+    def uninstrument():
+        if had_override:
+            database.execute_sql = execute_sql
+        else:
+            del database.execute_sql
+
+    return uninstrument
+
+
+@contextlib.contextmanager
+def profile(
+    client=None,
+    database: typing.Optional[peewee.Database] = None,
+    metrics: typing.Optional[Metrics] = None,
+) -> typing.Iterator[Metrics]:
+    """
+    Collect metrics for everything run inside the with-block
+
+    By default, instruments the current MTurk client and database.
+    """
+    if client is None:
+        client = objective_turk.client()
+    if database is None:
+        database = objective_turk.get_database()
+    if metrics is None:
+        metrics = Metrics()
+
+    uninstrument_client = instrument_client(client, metrics)
+    uninstrument_database = instrument_database(database, metrics)
+    started = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.wall_time = time.perf_counter() - started
+        uninstrument_database()
+        uninstrument_client()
+        logger.info("Profiled %.2fs: %s", metrics.wall_time, metrics.summary())
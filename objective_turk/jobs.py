@@ -0,0 +1,234 @@
+"""
+A journal of bulk operations, kept in the local database, so they can be resumed
+
+Every item of a journaled job (see objective_turk.bulk) has a row recording
+whether it is still pending, succeeded, was skipped, or failed (and why).
+Items are marked done in the same transaction as their results are saved,
+so after a crash, resuming the job only processes what's left.
+Failed items form the job's dead letters, and can be retried on their own.
+
+Items that were in flight during a crash are retried when the job is resumed;
+this is safe, because approvals and rejections check the assignment's status,
+and bonuses and HITs are sent with a UniqueRequestToken.
+"""
+
+import argparse
+import logging
+import typing
+
+import peewee
+
+from objective_turk import bulk
+from objective_turk import ledger
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Item statuses
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Job statuses
+RUNNING = "running"
+FINISHED = "finished"
+INCOMPLETE = "incomplete"  # finished, but some items failed
+
+
+class Job(objective_turk.BaseModel):
+    """
+    A bulk operation, with the parameters needed to run it again
+    """
+
+    id = peewee.AutoField()
+    operation = peewee.CharField(max_length=64)
+    parameters = objective_turk.SerializableJSONField()
+    status = peewee.CharField(
+        max_length=16,
+        default=RUNNING,
+        index=True,
+        choices=((RUNNING, RUNNING), (FINISHED, FINISHED), (INCOMPLETE, INCOMPLETE)),
+    )
+
+    def __str__(self):
+        return f"Job {self.id} ({self.operation}, {self.status})"
+
+    def counts(self) -> typing.Dict[str, int]:
+        """
+        Return the number of items with each status
+        """
+        return dict(
+            JobItem.select(JobItem.status, peewee.fn.COUNT(JobItem.id))
+            .where(JobItem.job == self)
+            .group_by(JobItem.status)
+            .tuples()
+        )
+
+    def dead_letters(self) -> peewee.ModelSelect:
+        """
+        Return a query for the items that failed, with their errors
+        """
+        return self.items.where(JobItem.status == FAILED)
+
+    def operation_instance(self) -> bulk.Operation:
+        return bulk.Operation.from_parameters(self.operation, self.parameters)
+
+
+class JobItem(objective_turk.BaseModel):
+    """
+    One item of a job, and what became of it
+    """
+
+    job = peewee.ForeignKeyField(
+        Job, on_delete=objective_turk.CASCADE, backref="items", column_name="JobId"
+    )
+    item = peewee.CharField(max_length=256)
+    payload = objective_turk.SerializableJSONField(null=True)
+    status = peewee.CharField(
+        max_length=16,
+        default=PENDING,
+        choices=(
+            (PENDING, PENDING),
+            (SUCCEEDED, SUCCEEDED),
+            (SKIPPED, SKIPPED),
+            (FAILED, FAILED),
+        ),
+    )
+    attempts = peewee.IntegerField(default=0)
+    error = peewee.TextField(null=True)
+
+    class Meta:
+        indexes = ((("job", "item"), True), (("job", "status"), False))
+
+    def __str__(self):
+        return f"{self.item} ({self.status})"
+
+
+objective_turk.register_models(Job, JobItem)
+
+
+def create(operation: bulk.Operation, items: bulk.Items) -> Job:
+    """
+    Record a new job for the given operation and items, without running it yet
+    """
+    payloads = bulk.with_payloads(items)
+    with objective_turk.get_database().atomic():
+        job = Job.create(operation=operation.name, parameters=operation.parameters())
+        rows = [
+            {"job": job.id, "item": item_id, "payload": payload}
+            for item_id, payload in payloads.items()
+        ]
+        # Stay well below SQLite's limit on the number of variables in a query
+        for start in range(0, len(rows), 100):
+            JobItem.insert_many(rows[start : start + 100]).execute()
+    logger.info("Created %s with %d items", job, len(payloads))
+    return job
+
+
+def resume(
+    job: Job,
+    retry_failed: bool = False,
+    max_workers: int = bulk.DEFAULT_MAX_WORKERS,
+    rate: typing.Optional[float] = None,
+    batch_size: int = 100,
+    budget: typing.Optional[ledger.Budget] = None,
+) -> bulk.BulkResult:
+    """
+    Run the job's pending items (and, with retry_failed, its failed ones)
+
+    A job that was interrupted, even mid-batch, can be resumed this way;
+    items that are already done aren't repeated. Items that would have exceeded
+    the budget (see bulk.run) are failed, so they can be retried with a larger one.
+    """
+    statuses = [PENDING, FAILED] if retry_failed else [PENDING]
+    payloads = dict(
+        JobItem.select(JobItem.item, JobItem.payload)
+        .where((JobItem.job == job) & (JobItem.status.in_(statuses)))
+        .order_by(JobItem.id)
+        .tuples()
+    )
+    logger.info("Running %s: %d items to go", job, len(payloads))
+
+    def record(item_id: str, status: str, detail: typing.Optional[str]) -> None:
+        update = {JobItem.status: status, JobItem.updated_at: objective_turk.now_utc()}
+        if status == SKIPPED:
+            update[JobItem.error] = None
+        else:
+            update[JobItem.attempts] = JobItem.attempts + 1
+            update[JobItem.error] = detail
+        JobItem.update(update).where(
+            (JobItem.job == job) & (JobItem.item == item_id)
+        ).execute()
+
+    job.status = RUNNING
+    job.save()
+    result = bulk.run(
+        job.operation_instance(),
+        payloads,
+        max_workers=max_workers,
+        rate=rate,
+        batch_size=batch_size,
+        on_item=record,
+        budget=budget,
+    )
+
+    job.status = INCOMPLETE if job.dead_letters().count() > 0 else FINISHED
+    job.save()
+    logger.info("%s: %s", job, job.counts())
+    return result
+
+
+def run(
+    operation: bulk.Operation, items: bulk.Items, **options
+) -> typing.Tuple[Job, bulk.BulkResult]:
+    """
+    Record a new job and run it (with the options of resume)
+    """
+    job = create(operation, items)
+    return job, resume(job, **options)
+
+
+def retry_failed(job: Job, **options) -> bulk.BulkResult:
+    """
+    Run the job's failed items again (with the options of resume)
+    """
+    return resume(job, retry_failed=True, **options)
+
+
+def dead_letters() -> peewee.ModelSelect:
+    """
+    Return a query for the failed items of all jobs
+    """
+    return JobItem.select().where(JobItem.status == FAILED)
+
+
+def unfinished() -> peewee.ModelSelect:
+    """
+    Return a query for the jobs that were interrupted or have failed items
+    """
+    return Job.select().where(Job.status != FINISHED).order_by(Job.id)
+
+
+def run_from_args(
+    args: argparse.Namespace, operation: bulk.Operation
+) -> bulk.BulkResult:
+    """
+    Run a journaled job according to the common command-line arguments of bulk scripts:
+    either a new one for the given operation, or the one to --resume
+    (whose own operation is used instead)
+    """
+    budget = ledger.Budget(args.budget) if args.budget is not None else None
+    if args.resume is not None:
+        job = Job.get_by_id(args.resume)
+        return resume(
+            job, args.retry_failed, args.max_workers, args.rate, budget=budget
+        )
+
+    job = create(operation, bulk.ids_from_args(args))
+    logger.info(
+        "If this is interrupted, continue with --resume %d (add --retry-failed "
+        "to also retry failures)",
+        job.id,
+    )
+    return resume(job, False, args.max_workers, args.rate, budget=budget)
@@ -0,0 +1,392 @@
+"""
+A local ledger of what has been spent (or committed) on HITs and bonuses
+
+Every HIT commits its reward for each of its MaxAssignments, plus MTurk's fees;
+every bonus costs its amount plus fees. The ledger keeps one entry per HIT
+and per bonus, which save hooks update whenever a HIT is saved (e.g., created,
+downloaded, or extended) and whenever a bonus is recorded, so totals by
+project, HITType or day are simple aggregate queries, with no API calls.
+
+A HIT's entry is what it may cost at most: MTurk doesn't charge for
+assignments that are never submitted, or that are rejected. Fees follow
+MTurk's pricing: 20% of rewards and bonuses (at least $0.01 each), another
+20% of rewards for HITs with 10 or more assignments, and 5% for HITs
+requiring the Masters qualification. Change FEE_RATES if that ever changes.
+
+A Budget caps total spending; bulk.run checks one before each batch of HITs
+or bonuses (see bulk.Operation.cost). rebuild recomputes the whole ledger.
+"""
+
+import datetime
+import decimal
+import logging
+import typing
+
+import peewee
+
+from objective_turk import archive
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+CENT = decimal.Decimal("0.01")
+
+FEE_RATES = {
+    "commission": decimal.Decimal("0.20"),
+    # For HITs with at least LARGE_HIT_ASSIGNMENTS assignments
+    "large_hit": decimal.Decimal("0.20"),
+    "masters": decimal.Decimal("0.05"),
+}
+MINIMUM_FEE = CENT
+LARGE_HIT_ASSIGNMENTS = 10
+
+MASTERS_QUALIFICATION_TYPES = {
+    "2ARFPLSP75KLA8M8DH1HTEQVJT3SY6",  # sandbox
+    "2F1QJWKUDD8XADTFD2Q0G6UTO95ALH",
+    "2F1KVCNHMVHV8E9PBUB2A4J79LU20F",  # sandbox categorization
+    "2NDP2L92HECWY8NS8H3CK0CP5L9GHO",
+    "2TGBB6BFMFFOM08IBMAFGGESC1UWJX",  # sandbox photo moderation
+    "21VZU98JHSTLZ5BPP4A9NOBJEK3DPG",
+}
+
+# Entry kinds
+HIT = "hit"
+BONUS = "bonus"
+
+GROUPINGS = ("project", "hit_type", "day")
+
+
+class LedgerEntry(objective_turk.BaseModel):
+    """
+    The cost of a HIT (its rewards, for all of its assignments) or of a bonus
+    """
+
+    id = peewee.AutoField()
+    kind = peewee.CharField(max_length=16, choices=((HIT, HIT), (BONUS, BONUS)))
+    hit = peewee.CharField(max_length=256, null=True, index=True, column_name="HITId")
+    hit_type = peewee.CharField(max_length=256, null=True, column_name="HITTypeId")
+    project = peewee.CharField(max_length=256, null=True, index=True)
+    worker = peewee.CharField(max_length=256, null=True, column_name="WorkerId")
+    # When the HIT was created or the bonus was granted (UTC)
+    day = peewee.DateField(index=True)
+    amount = peewee.DecimalField(decimal_places=2, auto_round=True)
+    fee = peewee.DecimalField(decimal_places=2, auto_round=True)
+
+    def __str__(self):
+        return (
+            f"{self.kind} {self.hit or self.worker}: ${self.amount} + ${self.fee} fees"
+        )
+
+    @property
+    def total(self) -> decimal.Decimal:
+        return decimal.Decimal(str(self.amount)) + decimal.Decimal(str(self.fee))
+
+
+objective_turk.register_models(LedgerEntry)
+
+
+class Totals(typing.NamedTuple):
+    group: typing.Any
+    rewards: decimal.Decimal
+    bonuses: decimal.Decimal
+    fees: decimal.Decimal
+
+    @property
+    def total(self) -> decimal.Decimal:
+        return self.rewards + self.bonuses + self.fees
+
+
+class BudgetExceeded(Exception):
+    """
+    Spending more would exceed a budget
+    """
+
+
+class Budget:
+    """
+    A limit on total spending (on one project, if given), as recorded in the ledger
+    """
+
+    def __init__(
+        self,
+        limit: typing.Union[decimal.Decimal, str, int],
+        project: typing.Optional[str] = None,
+    ):
+        self.limit = decimal.Decimal(str(limit))
+        self.project = project
+
+    def __repr__(self):
+        scope = f" for {self.project}" if self.project is not None else ""
+        return f"<Budget of ${self.limit}{scope}>"
+
+    def spent(self) -> decimal.Decimal:
+        return spent(self.project)
+
+    def remaining(self) -> decimal.Decimal:
+        return self.limit - self.spent()
+
+
+def _money(value: typing.Any) -> decimal.Decimal:
+    return decimal.Decimal(str(value or 0)).quantize(CENT)
+
+
+def reward_fee(
+    reward: typing.Union[decimal.Decimal, str],
+    assignments: int = 1,
+    masters: bool = False,
+) -> decimal.Decimal:
+    """
+    Return MTurk's fees on the reward of the given number of assignments
+    """
+    rate = FEE_RATES["commission"]
+    if assignments >= LARGE_HIT_ASSIGNMENTS:
+        rate += FEE_RATES["large_hit"]
+    if masters:
+        rate += FEE_RATES["masters"]
+    per_assignment = max(
+        (_money(reward) * rate).quantize(CENT, rounding=decimal.ROUND_HALF_UP),
+        MINIMUM_FEE,
+    )
+    return per_assignment * assignments
+
+
+def bonus_fee(amount: typing.Union[decimal.Decimal, str]) -> decimal.Decimal:
+    """
+    Return MTurk's fee on a bonus of the given amount
+    """
+    return max(
+        (_money(amount) * FEE_RATES["commission"]).quantize(
+            CENT, rounding=decimal.ROUND_HALF_UP
+        ),
+        MINIMUM_FEE,
+    )
+
+
+def requires_masters(qualification_requirements: typing.Optional[typing.List]) -> bool:
+    return any(
+        requirement.get("QualificationTypeId") in MASTERS_QUALIFICATION_TYPES
+        for requirement in qualification_requirements or []
+    )
+
+
+def hit_cost(
+    reward: typing.Union[decimal.Decimal, str],
+    max_assignments: int,
+    qualification_requirements: typing.Optional[typing.List] = None,
+) -> typing.Tuple[decimal.Decimal, decimal.Decimal]:
+    """
+    Return the rewards and fees a HIT with the given parameters commits
+    """
+    fees = reward_fee(
+        reward, max_assignments, requires_masters(qualification_requirements)
+    )
+    return _money(reward) * max_assignments, fees
+
+
+def _day(value: typing.Union[datetime.datetime, str, None]) -> datetime.date:
+    value = objective_turk._as_datetime(value)  # pylint: disable=protected-access
+    if value is None:
+        return objective_turk.now_utc().date()
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.date()
+
+
+def _hit_entry(hit: typing.Dict) -> typing.Dict:
+    amount, fee = hit_cost(
+        hit.get("Reward", 0),
+        int(hit.get("MaxAssignments", 0)),
+        hit.get("QualificationRequirements"),
+    )
+    return {
+        "kind": HIT,
+        "hit": hit["HITId"],
+        "hit_type": hit.get("HITTypeId"),
+        "project": objective_turk.Hit.project_from_annotation(
+            hit.get("RequesterAnnotation")
+        ),
+        "day": _day(hit.get("CreationTime")),
+        "amount": amount,
+        "fee": fee,
+    }
+
+
+def _bonus_entry(
+    bonus: typing.Dict, hit: typing.Optional[typing.Tuple[str, str, str]]
+) -> typing.Dict:
+    hit_id, hit_type, project = hit if hit is not None else (None, None, None)
+    return {
+        "kind": BONUS,
+        "hit": hit_id,
+        "hit_type": hit_type,
+        "project": project,
+        "worker": bonus["WorkerId"],
+        "day": _day(bonus.get("GrantTime")),
+        "amount": _money(bonus["BonusAmount"]),
+        "fee": bonus_fee(bonus["BonusAmount"]),
+    }
+
+
+def _hit_of_assignment(
+    assignment_id: str,
+) -> typing.Optional[typing.Tuple[str, str, str]]:
+    Assignment = objective_turk.Assignment
+    Hit = objective_turk.Hit
+    return (
+        Hit.select(Hit.id, Hit.hit_type, Hit.project)
+        .join(Assignment, on=(Assignment.hit == Hit.id))
+        .where(Assignment.id == assignment_id)
+        .tuples()
+        .first()
+    )
+
+
+# The fields of a HIT that its ledger entry depends on
+COSTED_FIELDS = ("Reward", "MaxAssignments", "RequesterAnnotation")
+
+
+def _on_hit_saved(previous: typing.Optional[typing.Dict], current: typing.Dict) -> None:
+    if previous is not None and all(
+        previous.get(key) == current.get(key) for key in COSTED_FIELDS
+    ):
+        return
+    LedgerEntry.delete().where(
+        (LedgerEntry.kind == HIT) & (LedgerEntry.hit == current["HITId"])
+    ).execute()
+    LedgerEntry.insert(_hit_entry(current)).execute()
+
+
+def _on_bonus_saved(
+    previous: typing.Optional[typing.Dict], current: typing.Dict
+) -> None:
+    hit = _hit_of_assignment(current["AssignmentId"])
+    LedgerEntry.insert(_bonus_entry(current, hit)).execute()
+
+
+objective_turk.on_save(objective_turk.Hit, _on_hit_saved, fields=COSTED_FIELDS)
+objective_turk.on_save(objective_turk.BonusPayment, _on_bonus_saved, fields=[])
+
+
+# Archived HITs and assignments count too
+@archive.including_archived_if_any()
+def rebuild() -> int:
+    """
+    Recompute the ledger from the HITs and bonuses in the database,
+    returning the number of entries
+    """
+    Hit = objective_turk.Hit
+    BonusPayment = objective_turk.BonusPayment
+    Assignment = objective_turk.Assignment
+
+    entries = [
+        _hit_entry(details)
+        for (details,) in Hit.select(Hit.details).tuples().iterator()
+    ]
+    hits = {
+        assignment_id: (hit_id, hit_type, project)
+        for assignment_id, hit_id, hit_type, project in Assignment.select(
+            Assignment.id, Hit.id, Hit.hit_type, Hit.project
+        )
+        .join(Hit, on=(Assignment.hit == Hit.id))
+        .tuples()
+        .iterator()
+    }
+    for bonus in BonusPayment.select().iterator():
+        details = {
+            "WorkerId": bonus.worker,
+            "BonusAmount": bonus.BonusAmount,
+            "GrantTime": bonus.GrantTime,
+        }
+        entries.append(_bonus_entry(details, hits.get(bonus.assignment)))
+
+    with objective_turk.get_database().atomic():
+        LedgerEntry.delete().execute()
+        # Stay well below SQLite's limit on the number of variables in a query
+        for start in range(0, len(entries), 50):
+            LedgerEntry.insert_many(entries[start : start + 50]).execute()
+    logger.info("Rebuilt the ledger: %d entries", len(entries))
+    return len(entries)
+
+
+# A database upgraded from a version without the ledger already has spending to count,
+# which budgets must see
+objective_turk.register_backfill(LedgerEntry, rebuild)
+
+
+def _scope(
+    query: peewee.ModelSelect,
+    project: typing.Optional[str],
+    since: typing.Optional[datetime.date],
+    until: typing.Optional[datetime.date],
+) -> peewee.ModelSelect:
+    if project is not None:
+        query = query.where(LedgerEntry.project == project)
+    if since is not None:
+        query = query.where(LedgerEntry.day >= since)
+    if until is not None:
+        query = query.where(LedgerEntry.day <= until)
+    return query
+
+
+def spent(
+    project: typing.Optional[str] = None,
+    since: typing.Optional[datetime.date] = None,
+    until: typing.Optional[datetime.date] = None,
+) -> decimal.Decimal:
+    """
+    Return the total committed to HITs and bonuses (including fees),
+    optionally only for one project, or between the given days (inclusive)
+    """
+    total = _scope(
+        LedgerEntry.select(peewee.fn.SUM(LedgerEntry.amount + LedgerEntry.fee)),
+        project,
+        since,
+        until,
+    ).scalar()
+    return _money(total)
+
+
+def totals(
+    by: str = "project",
+    project: typing.Optional[str] = None,
+    since: typing.Optional[datetime.date] = None,
+    until: typing.Optional[datetime.date] = None,
+) -> typing.List[Totals]:
+    """
+    Return rewards, bonuses and fees, grouped by project, hit_type or day
+    """
+    if by not in GROUPINGS:
+        raise ValueError(f"can't group by {by}; choose one of {', '.join(GROUPINGS)}")
+    group = getattr(LedgerEntry, by)
+
+    def total_of(kind: typing.Optional[str], column: peewee.Field) -> peewee.Node:
+        if kind is None:
+            return peewee.fn.SUM(column)
+        return peewee.fn.SUM(peewee.Case(None, [(LedgerEntry.kind == kind, column)], 0))
+
+    query = _scope(
+        LedgerEntry.select(
+            group,
+            total_of(HIT, LedgerEntry.amount),
+            total_of(BONUS, LedgerEntry.amount),
+            total_of(None, LedgerEntry.fee),
+        )
+        .group_by(group)
+        .order_by(group),
+        project,
+        since,
+        until,
+    )
+    return [
+        Totals(
+            (
+                datetime.date.fromisoformat(key)
+                if by == "day" and isinstance(key, str)
+                else key
+            ),
+            _money(rewards),
+            _money(bonuses),
+            _money(fees),
+        )
+        for key, rewards, bonuses, fees in query.tuples()
+    ]
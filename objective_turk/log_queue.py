@@ -0,0 +1,103 @@
+"""
+Non-blocking and sampled logging for high-volume code paths
+
+Records are handed to a queue on the calling thread, and formatted and written
+by a background listener thread, so a slow handler (like a colored console)
+doesn't hold up syncs. Per-row messages go to a dedicated "rows" logger, which
+can be sampled.
+"""
+
+import atexit
+import copy
+import itertools
+import logging
+import logging.handlers
+import queue
+import threading
+import typing
+
+_listener: typing.Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+class DeferredFormattingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves formatting to the listener thread
+
+    The standard QueueHandler formats every record before enqueueing it,
+    so that it can be pickled. Our queue never leaves the process, so only the message
+    is merged with its arguments here: they may be models, whose __str__ can query
+    the caller's session, and which may change by the time the listener gets to them.
+    Handler formatting (timestamps, colors, tracebacks) is still left to the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # A copy, since other handlers of the same logger get the original
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through only one in every `every` records
+
+    Sampling is deterministic (the first record, then every Nth),
+    so the same run always logs the same rows.
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        if every < 1:
+            raise ValueError("sampling interval must be at least 1")
+        self.every = every
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return next(self._counter) % self.every == 0
+
+
+def start(handlers: typing.Iterable[logging.Handler]) -> logging.Handler:
+    """
+    Start a background listener that passes queued records to the given handlers
+
+    Returns the handler to attach to loggers. Calling this again replaces the
+    previous listener, after flushing any records it still holds.
+    """
+    global _listener
+    log_queue: queue.Queue = queue.Queue()
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        _listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+    return DeferredFormattingQueueHandler(log_queue)
+
+
+def stop() -> None:
+    """
+    Write out any queued records and stop the background listener
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def sample_rows(logger: logging.Logger, every: typing.Optional[int]) -> None:
+    """
+    Log only one in every `every` per-row records from the given logger
+    (or all of them, if `every` is None)
+    """
+    for existing in list(logger.filters):
+        if isinstance(existing, SamplingFilter):
+            logger.removeFilter(existing)
+    if every is not None and every > 1:
+        logger.addFilter(SamplingFilter(every))
+
+
+atexit.register(stop)
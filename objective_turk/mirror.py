@@ -0,0 +1,312 @@
+"""
+A DuckDB copy of the local database, for analytical queries
+
+Requires duckdb and pyarrow (pip install objective-turk[mirror]). SQLite stays
+the store that everything else reads and writes; the mirror is a separate file
+(by default next to it, e.g. turk_production.duckdb) that sync brings up to date:
+
+    mirror = Mirror()
+    mirror.sync()
+    mirror.query(
+        "SELECT HITId, AssignmentStatus, COUNT(*) FROM assignment GROUP BY ALL"
+    ).fetchall()
+
+The tables are named like SQLite's, with the same columns, plus the fields of
+details listed in DETAIL_COLUMNS as typed columns of their own (e.g., hit.Reward
+as a number, and assignment.ApprovalTime as a timestamp); details itself is kept
+as JSON text, for anything else. An answer table has one row per answer of each
+assignment: AssignmentId, QuestionIdentifier and FreeText.
+
+Syncs are incremental: only rows updated since the last sync (by updated_at)
+are copied, and rows deleted from SQLite (e.g., archived) are deleted here too.
+A table whose SQLite columns changed (after an upgrade) is copied again in full.
+Nothing is mirrored as it is saved, so syncing MTurk data isn't slowed down;
+call sync (or run mirror_query) whenever you want fresh results.
+"""
+
+import datetime
+import json
+import logging
+import pathlib
+import typing
+
+import duckdb
+import peewee
+import pyarrow
+
+from objective_turk import frames
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Fields of details to copy into columns of their own, by model
+DETAIL_COLUMNS: typing.Dict[str, typing.Dict[str, type]] = {
+    "Hit": {
+        "Title": str,
+        "Description": str,
+        "Keywords": str,
+        "HITGroupId": str,
+        "HITLayoutId": str,
+        "HITStatus": str,
+        "HITReviewStatus": str,
+        "RequesterAnnotation": str,
+        "Reward": float,
+        "MaxAssignments": int,
+        "NumberOfAssignmentsPending": int,
+        "NumberOfAssignmentsAvailable": int,
+        "NumberOfAssignmentsCompleted": int,
+        "AssignmentDurationInSeconds": int,
+        "AutoApprovalDelayInSeconds": int,
+        "CreationTime": datetime.datetime,
+        "Expiration": datetime.datetime,
+    },
+    "Assignment": {
+        "AutoApprovalTime": datetime.datetime,
+        "ApprovalTime": datetime.datetime,
+        "RejectionTime": datetime.datetime,
+        "Deadline": datetime.datetime,
+        "RequesterFeedback": str,
+    },
+    "QualificationType": {
+        "Name": str,
+        "Description": str,
+        "Keywords": str,
+        "QualificationTypeStatus": str,
+        "IsRequestable": bool,
+        "AutoGranted": bool,
+        "CreationTime": datetime.datetime,
+    },
+    "Qualification": {
+        "IntegerValue": int,
+    },
+}
+
+ANSWER_TABLE = "answer"
+
+# Rows updated up to this long before the last sync's newest row are copied again,
+# in case they were committed (by another thread or process) after that sync read them
+OVERLAP = datetime.timedelta(minutes=1)
+
+
+def _mirrored_models() -> typing.List[typing.Type[objective_turk.BaseModel]]:
+    return [
+        objective_turk.Worker,
+        objective_turk.QualificationType,
+        objective_turk.Qualification,
+        objective_turk.Hit,
+        objective_turk.Assignment,
+        objective_turk.BonusPayment,
+    ]
+
+
+def _key_columns(model: typing.Type[objective_turk.BaseModel]) -> typing.List[str]:
+    primary_key = model._meta.primary_key
+    if isinstance(primary_key, peewee.CompositeKey):
+        return [
+            model._meta.fields[name].column_name for name in primary_key.field_names
+        ]
+    return [primary_key.column_name]
+
+
+def _join_on(columns: typing.List[str], left: str, right: str) -> str:
+    return " AND ".join(f'{left}."{column}" = {right}."{column}"' for column in columns)
+
+
+class SyncResult(typing.NamedTuple):
+    # Rows copied and deleted, by table
+    copied: typing.Dict[str, int]
+    deleted: typing.Dict[str, int]
+
+
+class Mirror:
+    """
+    A DuckDB file mirroring the current session's SQLite database
+    """
+
+    def __init__(self, path: typing.Union[str, pathlib.Path, None] = None):
+        if path is None:
+            live = pathlib.Path(objective_turk.get_database().database)
+            path = live.with_suffix(".duckdb")
+        self.path = pathlib.Path(path)
+        self.connection = duckdb.connect(str(self.path))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS _mirror_state "
+            "(table_name VARCHAR PRIMARY KEY, synced_until BIGINT, columns VARCHAR)"
+        )
+
+    def __repr__(self):
+        return f"<Mirror {self.path}>"
+
+    def __enter__(self) -> "Mirror":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def query(
+        self, sql: str, parameters: typing.Optional[typing.Sequence] = None
+    ) -> duckdb.DuckDBPyConnection:
+        """
+        Run an SQL query against the mirror; read its results with fetchall(),
+        arrow() or df()
+        """
+        return self.connection.execute(sql, parameters)
+
+    def sync(self, full: bool = False) -> SyncResult:
+        """
+        Copy what changed in SQLite since the last sync (or, with full, everything)
+        """
+        copied = {}
+        deleted = {}
+        for model in _mirrored_models():
+            table = model._meta.table_name
+            copied[table], deleted[table] = self._sync_table(model, full)
+        logger.info("Synced %s: %s", self, copied)
+        return SyncResult(copied, deleted)
+
+    def _state(self, table: str) -> typing.Tuple[typing.Optional[int], str]:
+        row = self.connection.execute(
+            "SELECT synced_until, columns FROM _mirror_state WHERE table_name = ?",
+            [table],
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else (None, "")
+
+    def _exists(self, table: str) -> bool:
+        return bool(
+            self.connection.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                [table],
+            ).fetchone()[0]
+        )
+
+    def _sync_table(
+        self, model: typing.Type[objective_turk.BaseModel], full: bool
+    ) -> typing.Tuple[int, int]:
+        table = model._meta.table_name
+        columns = ",".join(
+            column.name for column in objective_turk.get_database().get_columns(table)
+        )
+        synced_until, synced_columns = self._state(table)
+        if columns != synced_columns:
+            # New columns may have been filled in for every row, so copy them all again
+            full = True
+
+        # Every column, including the raw details, which a default select would leave out
+        query = model.select(*model._meta.sorted_fields)
+        updated = objective_turk.epoch_milliseconds(model.updated_at)
+        if not full and synced_until is not None:
+            overlap = int(OVERLAP.total_seconds() * 1000)
+            query = query.where(updated >= synced_until - overlap)
+        details = DETAIL_COLUMNS.get(model.__name__)
+        rows = frames.to_arrow(query, details)
+
+        keys = _key_columns(model)
+        connection = self.connection
+        connection.begin()
+        try:
+            connection.register("changed", rows)
+            if full or not self._exists(table):
+                connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+                connection.execute(f'CREATE TABLE "{table}" AS SELECT * FROM changed')
+            elif rows.num_rows:
+                connection.execute(
+                    f'DELETE FROM "{table}" USING changed '
+                    f'WHERE {_join_on(keys, table, "changed")}'
+                )
+                connection.execute(
+                    f'INSERT INTO "{table}" BY NAME SELECT * FROM changed'
+                )
+            connection.unregister("changed")
+
+            if model is objective_turk.Assignment:
+                self._sync_answers(rows, full)
+            deleted = self._delete_missing(model, keys)
+
+            newest = connection.execute(
+                f'SELECT epoch_ms(MAX("updated_at")) FROM "{table}"'
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT OR REPLACE INTO _mirror_state VALUES (?, ?, ?)",
+                [table, newest, columns],
+            )
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        return rows.num_rows, deleted
+
+    def _sync_answers(self, assignments: pyarrow.Table, full: bool) -> None:
+        # Answers are parsed in Python, but only for the assignments that changed
+        assignment_ids = []
+        questions = []
+        answers = []
+        for assignment_id, details in zip(
+            assignments.column("AssignmentId").to_pylist(),
+            assignments.column("details").to_pylist(),
+        ):
+            answer_xml = json.loads(details).get("Answer")
+            if not answer_xml:
+                continue
+            for question, answer in objective_turk.parse_answers(answer_xml).items():
+                assignment_ids.append(assignment_id)
+                questions.append(question)
+                answers.append(answer)
+        rows = pyarrow.table(
+            {
+                "AssignmentId": pyarrow.array(assignment_ids, pyarrow.string()),
+                "QuestionIdentifier": pyarrow.array(questions, pyarrow.string()),
+                "FreeText": pyarrow.array(answers, pyarrow.string()),
+            }
+        )
+
+        connection = self.connection
+        connection.register("changed_answers", rows)
+        if full or not self._exists(ANSWER_TABLE):
+            connection.execute(f'DROP TABLE IF EXISTS "{ANSWER_TABLE}"')
+            connection.execute(
+                f'CREATE TABLE "{ANSWER_TABLE}" AS SELECT * FROM changed_answers'
+            )
+        else:
+            connection.register(
+                "changed_assignments", assignments.select(["AssignmentId"])
+            )
+            connection.execute(
+                f'DELETE FROM "{ANSWER_TABLE}" WHERE "AssignmentId" IN '
+                '(SELECT "AssignmentId" FROM changed_assignments)'
+            )
+            connection.unregister("changed_assignments")
+            connection.execute(
+                f'INSERT INTO "{ANSWER_TABLE}" SELECT * FROM changed_answers'
+            )
+        connection.unregister("changed_answers")
+
+    def _delete_missing(
+        self, model: typing.Type[objective_turk.BaseModel], keys: typing.List[str]
+    ) -> int:
+        # Rows are only ever added by syncs, so if there are more here than in SQLite,
+        # some were deleted there
+        table = model._meta.table_name
+        connection = self.connection
+        mirrored = connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        if mirrored == model.select().count():
+            return 0
+
+        key_fields = [
+            field for field in model._meta.sorted_fields if field.column_name in keys
+        ]
+        connection.register("live_keys", frames.to_arrow(model.select(*key_fields)))
+        deleted = connection.execute(
+            f'DELETE FROM "{table}" WHERE NOT EXISTS (SELECT 1 FROM live_keys '
+            f'WHERE {_join_on(keys, table, "live_keys")})'
+        ).fetchone()[0]
+        connection.unregister("live_keys")
+        if model is objective_turk.Assignment:
+            connection.execute(
+                f'DELETE FROM "{ANSWER_TABLE}" WHERE "AssignmentId" NOT IN '
+                f'(SELECT "AssignmentId" FROM "{table}")'
+            )
+        logger.info("Deleted %d rows from %s that are gone from SQLite", deleted, table)
+        return deleted
@@ -0,0 +1,532 @@
+"""
+Event-driven ingestion of MTurk notifications
+
+MTurk can send a notification whenever something happens to a HIT of a given HITType
+(see subscribe). The NotificationIngestor consumes these from a queue and fetches
+and saves only the affected assignments and HITs, so the local database stays
+current without polling.
+
+Queues are pluggable: SqsQueue reads from Amazon SQS, where MTurk delivers notifications,
+while InMemoryQueue and FileQueue are stand-ins for testing and replaying events.
+
+An event that can't be ingested doesn't hold up the rest: its message is delivered
+again, and after max_attempts (or right away, if MTurk says the assignment doesn't
+exist) the event is saved as a FailedEvent, the dead letters, and its message deleted.
+"""
+
+import abc
+import collections
+import json
+import logging
+import pathlib
+import threading
+import typing
+
+import boto3
+import botocore.exceptions
+import peewee
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_VERSION = "2014-08-15"
+
+ASSIGNMENT_EVENTS = {
+    "AssignmentSubmitted",
+    "AssignmentApproved",
+    "AssignmentRejected",
+}
+# These change a HIT's counters, but there is no assignment data to fetch for them
+HIT_COUNTER_EVENTS = {
+    "AssignmentAccepted",
+    "AssignmentAbandoned",
+    "AssignmentReturned",
+    "HITCreated",
+    "HITExpired",
+    "HITExtended",
+    "HITReviewable",
+}
+DISPOSAL_EVENTS = {"HITDisposed"}
+
+DEFAULT_EVENT_TYPES = sorted(ASSIGNMENT_EVENTS | HIT_COUNTER_EVENTS | DISPOSAL_EVENTS)
+
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class FailedEvent(objective_turk.BaseModel):
+    """
+    An event that couldn't be ingested (a dead letter), with the last error
+    """
+
+    id = peewee.AutoField()
+    event_type = peewee.CharField(max_length=64, null=True)
+    event = objective_turk.SerializableJSONField()
+    attempts = peewee.IntegerField()
+    error = peewee.TextField()
+
+    def __str__(self):
+        return f"{self.event_type} event ({self.attempts} attempts): {self.error}"
+
+
+objective_turk.register_models(FailedEvent)
+
+
+def dead_letters() -> peewee.ModelSelect:
+    """
+    Return a query for the events that couldn't be ingested, oldest first
+    """
+    return FailedEvent.select().order_by(FailedEvent.id)
+
+
+class Message:
+    """
+    A message received from a queue
+
+    handle is whatever the queue needs to delete the message once it's been processed.
+    """
+
+    def __init__(self, body: str, handle: typing.Any):
+        self.body = body
+        self.handle = handle
+
+    def events(self) -> typing.List[typing.Dict]:
+        """
+        Return the MTurk events contained in this message
+        """
+        return json.loads(self.body).get("Events", [])
+
+
+class NotificationQueue(abc.ABC):
+    """
+    A source of MTurk notification messages
+    """
+
+    @abc.abstractmethod
+    def receive(
+        self, max_messages: int = 10, wait_seconds: float = 0
+    ) -> typing.List[Message]:
+        """
+        Return up to max_messages messages, waiting up to wait_seconds for one to arrive
+        """
+
+    @abc.abstractmethod
+    def delete(self, messages: typing.Iterable[Message]) -> None:
+        """
+        Acknowledge that the given messages have been processed
+        """
+
+    def release(self, messages: typing.Iterable[Message]) -> None:
+        """
+        Make the given messages, which weren't processed, available to be received again
+        """
+
+
+class SqsQueue(NotificationQueue):
+    """
+    An Amazon SQS queue that MTurk delivers notifications to
+
+    Messages that aren't deleted become visible again after the queue's visibility timeout,
+    so failed events are retried automatically (and release doesn't need to do anything).
+    """
+
+    def __init__(self, queue_url: str, client=None):
+        self.queue_url = queue_url
+        self.client = client if client is not None else boto3.client("sqs")
+
+    def receive(
+        self, max_messages: int = 10, wait_seconds: float = 0
+    ) -> typing.List[Message]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, 10),
+            WaitTimeSeconds=int(min(wait_seconds, 20)),
+        )
+        return [
+            Message(message["Body"], message["ReceiptHandle"])
+            for message in response.get("Messages", [])
+        ]
+
+    def delete(self, messages: typing.Iterable[Message]) -> None:
+        entries = [
+            {"Id": str(index), "ReceiptHandle": message.handle}
+            for index, message in enumerate(messages)
+        ]
+        # SQS deletes at most 10 messages per call
+        for start in range(0, len(entries), 10):
+            response = self.client.delete_message_batch(
+                QueueUrl=self.queue_url, Entries=entries[start : start + 10]
+            )
+            for failure in response.get("Failed", []):
+                logger.warning("Failed to delete SQS message: %s", failure)
+
+
+class InMemoryQueue(NotificationQueue):
+    """
+    A queue held in memory, e.g. for tests or for the fake MTurk backend
+
+    To receive the fake backend's notifications:
+        client.add_listener(queue.put)
+    """
+
+    def __init__(self):
+        self._messages: typing.Deque[Message] = collections.deque()
+        self._in_flight: typing.Dict[int, Message] = {}
+        self._condition = threading.Condition()
+        self._next_handle = 0
+
+    def put(self, body: typing.Union[str, typing.Dict]) -> None:
+        if not isinstance(body, str):
+            body = json.dumps(body, default=str)
+        with self._condition:
+            self._messages.append(Message(body, self._next_handle))
+            self._next_handle += 1
+            self._condition.notify()
+
+    def __len__(self):
+        return len(self._messages) + len(self._in_flight)
+
+    def receive(
+        self, max_messages: int = 10, wait_seconds: float = 0
+    ) -> typing.List[Message]:
+        with self._condition:
+            if not self._messages and wait_seconds:
+                self._condition.wait(wait_seconds)
+            received = []
+            while self._messages and len(received) < max_messages:
+                message = self._messages.popleft()
+                self._in_flight[message.handle] = message
+                received.append(message)
+            return received
+
+    def delete(self, messages: typing.Iterable[Message]) -> None:
+        with self._condition:
+            for message in messages:
+                self._in_flight.pop(message.handle, None)
+
+    def release(self, messages: typing.Iterable[Message]) -> None:
+        # Behind the messages already waiting, so they aren't held up
+        with self._condition:
+            for message in messages:
+                if self._in_flight.pop(message.handle, None) is not None:
+                    self._messages.append(message)
+
+    def requeue_unacknowledged(self) -> None:
+        """
+        Make received-but-not-deleted messages available again (like an SQS visibility timeout)
+        """
+        with self._condition:
+            for handle in sorted(self._in_flight, reverse=True):
+                self._messages.appendleft(self._in_flight.pop(handle))
+
+
+class FileQueue(NotificationQueue):
+    """
+    A queue backed by a file with one JSON notification per line
+
+    Progress is kept in a sidecar file (<path>.offset),
+    so a restarted consumer continues after the last message it deleted.
+    """
+
+    def __init__(self, path: typing.Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self.offset_path = self.path.with_name(self.path.name + ".offset")
+        self._offset = (
+            int(self.offset_path.read_text()) if self.offset_path.exists() else 0
+        )
+        self._read_position = self._offset
+        self._pending: typing.List[typing.Tuple[int, bool]] = []
+        self._released: typing.List[Message] = []
+
+    def put(self, body: typing.Union[str, typing.Dict]) -> None:
+        if not isinstance(body, str):
+            body = json.dumps(body, default=str)
+        with self.path.open("a") as queue_file:
+            queue_file.write(body.replace("\n", " ") + "\n")
+
+    def receive(
+        self, max_messages: int = 10, wait_seconds: float = 0
+    ) -> typing.List[Message]:
+        received = self._released[:max_messages]
+        del self._released[:max_messages]
+        if not self.path.exists():
+            return received
+        with self.path.open("rb") as queue_file:
+            queue_file.seek(self._read_position)
+            while len(received) < max_messages:
+                line = queue_file.readline()
+                if not line.endswith(b"\n"):
+                    break  # end of file, or a line that is still being written
+                self._read_position = queue_file.tell()
+                if line.strip():
+                    received.append(Message(line.decode("utf-8"), self._read_position))
+                    self._pending.append((self._read_position, False))
+        return received
+
+    def delete(self, messages: typing.Iterable[Message]) -> None:
+        deleted = {message.handle for message in messages}
+        self._pending = [(end, done or end in deleted) for end, done in self._pending]
+        # The offset can only move past messages that have all been deleted
+        while self._pending and self._pending[0][1]:
+            self._offset = self._pending.pop(0)[0]
+        self.offset_path.write_text(str(self._offset))
+
+    def release(self, messages: typing.Iterable[Message]) -> None:
+        # They stay pending, so the offset doesn't move past them until they're deleted
+        self._released.extend(messages)
+
+
+def subscribe(
+    hit_type_id: str,
+    destination: str,
+    event_types: typing.Iterable[str] = DEFAULT_EVENT_TYPES,
+    transport: str = "SQS",
+) -> None:
+    """
+    Ask MTurk to send notifications about HITs of the given HITType to the given destination
+    (for SQS, the queue's URL)
+    """
+    logger.info(
+        "Subscribing %s to notifications for HITType %s", destination, hit_type_id
+    )
+    objective_turk.client().update_notification_settings(
+        HITTypeId=hit_type_id,
+        Notification={
+            "Destination": destination,
+            "Transport": transport,
+            "Version": NOTIFICATION_VERSION,
+            "EventTypes": list(event_types),
+        },
+        Active=True,
+    )
+
+
+class NotificationIngestor:
+    """
+    Consume MTurk notifications and update the affected rows of the local database
+
+    Events in a batch are deduplicated, so a burst of submissions for one HIT
+    causes one fetch per assignment and at most one fetch of the HIT.
+    Everything is fetched before anything is saved, so the database isn't kept
+    locked during API calls.
+    """
+
+    def __init__(
+        self,
+        queue: NotificationQueue,
+        batch_size: int = 10,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.events_processed = 0
+        self.events_failed = 0
+        # Failed attempts so far, by event (kept in memory, so they restart with the process)
+        self._attempts: typing.Dict[str, int] = {}
+
+    def ingest(
+        self, events: typing.Iterable[typing.Dict]
+    ) -> typing.List[typing.Tuple[typing.Dict, Exception]]:
+        """
+        Fetch and save everything affected by the given events
+
+        Returns the events that couldn't be ingested, with their errors.
+        """
+        events = list(events)
+        assignment_ids: typing.Dict[str, None] = {}
+        hit_ids: typing.Dict[str, None] = {}
+        disposed_hit_ids: typing.Dict[str, None] = {}
+        for event in events:
+            event_type = event.get("EventType")
+            if event_type in ASSIGNMENT_EVENTS:
+                assignment_ids[event["AssignmentId"]] = None
+            elif event_type in HIT_COUNTER_EVENTS:
+                hit_ids[event["HITId"]] = None
+            elif event_type in DISPOSAL_EVENTS:
+                disposed_hit_ids[event["HITId"]] = None
+            else:
+                logger.debug("Ignoring %s event", event_type)
+
+        client = objective_turk.client()
+        errors: typing.Dict[str, Exception] = {}
+        assignments = {}
+        for assignment_id in assignment_ids:
+            try:
+                # GetAssignment also returns the HIT, so its counters come for free.
+                assignments[assignment_id] = client.get_assignment(
+                    AssignmentId=assignment_id
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                errors[assignment_id] = error
+            else:
+                hit_ids.pop(assignments[assignment_id]["HIT"]["HITId"], None)
+
+        hits = {}
+        for hit_id in hit_ids:
+            if hit_id in disposed_hit_ids:
+                continue
+            try:
+                hits[hit_id] = client.get_hit(HITId=hit_id)["HIT"]
+            except botocore.exceptions.ClientError as error:
+                if _is_request_error(error):
+                    # MTurk doesn't know the HIT anymore, so it was deleted
+                    disposed_hit_ids[hit_id] = None
+                else:
+                    errors[hit_id] = error
+            except Exception as error:  # pylint: disable=broad-except
+                errors[hit_id] = error
+
+        # pylint: disable=protected-access
+        Hit = objective_turk.Hit
+        with objective_turk.get_database().atomic():
+            for response in assignments.values():
+                hit = Hit._new_from_response(response["HIT"])
+                objective_turk.Assignment._new_from_response(
+                    response["Assignment"], hit
+                )
+            for hit in hits.values():
+                Hit._new_from_response(hit)
+            for hit_id in disposed_hit_ids:
+                hit = Hit.get_or_none(Hit.id == hit_id)
+                if hit is not None and not hit.deleted:
+                    hit.mark_deleted()
+
+        logger.info(
+            "Ingested notifications for %d assignments and %d HITs",
+            len(assignments),
+            len(hits) + len(disposed_hit_ids),
+        )
+        return [
+            (event, errors[key])
+            for event, key in ((event, _event_subject(event)) for event in events)
+            if key in errors
+        ]
+
+    def process_batch(self, wait_seconds: float = 0) -> int:
+        """
+        Receive and ingest one batch of messages, returning the number of messages handled
+
+        Messages are only deleted from the queue once their events have been saved
+        (or dead-lettered); the others are released, to be delivered again.
+        """
+        messages = self.queue.receive(self.batch_size, wait_seconds)
+        if not messages:
+            return 0
+
+        events_by_message = {}
+        for message in messages:
+            try:
+                events_by_message[message.handle] = message.events()
+            except ValueError:
+                logger.error("Discarding malformed notification: %s", message.body)
+                events_by_message[message.handle] = []
+
+        try:
+            failures = self.ingest(
+                event for events in events_by_message.values() for event in events
+            )
+        except BaseException:
+            # Nothing was saved (e.g., the database is locked), so it can all be retried
+            self.queue.release(messages)
+            raise
+        retried = set()
+        with objective_turk.get_database().atomic():
+            for event, error in failures:
+                if self._dead_letter(event, error):
+                    self.events_failed += 1
+                else:
+                    retried.add(_event_key(event))
+
+        done = []
+        released = []
+        for message in messages:
+            events = events_by_message[message.handle]
+            if any(_event_key(event) in retried for event in events):
+                released.append(message)
+            else:
+                done.append(message)
+                self.events_processed += len(events)
+        self.queue.delete(done)
+        if released:
+            self.queue.release(released)
+        return len(messages)
+
+    def _dead_letter(self, event: typing.Dict, error: Exception) -> bool:
+        """
+        Record a failed attempt at the given event, dead-lettering it if it shouldn't
+        be retried, and return whether it was
+        """
+        key = _event_key(event)
+        attempts = self._attempts.pop(key, 0) + 1
+        permanent = isinstance(
+            error, botocore.exceptions.ClientError
+        ) and _is_request_error(error)
+        if not permanent and attempts < self.max_attempts:
+            self._attempts[key] = attempts
+            logger.warning(
+                "Failed to ingest %s (attempt %d of %d); will retry: %s",
+                event.get("EventType"),
+                attempts,
+                self.max_attempts,
+                error,
+            )
+            return False
+        logger.error(
+            "Giving up on %s after %d attempts: %s",
+            event.get("EventType"),
+            attempts,
+            error,
+        )
+        FailedEvent.create(
+            event_type=event.get("EventType"),
+            event=event,
+            attempts=attempts,
+            error=f"{type(error).__name__}: {error}",
+        )
+        return True
+
+    def drain(self) -> int:
+        """
+        Process messages until the queue is empty, returning how many were handled
+        """
+        total = 0
+        while True:
+            handled = self.process_batch()
+            if handled == 0:
+                return total
+            total += handled
+
+    def run(
+        self, stop: typing.Optional[threading.Event] = None, wait_seconds: float = 20
+    ) -> None:
+        """
+        Keep consuming notifications until the stop event is set (or forever)
+        """
+        if stop is None:
+            stop = threading.Event()
+        logger.info("Starting notification ingestion")
+        while not stop.is_set():
+            try:
+                self.process_batch(wait_seconds)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to ingest notifications; will retry")
+                stop.wait(min(wait_seconds, 5))
+        logger.info(
+            "Stopped notification ingestion after %d events", self.events_processed
+        )
+
+
+def _is_request_error(error: botocore.exceptions.ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") == "RequestError"
+
+
+def _event_subject(event: typing.Dict) -> typing.Optional[str]:
+    # The assignment or HIT an event is about
+    if event.get("EventType") in ASSIGNMENT_EVENTS:
+        return event.get("AssignmentId")
+    return event.get("HITId")
+
+
+def _event_key(event: typing.Dict) -> str:
+    return json.dumps(event, sort_keys=True, default=str)
@@ -1,23 +1,41 @@
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import datetime
+import decimal
 import enum
+import importlib
 import json
 import logging
 import os
 import pathlib
+import threading
+import time
 import typing
+import weakref
 import xml.etree.ElementTree
 
+import botocore.exceptions
 import peewee
+import playhouse.migrate
 import playhouse.sqlite_ext as peewee_sqlite
 
 import objective_turk.color_logs
+import objective_turk.log_queue
 import mturk
 
 CASCADE = "CASCADE"
 NO_ACTION = "NO ACTION"
 
+# HITs created with a project are tagged by setting their RequesterAnnotation to this prefix plus the project ID
+PROJECT_ANNOTATION_PREFIX = "objective-turk-project:"
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Per-row messages ("Saving HIT ...") go to their own logger, so they can be sampled
+# (see objective_turk.log_queue) without affecting other messages.
+row_logger = logging.getLogger(__name__ + ".rows")
 
 
 class Environment(enum.Enum):
@@ -25,18 +43,296 @@ class Environment(enum.Enum):
     production = "production"
 
 
-_database: peewee.Database = peewee_sqlite.SqliteExtDatabase(None)
-_environment: typing.Optional[Environment] = None
-_client = None
-_init = False
+DEFAULT_IDENTITY_MAP_SIZE = 10000
+
+
+class IdentityMap:
+    """
+    Model instances by primary key, so that each row is loaded once, and shared
+
+    Model.get_by_id (and the library's lookups of HITs and workers while saving responses)
+    return the mapped instance of a row, loading it only the first time. Rows the library
+    saves replace the mapped data in place, so every holder of an instance sees the update;
+    model-level update and delete queries drop all instances of their model.
+    Writes made in other ways (raw SQL, or other processes) aren't seen.
+
+    At most size instances are kept; the least recently used ones are dropped first.
+    """
+
+    def __init__(self, size: int = DEFAULT_IDENTITY_MAP_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._instances: (
+            "collections.OrderedDict[typing.Tuple[type, typing.Any], peewee.Model]"
+        ) = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"<IdentityMap of {len(self)} instances "
+            f"({self.hits} hits, {self.misses} misses)>"
+        )
+
+    def __len__(self):
+        return len(self._instances)
+
+    def get(
+        self, model: typing.Type[peewee.Model], key: typing.Any
+    ) -> typing.Optional[peewee.Model]:
+        """
+        Return the mapped instance of the given model with the given primary key, if any
+        """
+        with self._lock:
+            instance = self._instances.get((model, key))
+            if instance is None:
+                self.misses += 1
+                return None
+            self._instances.move_to_end((model, key))
+            self.hits += 1
+            return instance
+
+    def add(self, instance: peewee.Model) -> peewee.Model:
+        """
+        Map an instance, returning the one to use from now on: if the row was already mapped,
+        the mapped instance, updated with this one's data
+        """
+        key = (type(instance), _primary_key_of(instance))
+        with self._lock:
+            mapped = self._instances.get(key)
+            if mapped is not None and mapped is not instance:
+                mapped.__data__ = dict(instance.__data__)
+                mapped.__rel__ = dict(instance.__rel__)
+                mapped._dirty.clear()
+                instance = mapped
+            self._instances[key] = instance
+            self._instances.move_to_end(key)
+            while len(self._instances) > self.size:
+                self._instances.popitem(last=False)
+        return instance
+
+    def discard(self, model: typing.Type[peewee.Model]) -> None:
+        """
+        Drop every mapped instance of the given model
+        """
+        with self._lock:
+            for key in [key for key in self._instances if key[0] is model]:
+                del self._instances[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._instances.clear()
+
+
+def _primary_key_of(instance: peewee.Model) -> typing.Any:
+    # Read from the instance's data, so foreign keys in the primary key aren't loaded
+    primary_key = instance._meta.primary_key
+    if isinstance(primary_key, peewee.CompositeKey):
+        return tuple(instance.__data__.get(name) for name in primary_key.field_names)
+    return instance.__data__.get(primary_key.name)
+
+
+def _primary_key_value(model: typing.Type[peewee.Model], key: typing.Any) -> typing.Any:
+    # A primary key as given to get_by_id, in the form _primary_key_of returns
+    if isinstance(model._meta.primary_key, peewee.CompositeKey):
+        return tuple(
+            value._pk if isinstance(value, peewee.Model) else value for value in key
+        )
+    return key
+
+
+class Session:
+    """
+    One account's environment, database and MTurk client
+
+    init sets up the default session. Other sessions can be used alongside it, e.g.
+    to sync sandbox and production, or several AWS profiles, on separate threads:
+    models, and everything else in this library, use the session activated
+    in the current thread (or the default one):
+
+        production = Session(Environment.production, profile="lab")
+        with production.activate():
+            Hit.download_all()
+
+    The database file is named after the profile and environment, as with init,
+    unless db_path is given. profile also selects the AWS credentials of the client
+    (by default, those of the AWS_PROFILE environment variable).
+
+    With identity_map_size, the session keeps an IdentityMap of that many instances,
+    shared by all code using the session (see also unit_of_work).
+    A client (e.g., a mturk.fake.FakeMTurkClient) can be given to use instead of creating one.
+
+    features holds the names of the optional features enabled for the database
+    (see enable_feature).
+    """
+
+    def __init__(
+        self,
+        environment: typing.Optional[Environment] = None,
+        db_path: typing.Union[str, pathlib.Path, None] = None,
+        profile: typing.Optional[str] = None,
+        create_database_if_missing: bool = True,
+        identity_map_size: typing.Optional[int] = None,
+        client=None,
+    ):
+        if environment is None:
+            environment = _environment_from_env()
+        self.environment = environment
+        self.profile = profile
+
+        if self.environment is Environment.production:
+            print_production_warning()
+
+        if db_path is None:
+            db_path = _default_db_path(environment, profile)
+        logger.debug("Using database file %s", db_path)
+        self.db_path = db_path
+        self.database: peewee.Database = peewee_sqlite.SqliteExtDatabase(
+            db_path, pragmas={"foreign_keys": 1}
+        )
+
+        self.identity_map = (
+            IdentityMap(identity_map_size) if identity_map_size is not None else None
+        )
+        self._client = client
+        self._client_lock = threading.Lock()
+
+        self.features: typing.Set[str] = set()
+        with self.activate():
+            if create_database_if_missing:
+                setup_database()
+                _set_up_sessions.add(self)
+            elif os.path.exists(db_path):
+                _load_features()
+
+    def __repr__(self):
+        profile = f"{self.profile}, " if self.profile is not None else ""
+        return f"<Session {profile}{self.environment.value}: {self.db_path}>"
+
+    @contextlib.contextmanager
+    def activate(self) -> typing.Iterator["Session"]:
+        """
+        Use this session in the current thread (or async task) until the block exits
+        """
+        token = _current_session.set(self)
+        try:
+            yield self
+        finally:
+            _current_session.reset(token)
+
+    def client(self):
+        """
+        Return this session's MTurk client, creating it the first time
+        """
+        with self._client_lock:
+            if self._client is None:
+                logger.debug("Initializing AWS boto3 client in %s", self.environment)
+                self._client = mturk.get_client(
+                    self.environment is Environment.sandbox, profile=self.profile
+                )
+        return self._client
+
+    def close(self) -> None:
+        _set_up_sessions.discard(self)
+        self.database.close()
+
+
+_default_session: typing.Optional[Session] = None
+# Sessions whose databases are kept up to date with the registered models
+_set_up_sessions: "weakref.WeakSet[Session]" = weakref.WeakSet()
+_current_session: contextvars.ContextVar[typing.Optional[Session]] = (
+    contextvars.ContextVar("objective_turk_session", default=None)
+)
+# Before init, models are bound to a database that can't be opened yet
+_uninitialized_database = peewee_sqlite.SqliteExtDatabase(None)
+
+
+_current_identity_map: contextvars.ContextVar[typing.Optional[IdentityMap]] = (
+    contextvars.ContextVar("objective_turk_identity_map", default=None)
+)
+
+
+@contextlib.contextmanager
+def unit_of_work(
+    size: int = DEFAULT_IDENTITY_MAP_SIZE,
+) -> typing.Iterator[IdentityMap]:
+    """
+    Share model instances by primary key (through a new IdentityMap) in the current thread
+    (or async task) until the block exits
+    """
+    token = _current_identity_map.set(IdentityMap(size))
+    try:
+        yield _current_identity_map.get()
+    finally:
+        _current_identity_map.reset(token)
+
+
+def _identity_map() -> typing.Optional[IdentityMap]:
+    # The current unit of work's, or else the current session's (if it has one)
+    identity_map = _current_identity_map.get()
+    if identity_map is not None:
+        return identity_map
+    session = current_session()
+    return session.identity_map if session is not None else None
+
+
+def _forget(model: typing.Type[peewee.Model]) -> None:
+    # Drop the mapped instances of a model whose rows were changed in bulk
+    identity_map = _identity_map()
+    if identity_map is not None:
+        identity_map.discard(model)
+
+
+def _remember(instance: peewee.Model) -> peewee.Model:
+    # The instance to use for a row just loaded or saved (see IdentityMap.add)
+    identity_map = _identity_map()
+    return identity_map.add(instance) if identity_map is not None else instance
+
+
+def current_session() -> typing.Optional[Session]:
+    """
+    Return the session activated in the current thread, or else the default one
+    (None before init)
+    """
+    session = _current_session.get()
+    return session if session is not None else _default_session
+
+
+def _session() -> Session:
+    session = current_session()
+    if session is None:
+        raise EnvironmentNotInitializedError()
+    return session
 
 
 def get_current_environment() -> typing.Optional[Environment]:
-    return _environment
+    session = current_session()
+    return session.environment if session is not None else None
 
 
 def get_database() -> peewee.Database:
-    return _database
+    """
+    Return the current session's database
+    """
+    session = current_session()
+    return session.database if session is not None else _uninitialized_database
+
+
+class _SessionDatabase(peewee.DatabaseProxy):
+    """
+    The database of our models: a proxy for the current session's database
+    """
+
+    @property
+    def obj(self) -> peewee.Database:
+        return get_database()
+
+    def initialize(self, obj):
+        # The proxied database is always the current session's, so there's nothing to set
+        pass
+
+
+_database = _SessionDatabase()
 
 
 def print_production_warning() -> None:
@@ -56,59 +352,97 @@ def init(
     color_logs: bool = True,
     create_database_if_missing: bool = True,
     reinit: bool = False,
+    log_level: typing.Union[int, str, None] = None,
+    log_sample_every: typing.Optional[int] = None,
+    identity_map_size: typing.Optional[int] = None,
 ) -> None:
     """
     Initialize the environment by specifying whether you're operating in production or the sandbox.
     This prepares (but doesn't instantiate) the AWS MTurk client and specifies the database to use.
+
+    These make up the default session (see Session); reinit replaces it, which doesn't affect
+    code running in other sessions.
+
+    log_level sets the level of the library's loggers (default: MTURK_LOG_LEVEL, or INFO with color_logs).
+    log_sample_every logs only one in every N per-row messages (default: MTURK_LOG_SAMPLE_EVERY).
+    identity_map_size gives the session an IdentityMap of that many instances.
     """
-    global _init
-    if _init and not reinit:
+    global _default_session
+    if _default_session is not None and not reinit:
         logger.warning("initialization already complete")
         return
 
-    if color_logs:
-        objective_turk.color_logs.color_logs()
+    configure_logging(color_logs, log_level, log_sample_every)
 
     if environment is None:
-        # Infer from environment variable
-        env_production = os.getenv("MTURK_PRODUCTION")
-        if env_production is None:
-            logger.info("MTurk environment not specified; assuming sandbox")
-            environment = Environment.sandbox
-        elif env_production.lower() == "true":
-            environment = Environment.production
-        else:
-            environment = Environment.sandbox
-
+        environment = _environment_from_env()
     logger.debug("Initializing Objective Turk with %s environment", environment.value)
-    global _environment
-    _environment = environment
 
-    if _environment is Environment.production:
-        print_production_warning()
+    if _default_session is not None:
+        _default_session.close()
+    _default_session = Session(
+        environment,
+        db_path,
+        create_database_if_missing=create_database_if_missing,
+        identity_map_size=identity_map_size,
+    )
+
 
-    if db_path is None:
-        logger.info("inferring database path from environment")
+def _environment_from_env() -> Environment:
+    # Infer from environment variable
+    env_production = os.getenv("MTURK_PRODUCTION")
+    if env_production is None:
+        logger.info("MTurk environment not specified; assuming sandbox")
+        return Environment.sandbox
+    if env_production.lower() == "true":
+        return Environment.production
+    return Environment.sandbox
 
+
+def _default_db_path(
+    environment: Environment, profile: typing.Optional[str] = None
+) -> pathlib.Path:
+    logger.info("inferring database path from environment")
+
+    if profile is None:
         profile = os.getenv("AWS_PROFILE")
-        if profile is None:
-            profile = "turk"
-            logger.warning(
-                "AWS_PROFILE not specified. Using default value (%s) in database name.",
-                profile,
-            )
+    if profile is None:
+        profile = "turk"
+        logger.warning(
+            "AWS_PROFILE not specified. Using default value (%s) in database name.",
+            profile,
+        )
 
-        db_location = os.getenv("MTURK_DB_PATH", ".")
-        db_path = pathlib.Path(db_location) / f"{profile}_{environment.value}.db"
+    db_location = os.getenv("MTURK_DB_PATH", ".")
+    return pathlib.Path(db_location) / f"{profile}_{environment.value}.db"
 
-    logger.debug("Using database file %s", db_path)
 
-    _database.init(db_path, pragmas={"foreign_keys": 1})
+def configure_logging(
+    color_logs: bool = True,
+    log_level: typing.Union[int, str, None] = None,
+    log_sample_every: typing.Optional[int] = None,
+) -> None:
+    """
+    Set up the library's logging, as requested through init or the environment
+
+    If no level is given anywhere, the level is only set when we install our own handler,
+    so an application's own logging configuration stays in charge.
+    """
+    if log_level is None:
+        log_level = os.getenv("MTURK_LOG_LEVEL")
+    if log_level is None and color_logs:
+        log_level = logging.INFO
+    if isinstance(log_level, str):
+        log_level = log_level.upper()
+    if log_level is not None:
+        logging.getLogger("objective_turk").setLevel(log_level)
+
+    if log_sample_every is None and os.getenv("MTURK_LOG_SAMPLE_EVERY") is not None:
+        log_sample_every = int(os.environ["MTURK_LOG_SAMPLE_EVERY"])
+    objective_turk.log_queue.sample_rows(row_logger, log_sample_every)
 
-    if create_database_if_missing:
-        setup_database()
-    
-    _init = True
+    if color_logs:
+        objective_turk.color_logs.color_logs()
 
 
 def init_sandbox() -> None:
@@ -128,32 +462,32 @@ class EnvironmentNotInitializedError(Exception):
         super().__init__(message)
 
 
-def client():
+class FeatureNotEnabledError(Exception):
     """
-    Get the client that connects to the MTurk API.
-    Initializes it if that hasn't happened yet.
-    Uses the sandbox if the --debug flag was set.
+    An error raised when using an optional feature that isn't enabled for the database
     """
-    global _environment, _client
 
-    if _environment is None:
-        raise EnvironmentNotInitializedError()
+    def __init__(self, feature: str):
+        message = (
+            f"{feature} isn't enabled. Please call `objective_turk.{feature}.enable()`."
+        )
+        super().__init__(message)
 
-    if _client is None:
-        logger.debug("Initializing AWS boto3 client in %s", _environment)
-        sandbox: bool = _environment is Environment.sandbox
-        _client = mturk.get_client(sandbox)
 
-    return _client
+def client():
+    """
+    Get the client that connects to the MTurk API (the current session's).
+    Initializes it if that hasn't happened yet.
+    Uses the sandbox if the --debug flag was set.
+    """
+    return _session().client()
 
 
 def production_confirmation():
     """
     If in production, show a warning that the user is about to do something impactful
     """
-    if _environment is None:
-        raise EnvironmentNotInitializedError()
-    elif _environment is Environment.production:
+    if _session().environment is Environment.production:
         logger.warning("Performing operation with side-effects in production")
 
         skip_confirmation = os.getenv("MTURK_NO_CONFIRM")
@@ -185,6 +519,56 @@ class SerializableJSONField(peewee_sqlite.JSONField):
             return json.dumps(value, default=self.serialize_dates)
 
 
+def stored_json(value: typing.Any) -> typing.Any:
+    """
+    Return a value as it reads back from a SerializableJSONField (e.g., with dates as strings)
+    """
+    return json.loads(json.dumps(value, default=SerializableJSONField.serialize_dates))
+
+
+# julianday() of 1970-01-01T00:00:00Z, for converting SQLite timestamps to the Unix epoch
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+def epoch_milliseconds(timestamp: peewee.Node) -> peewee.Node:
+    """
+    Return an SQL expression converting an ISO timestamp to milliseconds since the epoch
+    """
+    julian_day = peewee.fn.julianday(timestamp)
+    return peewee.fn.ROUND((julian_day - UNIX_EPOCH_JULIAN_DAY) * 86400000).cast(
+        "INTEGER"
+    )
+
+
+def _as_datetime(
+    value: typing.Union[datetime.datetime, str, None],
+) -> typing.Optional[datetime.datetime]:
+    # Responses contain datetimes, while details loaded from the database contain strings
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+def parse_answers(answer_xml: str) -> typing.Dict:
+    """
+    Parse the answers of an assignment (in the QuestionFormAnswers format) into a dictionary
+    """
+    root = xml.etree.ElementTree.fromstring(answer_xml)
+
+    answer_dict = {}
+    for answer in root:
+        field = answer.find(
+            "{http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd}QuestionIdentifier"
+        )
+        value = answer.find(
+            "{http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd}FreeText"
+        )
+        if field is not None and value is not None:
+            answer_dict[field.text] = value.text
+
+    return answer_dict
+
+
 def now_utc() -> datetime.datetime:
     """
     Return a timezone-aware datetime of the current moment (in UTC)
@@ -192,6 +576,236 @@ def now_utc() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc)
 
 
+# Called as hook(previous, current) whenever a row of the given model is saved
+# from an API response; previous is the row's details before the save (None for a new row),
+# and current is the response. Hooks run in the same transaction as the save.
+SaveHook = typing.Callable[[typing.Optional[typing.Dict], typing.Dict], None]
+
+
+class _Hook(typing.NamedTuple):
+    function: typing.Callable
+    # The fields of previous that a save hook reads (None for all of them)
+    fields: typing.Optional[typing.FrozenSet[str]]
+    # The optional feature it belongs to (see register_feature), if any
+    feature: typing.Optional[str]
+
+
+_save_hooks: typing.Dict[typing.Type[peewee.Model], typing.List[_Hook]] = {}
+
+
+def on_save(
+    model: typing.Type[peewee.Model],
+    hook: SaveHook,
+    fields: typing.Optional[typing.Iterable[str]] = None,
+    feature: typing.Optional[str] = None,
+) -> SaveHook:
+    """
+    Register a hook to run whenever a row of the given model is saved from an API response
+    (if it's part of a feature, only in sessions whose database has the feature enabled)
+
+    If the hook only reads some (top-level) fields of previous, name them, so that
+    when no other hook needs more, previous is loaded without parsing the rest of the details.
+    """
+    fields = frozenset(fields) if fields is not None else None
+    _save_hooks.setdefault(model, []).append(_Hook(hook, fields, feature))
+    return hook
+
+
+def _active_hooks(hooks: typing.List[_Hook]) -> typing.List[_Hook]:
+    # Those that aren't part of a feature, or whose feature is enabled in the current session
+    session = current_session()
+    features = session.features if session is not None else set()
+    return [hook for hook in hooks if hook.feature is None or hook.feature in features]
+
+
+# Called as lookup(model, primary key) for a row that isn't in the model's table,
+# to find its details where else it's kept (e.g., archived), or None
+PreviousLookup = typing.Callable[
+    [typing.Type[peewee.Model], typing.Any], typing.Optional[typing.Dict]
+]
+_previous_lookups: typing.List[PreviousLookup] = []
+
+
+def register_previous_lookup(lookup: PreviousLookup) -> PreviousLookup:
+    """
+    Register a function that finds the details of rows kept outside their model's table,
+    so that save hooks see them as previous when such a row is saved again
+    """
+    _previous_lookups.append(lookup)
+    return lookup
+
+
+def _previous_details(
+    model: typing.Type[peewee.Model],
+    where: peewee.Expression,
+    primary_key: typing.Any = None,
+) -> typing.Optional[typing.Dict]:
+    """
+    Return what the model's save hooks need of the details of the row matching where
+    (or, if it isn't in the table, that registered lookups find by primary key):
+    all of them, or only the fields the hooks read; None if there's no such row
+    (or no hooks to need them)
+    """
+    hooks = _active_hooks(_save_hooks.get(model, []))
+    if not hooks:
+        return None
+    if any(hook.fields is None for hook in hooks):
+        fields = None
+    else:
+        fields = frozenset().union(*(hook.fields for hook in hooks))
+    if fields is None:
+        row = model.select(model.details).where(where).tuples().first()
+        previous = row[0] if row is not None else None
+    else:
+        fields = sorted(fields)
+        columns = [
+            peewee.fn.json_extract(model.details, f"$.{field}") for field in fields
+        ] or [peewee.Value(1)]
+        row = model.select(*columns).where(where).tuples().first()
+        previous = dict(zip(fields, row)) if row is not None else None
+
+    if previous is None and primary_key is not None:
+        for lookup in _previous_lookups:
+            previous = lookup(model, primary_key)
+            if previous is not None:
+                if fields is not None:
+                    previous = {field: previous.get(field) for field in fields}
+                break
+    return previous
+
+
+def _run_save_hooks(
+    model: typing.Type[peewee.Model],
+    previous: typing.Optional[typing.Dict],
+    current: typing.Dict,
+) -> None:
+    for hook in _active_hooks(_save_hooks.get(model, [])):
+        hook.function(previous, current)
+
+
+# Called as hook(previous) whenever a row of the given model is deleted because it's gone
+# from MTurk; previous is the row's details. Hooks run in the same transaction as the delete.
+DeleteHook = typing.Callable[[typing.Dict], None]
+_delete_hooks: typing.Dict[typing.Type[peewee.Model], typing.List[_Hook]] = {}
+
+
+def on_delete(
+    model: typing.Type[peewee.Model],
+    hook: DeleteHook,
+    feature: typing.Optional[str] = None,
+) -> DeleteHook:
+    """
+    Register a hook to run whenever a row of the given model is deleted because it's gone from MTurk
+    (if it's part of a feature, only in sessions whose database has the feature enabled)
+    """
+    _delete_hooks.setdefault(model, []).append(_Hook(hook, None, feature))
+    return hook
+
+
+def _run_delete_hooks(model: typing.Type[peewee.Model], previous: typing.Dict) -> None:
+    for hook in _active_hooks(_delete_hooks.get(model, [])):
+        hook.function(previous)
+
+
+class _PrefetchedRows(peewee.CursorWrapper):
+    """
+    Results that were already loaded (by peewee.prefetch), standing in for a cursor
+    """
+
+    def __init__(self, rows: typing.List[peewee.Model]):
+        super().__init__(None)
+        self.row_cache = rows
+        self.count = len(rows)
+        self.populated = True
+
+    def iterator(self):
+        return iter(self.row_cache)
+
+
+class Query(peewee.ModelSelect):
+    """
+    A query over one of our models, whose results can also be read as columns
+    (see objective_turk.frames), and which can load related rows along with them
+
+    Walking relations row by row (hit.assignments, assignment.worker, and so on)
+    runs a query for every row. Instead, with_related (or with_assignments, with_workers,
+    etc.) loads each kind of related row in one query, for all results at once:
+
+        for hit in Hit.select().with_assignments().with_workers():
+            for assignment in hit.assignments:  # a list; no queries
+                print(assignment.worker.id)
+
+    Each kind of related row is linked to the results, or to related rows added earlier.
+    """
+
+    # Queries for the related rows to load along with the results
+    _related: typing.Tuple[peewee.ModelSelect, ...] = ()
+
+    @peewee.Node.copy
+    def with_related(
+        self, *related: typing.Union[typing.Type[peewee.Model], peewee.ModelSelect]
+    ) -> "Query":
+        """
+        Also load the related rows of the given models (or just those a query over them selects)
+        """
+        self._related += tuple(
+            query if isinstance(query, peewee.ModelSelect) else query.select()
+            for query in related
+        )
+
+    def with_assignments(self) -> "Query":
+        return self.with_related(Assignment)
+
+    def with_hits(self) -> "Query":
+        return self.with_related(Hit)
+
+    def with_workers(self) -> "Query":
+        return self.with_related(Worker)
+
+    def with_qualifications(self) -> "Query":
+        return self.with_related(Qualification)
+
+    def with_qualification_types(self) -> "Query":
+        return self.with_related(QualificationType)
+
+    def _execute(self, database):
+        if not self._related or self._cursor_wrapper is not None:
+            return super()._execute(database)
+        # One query for the results, then one for each kind of related row
+        query = self.clone()
+        query._related = ()
+        self._cursor_wrapper = _PrefetchedRows(peewee.prefetch(query, *self._related))
+        return self._cursor_wrapper
+
+    def iterator(self, database=None):
+        if self._related:
+            return iter(self.execute(database))
+        return super().iterator(database)
+
+    def to_arrow(
+        self,
+        details: "frames.DetailColumns" = None,
+        chunk_size: typing.Optional[int] = None,
+    ) -> "pyarrow.Table":
+        """
+        Return the results as a pyarrow Table, with the given details fields as extra columns
+        """
+        # Imported here, because pyarrow is optional
+        from objective_turk import frames  # pylint: disable=import-outside-toplevel
+
+        return frames.to_arrow(self, details, chunk_size or frames.DEFAULT_CHUNK_SIZE)
+
+    def to_pandas(
+        self,
+        details: "frames.DetailColumns" = None,
+        chunk_size: typing.Optional[int] = None,
+    ) -> "pandas.DataFrame":
+        """
+        Return the results as a pandas DataFrame, with the given details fields as extra columns
+        """
+        return self.to_arrow(details, chunk_size).to_pandas()
+
+
 class BaseModel(peewee.Model):
     """
     The base for all of our MTurk models
@@ -203,13 +817,70 @@ class BaseModel(peewee.Model):
     def __str__(self):
         return str(self.id)
 
+    @classmethod
+    def select(cls, *fields) -> Query:
+        # As in peewee.Model.select, but returning our own kind of query
+        is_default = not fields
+        if not fields:
+            fields = cls._meta.sorted_fields
+        return Query(cls, fields, is_default=is_default)
+
     def save(self, *args, **kwargs):
         """
         Save overridden to update updated_at
         per suggestion in https://stackoverflow.com/a/18533416
         """
         self.updated_at = now_utc()
-        return super().save(*args, **kwargs)
+        saved = super().save(*args, **kwargs)
+        _remember(self)
+        return saved
+
+    @classmethod
+    def get_by_id(cls, pk):
+        # Served from the identity map (see IdentityMap), if there is one
+        identity_map = _identity_map()
+        if identity_map is None:
+            return super().get_by_id(pk)
+        instance = identity_map.get(cls, _primary_key_value(cls, pk))
+        if instance is None:
+            instance = identity_map.add(super().get_by_id(pk))
+        return instance
+
+    @classmethod
+    def update(cls, *args, **kwargs):
+        # Any mapped instance may be changed
+        _forget(cls)
+        return super().update(*args, **kwargs)
+
+    @classmethod
+    def delete(cls):
+        _forget(cls)
+        return super().delete()
+
+    @classmethod
+    def _new_row(cls, **values) -> typing.Dict[str, typing.Any]:
+        """
+        Return the values of a new row: the given ones, and the defaults of the other fields
+        """
+        return dict(cls._meta.get_default_dict(), **values)
+
+    @classmethod
+    def _loaded(cls, row: typing.Dict[str, typing.Any]) -> "BaseModel":
+        """
+        Return the instance that loading the given row (just saved) would return,
+        without querying the database
+        """
+        instance = cls(__no_default__=1)
+        for name, value in row.items():
+            field = cls._meta.fields[name]
+            if isinstance(value, peewee.Model):
+                instance.__rel__[name] = value
+            stored = field.db_value(value)
+            if isinstance(stored, datetime.date):
+                # As SQLite stores it: as text
+                stored = str(stored)
+            instance.__data__[name] = field.python_value(stored)
+        return instance
 
     class Meta:
         database = _database
@@ -218,6 +889,16 @@ class BaseModel(peewee.Model):
 class Worker(BaseModel):
     id = peewee.CharField(max_length=256, primary_key=True, column_name="WorkerId")
 
+    @classmethod
+    def _get_or_create(cls, worker_id: str) -> "Worker":
+        # As get_or_create, but from the identity map if the worker is in it
+        identity_map = _identity_map()
+        if identity_map is not None:
+            worker = identity_map.get(cls, worker_id)
+            if worker is not None:
+                return worker
+        return _remember(cls.get_or_create(id=worker_id)[0])
+
     def has_qualification(self, qualification_type: "QualificationType") -> bool:
         """
         Returns true if the given QualificationType has been assigned to the provided worker
@@ -235,6 +916,32 @@ class Worker(BaseModel):
         """
         qualification_type.assign(self, send_notification, qualification_value)
 
+    @property
+    def stats(self) -> "objective_turk.worker_stats.WorkerStats":
+        """
+        Return this worker's statistics (kept up to date as assignments are saved,
+        once enabled with worker_stats.enable())
+        """
+        # Imported here, because worker_stats builds on this module
+        from objective_turk import worker_stats
+
+        return worker_stats.for_worker(self.id)
+
+    @property
+    def approval_rate(self) -> typing.Optional[float]:
+        """
+        Return the fraction of this worker's reviewed assignments that were approved
+        (None if none have been reviewed)
+        """
+        return self.stats.approval_rate
+
+    @property
+    def median_work_time(self) -> typing.Optional[float]:
+        """
+        Return the (approximate) median number of seconds this worker spent on an assignment
+        """
+        return self.stats.median_work_time
+
     def send_message(self, subject: str, message: str) -> None:
         """
         Send a message to the worker
@@ -307,16 +1014,15 @@ class QualificationType(BaseModel):
 
     @classmethod
     def _new_from_response(cls, qualification_type: typing.Dict):
-        logger.debug(
+        row_logger.debug(
             "Saving QualificationType %s", qualification_type["QualificationTypeId"]
         )
-        return (
-            cls.insert(
-                id=qualification_type["QualificationTypeId"], details=qualification_type
-            )
-            .on_conflict_replace()
-            .execute()
+        row = cls._new_row(
+            id=qualification_type["QualificationTypeId"], details=qualification_type
         )
+        cls.insert(row).on_conflict_replace().execute()
+        if _identity_map() is not None:
+            _remember(cls._loaded(row))
 
     @classmethod
     def create_qualification_type(cls, name: str, description: str) -> None:
@@ -334,6 +1040,8 @@ class QualificationType(BaseModel):
         """
         Download all QualificationTypes owned by the current MTurk account
         """
+        started = time.monotonic()
+        count = 0
         for qualification_type in mturk.get_pages(
             client().list_qualification_types,
             "QualificationTypes",
@@ -341,6 +1049,27 @@ class QualificationType(BaseModel):
             MustBeRequestable=False,
         ):
             cls._new_from_response(qualification_type)
+            count += 1
+        logger.info(
+            "Saved %d QualificationTypes in %.1fs", count, time.monotonic() - started
+        )
+
+
+# The statuses of the qualifications listed when syncing; a qualification MTurk lists
+# under neither no longer exists
+QUALIFICATION_STATUSES = ("Granted", "Revoked")
+
+
+class QualificationDiff(typing.NamedTuple):
+    """
+    The WorkerIds whose qualification (of the given type) a sync added, changed or deleted
+    """
+
+    qualification_type: str
+    inserted: typing.List[str]
+    updated: typing.List[str]
+    deleted: typing.List[str]
+    unchanged: int
 
 
 class Qualification(BaseModel):
@@ -369,15 +1098,17 @@ class Qualification(BaseModel):
         primary_key = peewee.CompositeKey("qualification_type", "worker")
 
     def __str__(self):
+        # The IDs are read without loading the related rows
         return "QualificationTypeId %s granted to %s" % (
-            self.qualification_type.id,
-            self.worker.id,
+            self.QualificationTypeId,
+            self.WorkerId,
         )
 
     @classmethod
     def exists(cls, qualification_type: QualificationType, worker: Worker) -> bool:
         """
         Returns true if the given QualificationType has been assigned to the provided worker
+        (and not revoked since)
         """
         return (
             # Pylint compares about missing database parameter, but that's not required
@@ -386,6 +1117,7 @@ class Qualification(BaseModel):
             .where(
                 (Qualification.qualification_type == qualification_type)
                 & (Qualification.worker == worker)
+                & (Qualification.Status == "Granted")
             )
             .count()
             > 0
@@ -395,36 +1127,184 @@ class Qualification(BaseModel):
     def new_from_response(
         cls, qualification: typing.Dict, qualification_type: QualificationType
     ) -> None:
-        logger.debug(
+        row_logger.debug(
             "Saving Qualification of Worker %s for QualificationType %s",
             qualification["WorkerId"],
             qualification_type.id,
         )
-        cls.insert(
+        worker = Worker._get_or_create(qualification["WorkerId"])
+        previous = _previous_details(
+            cls,
+            (cls.qualification_type == qualification_type) & (cls.worker == worker),
+        )
+        row = cls._new_row(
             qualification_type=qualification_type,
-            worker=Worker.get_or_create(id=qualification["WorkerId"])[0],
-            GrantTime=qualification["GrantTime"].isoformat(),
+            worker=worker,
+            GrantTime=_as_datetime(qualification["GrantTime"]).isoformat(),
             Status=qualification["Status"],
             details=qualification,
-        ).on_conflict_replace().execute()
+        )
+        with _database.atomic():
+            cls.insert(row).on_conflict_replace().execute()
+            _run_save_hooks(cls, previous, qualification)
+        if _identity_map() is not None:
+            _remember(cls._loaded(row))
 
     @classmethod
     def download_qualification_type(cls, qualification_type: QualificationType):
         """
         Download all qualifications for the given QualificationType
+        (see sync_qualification_type), returning a query for them
         """
-        for qualification in mturk.get_pages(
-            client().list_workers_with_qualification_type,
-            "Qualifications",
-            QualificationTypeId=qualification_type.id,
-        ):
-            cls.new_from_response(qualification, qualification_type)
-
+        cls.sync_qualification_type(qualification_type)
         return cls.select().where(cls.qualification_type == qualification_type.id)
 
+    @classmethod
+    def sync_qualification_type(
+        cls, qualification_type: QualificationType
+    ) -> QualificationDiff:
+        """
+        Make the local qualifications of the given QualificationType match MTurk's:
+        save the ones that are new or changed, and delete the ones that no longer exist
+        """
+        started = time.monotonic()
+        remote = cls._list_remote(client(), qualification_type.id)
+        return cls._apply_remote(qualification_type, remote, started)
+
+    @classmethod
+    def sync_qualification_types(
+        cls,
+        qualification_types: typing.Optional[typing.Iterable[QualificationType]] = None,
+        max_workers: int = 8,
+    ) -> typing.List[QualificationDiff]:
+        """
+        Sync the qualifications of several QualificationTypes (by default, all local ones)
+
+        Qualifications are listed concurrently; each type's changes are saved on this thread,
+        as soon as its listing is complete. Types MTurk refuses to list (e.g., deleted ones)
+        are skipped.
+        """
+        if qualification_types is None:
+            qualification_types = QualificationType.select()
+        qualification_types = list(qualification_types)
+        mturk_client = client()
+        started = time.monotonic()
+
+        def list_remote(qualification_type):
+            try:
+                return cls._list_remote(mturk_client, qualification_type.id)
+            except botocore.exceptions.ClientError as error:
+                if error.response.get("Error", {}).get("Code") != "RequestError":
+                    raise
+                logger.warning(
+                    "Not syncing QualificationType %s: %s", qualification_type.id, error
+                )
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [
+                cls._apply_remote(qualification_type, remote, started)
+                for qualification_type, remote in zip(
+                    qualification_types,
+                    executor.map(list_remote, qualification_types),
+                )
+                if remote is not None
+            ]
+
+    @classmethod
+    def _list_remote(
+        cls, mturk_client, qualification_type_id: str
+    ) -> typing.Dict[str, typing.Dict]:
+        # Every qualification of the type on MTurk, by WorkerId
+        remote = {}
+        for status in QUALIFICATION_STATUSES:
+            for qualification in mturk.get_pages(
+                mturk_client.list_workers_with_qualification_type,
+                "Qualifications",
+                QualificationTypeId=qualification_type_id,
+                Status=status,
+            ):
+                remote[qualification["WorkerId"]] = qualification
+        return remote
+
+    @classmethod
+    def _apply_remote(
+        cls,
+        qualification_type: QualificationType,
+        remote: typing.Dict[str, typing.Dict],
+        started: float,
+    ) -> QualificationDiff:
+        local = dict(
+            cls.select(cls.worker, cls.details)
+            .where(cls.qualification_type == qualification_type)
+            .tuples()
+            .iterator()
+        )
+        inserted = sorted(remote.keys() - local.keys())
+        deleted = sorted(local.keys() - remote.keys())
+        updated = sorted(
+            worker_id
+            for worker_id in remote.keys() & local.keys()
+            if stored_json(remote[worker_id]) != local[worker_id]
+        )
+        rows = [
+            cls._new_row(
+                qualification_type=qualification_type.id,
+                worker=worker_id,
+                GrantTime=_as_datetime(remote[worker_id]["GrantTime"]).isoformat(),
+                Status=remote[worker_id]["Status"],
+                details=remote[worker_id],
+            )
+            for worker_id in inserted + updated
+        ]
+
+        # Rows are written in bulk, in chunks well below SQLite's limit on query variables
+        with _database.atomic():
+            for start in range(0, len(inserted), 500):
+                Worker.insert_many(
+                    [{"id": worker_id} for worker_id in inserted[start : start + 500]]
+                ).on_conflict_ignore().execute()
+            for start in range(0, len(rows), 100):
+                cls.insert_many(
+                    rows[start : start + 100]
+                ).on_conflict_replace().execute()
+            for worker_id in inserted + updated:
+                _run_save_hooks(cls, local.get(worker_id), remote[worker_id])
+            for start in range(0, len(deleted), 500):
+                cls.delete().where(
+                    (cls.qualification_type == qualification_type)
+                    & (cls.worker.in_(deleted[start : start + 500]))
+                ).execute()
+            for worker_id in deleted:
+                _run_delete_hooks(cls, local[worker_id])
+        if rows:
+            _forget(cls)
+
+        diff = QualificationDiff(
+            qualification_type.id,
+            inserted,
+            updated,
+            deleted,
+            len(remote) - len(inserted) - len(updated),
+        )
+        logger.info(
+            "Synced qualifications for QualificationType %s in %.1fs: "
+            "%d new, %d changed, %d deleted, %d unchanged",
+            qualification_type.id,
+            time.monotonic() - started,
+            len(diff.inserted),
+            len(diff.updated),
+            len(diff.deleted),
+            diff.unchanged,
+        )
+        return diff
+
 
 TypeHit = typing.TypeVar("TypeHit", bound="Hit")
 
+# The HITStatus of a deleted HIT
+DELETED_HIT_STATUS = "Disposed"
+
 
 class Hit(BaseModel):
     """
@@ -433,6 +1313,7 @@ class Hit(BaseModel):
 
     id = peewee.CharField(max_length=256, primary_key=True, column_name="HITId")
     hit_type = peewee.CharField(max_length=256, column_name="HITTypeId")
+    project = peewee.CharField(max_length=256, null=True, index=True)
     details = SerializableJSONField()
 
     def __str__(self):
@@ -493,6 +1374,13 @@ class Hit(BaseModel):
         """
         return self.total_assignments == self.completed_assignments
 
+    @property
+    def deleted(self) -> bool:
+        """
+        Return true if the HIT was deleted from MTurk (as far as we know)
+        """
+        return self.details.get("HITStatus") == DELETED_HIT_STATUS
+
     @property
     def completed(self) -> bool:
         """
@@ -500,8 +1388,8 @@ class Hit(BaseModel):
         Either all of them have been completed,
         or the HIT has expired and there are no pending or unreviewed assignments.
         """
-        # If all assigments have been graded, HIT is done
-        if self.all_assignments_completed:
+        # If all assigments have been graded, or the HIT was deleted, HIT is done
+        if self.all_assignments_completed or self.deleted:
             return True
 
         if self.expired:
@@ -546,16 +1434,55 @@ class Hit(BaseModel):
         )
         self.download(self.id)
 
+    @staticmethod
+    def project_from_annotation(
+        annotation: typing.Optional[str],
+    ) -> typing.Optional[str]:
+        """
+        Return the project a HIT was tagged with, given its RequesterAnnotation
+        """
+        if annotation is not None and annotation.startswith(PROJECT_ANNOTATION_PREFIX):
+            return annotation[len(PROJECT_ANNOTATION_PREFIX) :]
+        return None
+
+    @classmethod
+    def for_project(cls, project: str) -> peewee.ModelSelect:
+        """
+        Return a query for the HITs of the given project
+        """
+        return cls.select().where(cls.project == project)
+
+    @classmethod
+    def _backfill_project(cls) -> None:
+        """
+        Fill in the project of HITs saved before the project column existed
+        """
+        annotation = cls.details["RequesterAnnotation"]
+        updated = (
+            cls.update(
+                project=peewee.fn.SUBSTR(annotation, len(PROJECT_ANNOTATION_PREFIX) + 1)
+            )
+            .where(annotation.startswith(PROJECT_ANNOTATION_PREFIX))
+            .execute()
+        )
+        logger.info("Tagged %d existing HITs with their project", updated)
+
     @classmethod
     def _new_from_response(cls: typing.Type[TypeHit], hit: typing.Dict) -> TypeHit:
         hit_id = hit["HITId"]
-        logger.debug("Saving HIT %s", hit_id)
-        (
-            cls.insert(id=hit["HITId"], hit_type=hit["HITTypeId"], details=hit)
-            .on_conflict_replace()
-            .execute()
+        row_logger.debug("Saving HIT %s", hit_id)
+        previous = _previous_details(Hit, cls.id == hit_id, hit_id)
+        row = cls._new_row(
+            id=hit_id,
+            hit_type=hit["HITTypeId"],
+            project=cls.project_from_annotation(hit.get("RequesterAnnotation")),
+            details=hit,
         )
-        return cls.get(cls.id == hit_id)
+        with _database.atomic():
+            cls.insert(row).on_conflict_replace().execute()
+            _run_save_hooks(Hit, previous, hit)
+        # Built from what was saved, rather than read back
+        return _remember(cls._loaded(row))
 
     @classmethod
     def download(cls, hit_id: str) -> TypeHit:
@@ -566,6 +1493,30 @@ class Hit(BaseModel):
         hit = response["HIT"]
         return cls._new_from_response(hit)
 
+    @classmethod
+    def incomplete(cls) -> peewee.ModelSelect:
+        """
+        Return a query for the HITs that may not be completed (see completed):
+        those with assignments left to complete, that weren't deleted.
+        The rest of the completed logic needs the current time, so it isn't applied here.
+        """
+        status = cls.details["HITStatus"]
+        return cls.select().where(
+            (
+                cls.details["NumberOfAssignmentsCompleted"]
+                != cls.details["MaxAssignments"]
+            )
+            & (status.is_null() | (status != DELETED_HIT_STATUS))
+        )
+
+    def mark_deleted(self: TypeHit) -> TypeHit:
+        """
+        Record that the current HIT was deleted from MTurk (e.g., MTurk no longer knows it),
+        returning the updated HIT
+        """
+        # Saved like a response, so save hooks see the change
+        return self._new_from_response(dict(self.details, HITStatus=DELETED_HIT_STATUS))
+
     def redownload(self) -> TypeHit:
         """
         Re-download the current HIT.
@@ -574,14 +1525,49 @@ class Hit(BaseModel):
         return self.download(self.id)
 
     @classmethod
-    def download_all(cls) -> None:
+    def download_all(cls, project: typing.Optional[str] = None) -> None:
         """
         Download all HITs known to MTurk
 
         Remember that MTurk only retains more recent HITs.
+
+        If a project is given, only that project's HITs are saved. (MTurk can't filter
+        the listing itself; to refresh a project's known HITs without listing
+        the whole account, use objective_turk.projects.sync.)
         """
+        started = time.monotonic()
+        count = 0
         for hit in mturk.get_pages(client().list_hits, "HITs"):
+            if project is not None and project != cls.project_from_annotation(
+                hit.get("RequesterAnnotation")
+            ):
+                continue
             cls._new_from_response(hit)
+            count += 1
+        logger.info("Saved %d HITs in %.1fs", count, time.monotonic() - started)
+
+    @classmethod
+    def teardown(
+        cls,
+        hits: typing.Iterable[typing.Union["Hit", str]],
+        approve_submitted: bool = False,
+        feedback: typing.Optional[str] = None,
+        **options,
+    ) -> "objective_turk.bulk.BulkResult":
+        """
+        Expire the given HITs (or HITIds), optionally approve their submitted assignments,
+        and delete them, as one journaled job (see bulk.TeardownHits and jobs.resume,
+        whose options, such as max_workers and rate, can be given)
+        """
+        # Imported here, because bulk and jobs build on this module
+        # pylint: disable=import-outside-toplevel
+        from objective_turk import bulk
+        from objective_turk import jobs
+
+        hit_ids = [hit.id if isinstance(hit, Hit) else hit for hit in hits]
+        operation = bulk.TeardownHits(approve_submitted, feedback)
+        _, result = jobs.run(operation, hit_ids, **options)
+        return result
 
     def download_assignments(self) -> None:
         """
@@ -611,36 +1597,82 @@ class Assignment(BaseModel):
             ("Rejected", "Rejected"),
         ),
     )
+    # Copied out of details as milliseconds since the epoch, so timing analytics
+    # can load them without parsing JSON or timestamps (see analytics)
+    AcceptTime = peewee.TimestampField(
+        null=True, default=None, resolution=1000, utc=True, index=True
+    )
+    SubmitTime = peewee.TimestampField(
+        null=True, default=None, resolution=1000, utc=True
+    )
     details = SerializableJSONField()
 
     @classmethod
     def _new_from_response(
         cls, assignment: typing.Dict, hit: typing.Optional[Hit] = None
     ) -> None:
-        logger.debug("Saving assignment %s", assignment["AssignmentId"])
-        worker, _ = Worker.get_or_create(id=assignment["WorkerId"])
+        row_logger.debug("Saving assignment %s", assignment["AssignmentId"])
+        worker = Worker._get_or_create(assignment["WorkerId"])
         if hit is None:
             hit = Hit.get_by_id(assignment["HITId"])
-        Assignment.insert(
+
+        previous = _previous_details(
+            cls, cls.id == assignment["AssignmentId"], assignment["AssignmentId"]
+        )
+        row = Assignment._new_row(
             id=assignment["AssignmentId"],
             worker=worker,
             hit=hit,
             AssignmentStatus=assignment["AssignmentStatus"],
+            AcceptTime=_as_datetime(assignment.get("AcceptTime")),
+            SubmitTime=_as_datetime(assignment.get("SubmitTime")),
             details=assignment,
-        ).on_conflict_replace().execute()
+        )
+        with _database.atomic():
+            Assignment.insert(row).on_conflict_replace().execute()
+            _run_save_hooks(cls, previous, assignment)
+        if _identity_map() is not None:
+            _remember(Assignment._loaded(row))
+
+    @classmethod
+    def _backfill_times(cls) -> None:
+        """
+        Fill in the AcceptTime and SubmitTime of assignments saved before those columns existed
+        """
+
+        updated = cls.update(
+            AcceptTime=epoch_milliseconds(
+                peewee.fn.json_extract(cls.details, "$.AcceptTime")
+            ),
+            SubmitTime=epoch_milliseconds(
+                peewee.fn.json_extract(cls.details, "$.SubmitTime")
+            ),
+        ).execute()
+        logger.info("Filled in the times of %d existing assignments", updated)
+
+    @classmethod
+    def for_project(cls, project: str) -> peewee.ModelSelect:
+        """
+        Return a query for the assignments of the given project's HITs
+        """
+        return cls.select().join(Hit).where(Hit.project == project)
 
     @classmethod
     def download_assignments_for_hit(cls, hit: Hit) -> None:
         """
         Download all the assignments for the given HIT
         """
+        count = 0
         for assignment in mturk.get_pages(
             client().list_assignments_for_hit, "Assignments", HITId=hit.id
         ):
             cls._new_from_response(assignment, hit)
+            count += 1
+        logger.debug("Saved %d assignments for %s", count, hit)
 
     def __str__(self) -> str:
-        return f"Assignment {self.id} by Worker {self.worker} for {self.hit}"
+        # The IDs are read without loading the related rows
+        return f"Assignment {self.id} by Worker {self.WorkerId} for HIT {self.HITId}"
 
     def approve(self) -> None:
         """
@@ -667,28 +1699,14 @@ class Assignment(BaseModel):
         """
         Return a response's answers as a dictionary object
         """
-        answer_xml = self.details["Answer"]
-        root = xml.etree.ElementTree.fromstring(answer_xml)
-
-        answer_dict = {}
-        for answer in root:
-            field = answer.find(
-                "{http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd}QuestionIdentifier"
-            )
-            value = answer.find(
-                "{http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/2005-10-01/QuestionFormAnswers.xsd}FreeText"
-            )
-            if field is not None and value is not None:
-                answer_dict[field.text] = value.text
-
-        return answer_dict
+        return parse_answers(self.details["Answer"])
 
     def send_bonus(self, amount: str, message: str) -> None:
         """
         Pay a bonus to the worker for this assignment
         https://docs.aws.amazon.com/AWSMechTurk/latest/AWSMturkAPI/ApiReference_SendBonusOperation.html
         """
-        worker_id = str(self.worker.id)
+        worker_id = str(self.WorkerId)
         assignment_id = str(self.id)
 
         logger.info(
@@ -705,6 +1723,69 @@ class Assignment(BaseModel):
             AssignmentId=assignment_id,
             Reason=message,
         )
+        BonusPayment._new_from_response(
+            {
+                "WorkerId": worker_id,
+                "BonusAmount": amount,
+                "AssignmentId": assignment_id,
+                "Reason": message,
+                "GrantTime": now_utc(),
+            }
+        )
+
+    @property
+    def bonus_payments(self) -> peewee.ModelSelect:
+        """
+        Return a query for the bonuses paid for this assignment (that we know of)
+        """
+        return BonusPayment.select().where(BonusPayment.assignment == self.id)
+
+
+class BonusPayment(BaseModel):
+    """
+    A bonus paid to a worker, as recorded when it was sent
+
+    https://docs.aws.amazon.com/AWSMechTurk/latest/AWSMturkAPI/ApiReference_BonusPaymentDataStructureArticle.html
+    """
+
+    id = peewee.AutoField()
+    assignment = peewee.CharField(
+        max_length=256, index=True, column_name="AssignmentId"
+    )
+    worker = peewee.CharField(max_length=256, index=True, column_name="WorkerId")
+    BonusAmount = peewee.DecimalField(decimal_places=2, auto_round=True)
+    Reason = peewee.TextField(null=True)
+    GrantTime = peewee.DateTimeField(default=now_utc)
+    # Set for bonuses sent with a UniqueRequestToken, so the same bonus isn't recorded twice
+    UniqueRequestToken = peewee.CharField(max_length=64, null=True, unique=True)
+
+    def __str__(self):
+        return f"Bonus of ${self.BonusAmount} to {self.worker} for {self.assignment}"
+
+    @classmethod
+    def _new_from_response(cls, bonus: typing.Dict) -> None:
+        token = bonus.get("UniqueRequestToken")
+        if token is not None and cls.get_or_none(cls.UniqueRequestToken == token):
+            return
+        row_logger.debug("Saving bonus for assignment %s", bonus["AssignmentId"])
+        with _database.atomic():
+            cls.insert(
+                assignment=bonus["AssignmentId"],
+                worker=bonus["WorkerId"],
+                BonusAmount=decimal.Decimal(str(bonus["BonusAmount"])),
+                Reason=bonus.get("Reason"),
+                GrantTime=bonus.get("GrantTime") or now_utc(),
+                UniqueRequestToken=token,
+            ).execute()
+            _run_save_hooks(cls, None, bonus)
+
+
+class Feature(BaseModel):
+    """
+    An optional feature enabled for this database (see enable_feature)
+    """
+
+    id = peewee.CharField(max_length=64, primary_key=True, column_name="name")
 
 
 models: typing.List[peewee.Model] = [
@@ -713,9 +1794,93 @@ models: typing.List[peewee.Model] = [
     Qualification,
     Hit,
     Assignment,
+    BonusPayment,
+    Feature,
 ]
 
 
+def register_models(*new_models: typing.Type[peewee.Model]) -> None:
+    """
+    Add models defined outside this module to the ones whose tables
+    init creates (or, for an existing database, adds)
+
+    Databases already set up (e.g., when the module defining the models is imported
+    after init) get the new tables right away.
+    """
+    added = [model for model in new_models if model not in models]
+    models.extend(added)
+    if added:
+        for session in list(_set_up_sessions):
+            with session.activate():
+                migrate_database()
+
+
+# The models of each optional feature's tables, by the feature's name
+_features: typing.Dict[str, typing.List[typing.Type[peewee.Model]]] = {}
+
+
+def register_feature(name: str, *feature_models: typing.Type[peewee.Model]) -> None:
+    """
+    Register an optional feature, named after the module of this package implementing it,
+    with the models of its tables, which only databases that enable it have
+
+    The feature's save and delete hooks should be registered under its name,
+    so that they only run in sessions whose database has it enabled.
+    """
+    _features[name] = list(feature_models)
+
+
+def enable_feature(name: str) -> None:
+    """
+    Enable the named optional feature for the current session's database, creating its
+    tables (filled in from the data already there)
+
+    The choice is saved in the database, so from then on, every session using it
+    keeps the feature's tables up to date. (Sessions already open elsewhere,
+    e.g. in other processes, only do so once they're created again.)
+    """
+    session = _session()
+    if name in session.features:
+        return
+    importlib.import_module(f"{__package__}.{name}")
+    if name not in _features:
+        raise ValueError(f"Unknown feature: {name}")
+    logger.info("Enabling %s", name)
+    Feature.insert(id=name).on_conflict_ignore().execute()
+    session.features.add(name)
+    migrate_database()
+
+
+def require_feature(name: str) -> None:
+    """
+    Raise FeatureNotEnabledError if the named feature isn't enabled in the current session
+    """
+    if name not in _session().features:
+        raise FeatureNotEnabledError(name)
+
+
+def _load_features() -> None:
+    # Importing a feature's module registers its models and hooks
+    session = _session()
+    if not Feature.table_exists():
+        return
+    for (name,) in Feature.select(Feature.id).tuples():
+        try:
+            importlib.import_module(f"{__package__}.{name}")
+        except ImportError:
+            logger.warning("Ignoring unknown feature %s enabled for the database", name)
+            continue
+        session.features.add(name)
+
+
+def _session_models() -> typing.List[typing.Type[peewee.Model]]:
+    # The models whose tables the current session's database should have
+    features = _session().features
+    return models + [
+        model for name in sorted(features) for model in _features.get(name, [])
+    ]
+
+
 def notify_workers(
     subject: str, message: str, workers: typing.Iterable[Worker]
 ) -> None:
@@ -733,32 +1898,94 @@ def notify_workers(
 
 
 def create_db() -> None:
-    if _environment is None:
+    if current_session() is None:
         raise EnvironmentNotInitializedError()
 
-    _database.create_tables(models)
+    get_database().create_tables(_session_models())
 
 
 def setup_database() -> None:
     """
     Perform database setup
     """
-    if _environment is None:
+    if current_session() is None:
         raise EnvironmentNotInitializedError()
 
+    _load_features()
     some_exist = False
     all_exist = True
-    for model in models:
+    for model in _session_models():
         exists = model.table_exists()
         some_exist |= exists
         all_exist &= exists
 
     if all_exist:
-        logger.debug("Database setup appears complete")
+        logger.debug("Database tables exist")
+        migrate_database()
     elif some_exist:
-        logger.warning(
-            "Database appears only partially set up. This may cause problems later."
-        )
+        logger.info("Database appears only partially set up. Adding what's missing.")
+        migrate_database()
     else:
         logger.info("Database not set up. Setting up database!")
         create_db()
+
+
+# Functions that populate a newly added column (or, for None, a newly added table)
+# from data already in the database, keyed by (model, column name)
+_backfills: typing.Dict[
+    typing.Tuple[typing.Type[peewee.Model], str], typing.Callable
+] = {
+    # pylint: disable=protected-access
+    (Hit, "project"): Hit._backfill_project,
+    # (AcceptTime is added first, so by then both columns exist)
+    (Assignment, "SubmitTime"): Assignment._backfill_times,
+}
+
+
+def register_backfill(
+    model: typing.Type[peewee.Model],
+    backfill: typing.Callable,
+    column: typing.Optional[str] = None,
+) -> None:
+    """
+    Register a function that fills in the given model's table (or just one column)
+    from the data already in the database, when migrate_database adds it
+    """
+    _backfills[(model, column)] = backfill
+
+
+def migrate_database() -> None:
+    """
+    Bring a database created by an earlier version of this library up to date,
+    by adding any missing tables, columns and indexes
+    """
+    database = get_database()
+    migrator = playhouse.migrate.SqliteMigrator(database)
+    created = []
+    for model in _session_models():
+        if not model.table_exists():
+            logger.info("Creating table %s", model._meta.table_name)
+            database.create_tables([model])
+            created.append(model)
+            continue
+
+        table = model._meta.table_name
+        existing = {column.name for column in database.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name in existing:
+                continue
+            logger.info("Adding column %s to table %s", field.column_name, table)
+            with database.atomic():
+                playhouse.migrate.migrate(
+                    migrator.add_column(table, field.column_name, field)
+                )
+                backfill = _backfills.get((model, field.column_name))
+                if backfill is not None:
+                    backfill()
+
+    # Filled in once every table and column is in place, outside any transaction,
+    # since they may read other tables (or attach the archive)
+    for model in created:
+        backfill = _backfills.get((model, None))
+        if backfill is not None:
+            backfill()
@@ -0,0 +1,109 @@
+"""
+Project-scoped sync, export and review
+
+HITs created with a project (see create_hit) carry it in their RequesterAnnotation,
+and are indexed by it locally, so a team running one study in a shared account
+only needs to touch its own HITs and assignments.
+"""
+
+import csv
+import logging
+import typing
+
+import peewee
+
+from objective_turk import objective_turk
+from objective_turk import refresh
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPORT_FIELDS = [
+    "AssignmentId",
+    "WorkerId",
+    "HITId",
+    "AssignmentStatus",
+    "AcceptTime",
+    "SubmitTime",
+]
+
+
+def hits(project: str) -> peewee.ModelSelect:
+    """
+    Return a query for the project's HITs
+    """
+    return objective_turk.Hit.for_project(project)
+
+
+def assignments(project: str) -> peewee.ModelSelect:
+    """
+    Return a query for the assignments of the project's HITs
+    """
+    return objective_turk.Assignment.for_project(project)
+
+
+def sync(
+    project: str, discover: bool = False, max_workers: int = 8
+) -> refresh.RefreshResult:
+    """
+    Bring the project's unfinished HITs, and their assignments, up to date
+
+    Only HITs already known locally are fetched (one GetHIT each), so the cost
+    scales with the project rather than the account. HITs created through
+    create_hit are saved locally when they're created. To also pick up project
+    HITs created elsewhere, pass discover=True, which lists every HIT in the account.
+    """
+    if discover:
+        objective_turk.Hit.download_all(project=project)
+
+    hit_ids = [hit.id for hit in hits(project) if not hit.completed]
+    logger.info("Syncing %d unfinished HITs of project %s", len(hit_ids), project)
+    return refresh.execute(
+        refresh.RefreshPlan(hit_ids, refresh.GET_HIT, len(hit_ids)), max_workers
+    )
+
+
+def submitted_assignments(project: str) -> peewee.ModelSelect:
+    """
+    Return a query for the project's assignments that are waiting to be reviewed
+    """
+    Assignment = objective_turk.Assignment
+    return assignments(project).where(Assignment.AssignmentStatus == "Submitted")
+
+
+def approve_submitted(project: str) -> int:
+    """
+    Approve every submitted assignment of the project, returning how many were approved
+    """
+    count = 0
+    for assignment in submitted_assignments(project):
+        assignment.approve()
+        count += 1
+    logger.info("Approved %d assignments of project %s", count, project)
+    return count
+
+
+def export_assignments(
+    project: str,
+    output: typing.TextIO,
+    fields: typing.Sequence[str] = DEFAULT_EXPORT_FIELDS,
+    include_answers: bool = False,
+) -> int:
+    """
+    Write the project's assignments as CSV to the given output, returning the number of rows
+
+    With include_answers, every answer field found in the assignments gets a column.
+    """
+    rows = []
+    answer_fields: typing.Dict[str, None] = {}
+    for assignment in assignments(project):
+        row = {field: assignment.details.get(field) for field in fields}
+        if include_answers:
+            answers = assignment.answers
+            answer_fields.update(dict.fromkeys(answers))
+            row.update(answers)
+        rows.append(row)
+
+    writer = csv.DictWriter(output, list(fields) + list(answer_fields))
+    writer.writeheader()
+    writer.writerows(rows)
+    return len(rows)
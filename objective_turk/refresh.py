@@ -0,0 +1,295 @@
+"""
+Plan and carry out the cheapest refresh of every stale or incomplete HIT
+
+Hit.completed returns False for HITs whose data is out of date, leaving the
+re-download to other code. This module is that code: it finds all such HITs in
+one query, decides whether fetching them one at a time (GetHIT) or paging
+through a listing (ListHITs or ListReviewableHITs) takes fewer API calls,
+fetches them concurrently, and saves the results (and any changed assignments)
+in bulk.
+"""
+
+import concurrent.futures
+import logging
+import math
+import typing
+
+import botocore.exceptions
+import peewee
+
+import mturk
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+
+# Stay well below SQLite's limit on the number of variables in a query
+IN_CHUNK_SIZE = 500
+
+GET_HIT = "get_hit"
+LIST_HITS = "list_hits"
+LIST_REVIEWABLE_HITS = "list_reviewable_hits"
+
+
+class RefreshPlan:
+    """
+    The HITs to refresh, and the API calls we expect that to take
+    """
+
+    def __init__(self, hit_ids: typing.List[str], strategy: str, estimated_calls: int):
+        self.hit_ids = hit_ids
+        self.strategy = strategy
+        self.estimated_calls = estimated_calls
+
+    def __repr__(self):
+        return (
+            f"<RefreshPlan {len(self.hit_ids)} HITs via {self.strategy}, "
+            f"~{self.estimated_calls} calls>"
+        )
+
+
+class RefreshResult:
+    """
+    What a refresh did
+    """
+
+    def __init__(self):
+        self.hits_refreshed = 0
+        self.hits_missing: typing.List[str] = []
+        self.assignment_syncs = 0
+        self.assignments_saved = 0
+        self.api_calls = 0
+
+    def __repr__(self):
+        return (
+            f"<RefreshResult {self.hits_refreshed} HITs refreshed, "
+            f"{len(self.hits_missing)} missing, {self.assignments_saved} assignments "
+            f"saved from {self.assignment_syncs} HITs, {self.api_calls} API calls>"
+        )
+
+
+def _chunks(items: typing.List, size: int = IN_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def stale_hits() -> typing.List[objective_turk.Hit]:
+    """
+    Return every local HIT that isn't completed, including those with out-of-date data
+
+    HITs whose assignments are all completed, or that were deleted, are excluded in SQL
+    (see Hit.incomplete); the rest of the Hit.completed logic is applied to what remains.
+    """
+    return [hit for hit in objective_turk.Hit.incomplete() if not hit.completed]
+
+
+def _expected_reviewable(hit: objective_turk.Hit) -> bool:
+    # An expired HIT with no pending assignments should show up as Reviewable,
+    # unless it's been moved on (to Reviewing or Disposed).
+    return (
+        hit.expired
+        and hit.pending_assignments == 0
+        and hit.details.get("HITStatus") not in ("Reviewing", "Disposed")
+    )
+
+
+def plan(
+    hits: typing.Optional[typing.List[objective_turk.Hit]] = None,
+    page_size: int = PAGE_SIZE,
+) -> RefreshPlan:
+    """
+    Choose how to refresh the given HITs (by default, all stale ones) in the fewest API calls
+
+    Listing costs one call per page of *all* matching HITs in the account,
+    which we estimate from the local database.
+    """
+    if hits is None:
+        hits = stale_hits()
+    hit_ids = [hit.id for hit in hits]
+    if not hits:
+        return RefreshPlan(hit_ids, GET_HIT, 0)
+
+    Hit = objective_turk.Hit
+    options = [(len(hits), GET_HIT)]
+
+    total_hits = Hit.select().count()
+    options.append((math.ceil(total_hits / page_size), LIST_HITS))
+
+    if all(_expected_reviewable(hit) for hit in hits):
+        reviewable = sum(1 for hit in Hit.select() if _expected_reviewable(hit))
+        options.append((math.ceil(reviewable / page_size), LIST_REVIEWABLE_HITS))
+
+    estimated_calls, strategy = min(options)
+    return RefreshPlan(hit_ids, strategy, estimated_calls)
+
+
+def _fetch_individually(
+    hit_ids: typing.Iterable[str], max_workers: int, result: RefreshResult
+) -> typing.Dict[str, typing.Dict]:
+    client = objective_turk.client()
+
+    def fetch(hit_id):
+        try:
+            return client.get_hit(HITId=hit_id)["HIT"]
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] != "RequestError":
+                raise
+            return None  # the HIT has been deleted
+
+    hit_ids = list(hit_ids)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = list(executor.map(fetch, hit_ids))
+    result.api_calls += len(hit_ids)
+    return {
+        hit_id: response
+        for hit_id, response in zip(hit_ids, responses)
+        if response is not None
+    }
+
+
+def _fetch_by_listing(
+    action, wanted: typing.Set[str], result: RefreshResult, **kwargs
+) -> typing.Dict[str, typing.Dict]:
+    found = {}
+    pages = 0
+
+    def counting_action(**page_kwargs):
+        nonlocal pages
+        pages += 1
+        return action(**page_kwargs)
+
+    for hit in mturk.get_pages(counting_action, "HITs", MaxResults=PAGE_SIZE, **kwargs):
+        if hit["HITId"] in wanted:
+            found[hit["HITId"]] = hit
+            if len(found) == len(wanted):
+                break
+    result.api_calls += pages
+    return found
+
+
+def _fetch_assignments(
+    hit_ids: typing.List[str], max_workers: int, result: RefreshResult
+) -> typing.Dict[str, typing.List[typing.Dict]]:
+    client = objective_turk.client()
+    calls = [0] * len(hit_ids)
+
+    def fetch(index_and_id):
+        index, hit_id = index_and_id
+
+        def counting_action(**kwargs):
+            calls[index] += 1
+            return client.list_assignments_for_hit(**kwargs)
+
+        return list(
+            mturk.get_pages(
+                counting_action, "Assignments", HITId=hit_id, MaxResults=PAGE_SIZE
+            )
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = list(executor.map(fetch, enumerate(hit_ids)))
+    result.api_calls += sum(calls)
+    return dict(zip(hit_ids, responses))
+
+
+def execute(refresh_plan: RefreshPlan, max_workers: int = 8) -> RefreshResult:
+    """
+    Carry out a refresh plan
+
+    API calls are made concurrently; all database writes happen afterwards,
+    on this thread, in one transaction for HITs and one for assignments.
+    """
+    result = RefreshResult()
+    wanted = set(refresh_plan.hit_ids)
+    if not wanted:
+        return result
+
+    logger.info("Refreshing %s", refresh_plan)
+    client = objective_turk.client()
+    if refresh_plan.strategy == LIST_HITS:
+        fetched = _fetch_by_listing(client.list_hits, wanted, result)
+    elif refresh_plan.strategy == LIST_REVIEWABLE_HITS:
+        fetched = _fetch_by_listing(
+            client.list_reviewable_hits, wanted, result, Status="Reviewable"
+        )
+    else:
+        fetched = {}
+
+    # Anything the listing didn't turn up (or everything, for GetHIT) is fetched directly
+    fetched.update(_fetch_individually(wanted - set(fetched), max_workers, result))
+    result.hits_missing = sorted(wanted - set(fetched))
+    for hit_id in result.hits_missing:
+        logger.warning("HIT %s no longer exists on MTurk", hit_id)
+
+    Hit = objective_turk.Hit
+    # Marked deleted, so they're completed, and aren't refreshed again
+    with objective_turk.get_database().atomic():
+        for chunk in _chunks(result.hits_missing):
+            for hit in Hit.select().where(Hit.id.in_(chunk)):
+                hit.mark_deleted()
+
+    Assignment = objective_turk.Assignment
+    previous = {}
+    local_assignments = {}
+    for chunk in _chunks(list(fetched)):
+        previous.update(
+            (hit.id, hit.details) for hit in Hit.select().where(Hit.id.in_(chunk))
+        )
+        local_assignments.update(
+            Assignment.select(Assignment.hit, peewee.fn.COUNT(Assignment.id))
+            .where(Assignment.hit.in_(chunk))
+            .group_by(Assignment.hit)
+            .tuples()
+        )
+
+    with objective_turk.get_database().atomic():
+        for hit in fetched.values():
+            # pylint: disable=protected-access
+            Hit._new_from_response(hit)
+    result.hits_refreshed = len(fetched)
+
+    # Assignments only need to be synced where the counters say something happened
+    # that we haven't seen yet.
+    needs_sync = []
+    for hit_id, hit in fetched.items():
+        old = previous.get(hit_id, {})
+        counters_changed = any(
+            old.get(field) != hit.get(field)
+            for field in (
+                "NumberOfAssignmentsPending",
+                "NumberOfAssignmentsAvailable",
+                "NumberOfAssignmentsCompleted",
+            )
+        )
+        submitted_or_done = (
+            hit["MaxAssignments"]
+            - hit["NumberOfAssignmentsAvailable"]
+            - hit["NumberOfAssignmentsPending"]
+        )
+        if counters_changed or local_assignments.get(hit_id, 0) != submitted_or_done:
+            needs_sync.append(hit_id)
+
+    assignments = _fetch_assignments(needs_sync, max_workers, result)
+    with objective_turk.get_database().atomic():
+        hits = {
+            hit.id: hit
+            for chunk in _chunks(needs_sync)
+            for hit in Hit.select().where(Hit.id.in_(chunk))
+        }
+        for hit_id, hit_assignments in assignments.items():
+            for assignment in hit_assignments:
+                # pylint: disable=protected-access
+                Assignment._new_from_response(assignment, hits[hit_id])
+            result.assignments_saved += len(hit_assignments)
+    result.assignment_syncs = len(needs_sync)
+
+    logger.info("Finished: %s", result)
+    return result
+
+
+def refresh_stale(max_workers: int = 8) -> RefreshResult:
+    """
+    Bring every stale or incomplete HIT (and its assignments) up to date
+    """
+    return execute(plan(), max_workers)
@@ -0,0 +1,301 @@
+"""
+A long-running watcher that keeps active HITs up to date
+
+Rather than re-downloading every HIT on a fixed schedule, the watcher polls each
+HIT on its own adaptive schedule: more often as it nears expiration or while
+workers have assignments pending, and not at all once Hit.completed is true.
+Assignments are only downloaded for HITs whose counters changed.
+"""
+
+import heapq
+import logging
+import threading
+import time
+import typing
+
+import botocore.exceptions
+
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# The fields of a HIT whose change means there may be new or updated assignments
+ASSIGNMENT_COUNTERS = (
+    "NumberOfAssignmentsPending",
+    "NumberOfAssignmentsAvailable",
+    "NumberOfAssignmentsCompleted",
+    "MaxAssignments",
+)
+
+WATCHED_FIELDS = ASSIGNMENT_COUNTERS + ("HITStatus", "Expiration", "HITReviewStatus")
+
+
+class HitChange:
+    """
+    A change to a watched HIT, as delivered to callbacks
+
+    changes maps each changed HIT field to its (old, new) values.
+    new_assignments and updated_assignments list the AssignmentIds that appeared
+    or changed status in this poll.
+    """
+
+    def __init__(
+        self,
+        hit: objective_turk.Hit,
+        changes: typing.Dict[str, typing.Tuple[typing.Any, typing.Any]],
+        new_assignments: typing.List[str],
+        updated_assignments: typing.List[str],
+    ):
+        self.hit = hit
+        self.changes = changes
+        self.new_assignments = new_assignments
+        self.updated_assignments = updated_assignments
+
+    def __repr__(self):
+        return (
+            f"<HitChange {self.hit.id} changes={sorted(self.changes)} "
+            f"new={len(self.new_assignments)} updated={len(self.updated_assignments)}>"
+        )
+
+
+Callback = typing.Callable[[HitChange], None]
+
+
+class HitWatcher:
+    """
+    Poll active HITs on an adaptive schedule and report changes to callbacks
+
+    Poll intervals are derived from each HIT's state:
+    - a HIT that is completed is no longer polled;
+    - a HIT that MTurk no longer knows is marked deleted, and no longer polled;
+    - a HIT whose poll fails is retried after min_interval, doubling with each failure;
+    - an expired HIT whose data predates its expiration is polled once more, right away;
+    - otherwise the interval is a fraction of the time left before expiration,
+      divided further by the number of pending assignments,
+      and clamped between min_interval and max_interval (in seconds).
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 30,
+        max_interval: float = 3600,
+        expiration_fraction: float = 0.1,
+        discover_interval: typing.Optional[float] = 300,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.expiration_fraction = expiration_fraction
+        self.discover_interval = discover_interval
+        self._callbacks: typing.List[Callback] = []
+        self._schedule: typing.List[typing.Tuple[float, str]] = []
+        self._due: typing.Dict[str, float] = {}
+        self._last_discovery: typing.Optional[float] = None
+        # Consecutive failed polls, by HIT
+        self._failures: typing.Dict[str, int] = {}
+        self.polls = 0
+
+    def on_change(self, callback: Callback) -> Callback:
+        """
+        Register a callback to be called with a HitChange whenever a watched HIT changes
+
+        Can be used as a decorator.
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def interval(self, hit: objective_turk.Hit) -> typing.Optional[float]:
+        """
+        Return how many seconds to wait before polling the given HIT again,
+        or None if it doesn't need to be polled anymore
+        """
+        if hit.completed:
+            return None
+
+        if hit.expired:
+            if not hit.updated_after_expiration:
+                # Our last look predates the expiration, so we need one more.
+                return 0.0
+            # Expired, but assignments are still pending or awaiting review.
+            # Those only change slowly (workers finishing up, or our own reviews).
+            interval = self.max_interval / 4
+        else:
+            time_left = (hit.expiration - objective_turk.now_utc()).total_seconds()
+            interval = time_left * self.expiration_fraction
+
+        interval /= 1 + hit.pending_assignments
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def watch(self, hit: objective_turk.Hit, delay: typing.Optional[float] = None):
+        """
+        Start watching the given HIT (or reschedule it)
+        """
+        if delay is None:
+            delay = self.interval(hit)
+        if delay is None:
+            self.unwatch(hit.id)
+            return
+        self._schedule_poll(hit.id, delay)
+
+    def _schedule_poll(self, hit_id: str, delay: float) -> None:
+        due = time.monotonic() + delay
+        self._due[hit_id] = due
+        heapq.heappush(self._schedule, (due, hit_id))
+
+    def unwatch(self, hit_id: str) -> None:
+        # Entries left in the heap are skipped once they're no longer in _due.
+        self._due.pop(hit_id, None)
+        self._failures.pop(hit_id, None)
+
+    @property
+    def watched(self) -> typing.List[str]:
+        return list(self._due)
+
+    def discover(self) -> int:
+        """
+        Start watching every HIT in the local database that isn't completed yet
+
+        New HITs arrive in the database through create_hit or a sync,
+        so this doesn't need to call the API.
+        """
+        added = 0
+        for hit in objective_turk.Hit.incomplete():
+            if hit.id not in self._due:
+                delay = self.interval(hit)
+                if delay is not None:
+                    self.watch(hit, delay)
+                    added += 1
+        self._last_discovery = time.monotonic()
+        if added:
+            logger.info("Watching %d more HITs (%d total)", added, len(self._due))
+        return added
+
+    def _assignment_states(self, hit_id: str) -> typing.Dict[str, str]:
+        Assignment = objective_turk.Assignment
+        return {
+            row[0]: row[1]
+            for row in Assignment.select(Assignment.id, Assignment.AssignmentStatus)
+            .where(Assignment.hit == hit_id)
+            .tuples()
+        }
+
+    def poll(self, hit_id: str) -> typing.Optional[HitChange]:
+        """
+        Poll a single HIT now, returning the change (if any) and rescheduling it
+        """
+        previous = objective_turk.Hit.get_or_none(objective_turk.Hit.id == hit_id)
+        previous_details = previous.details if previous is not None else {}
+
+        hit = objective_turk.Hit.download(hit_id)
+        self.polls += 1
+
+        changes = {
+            field: (previous_details.get(field), hit.details.get(field))
+            for field in WATCHED_FIELDS
+            if previous_details.get(field) != hit.details.get(field)
+        }
+
+        new_assignments: typing.List[str] = []
+        updated_assignments: typing.List[str] = []
+        if previous is None or any(field in changes for field in ASSIGNMENT_COUNTERS):
+            before = self._assignment_states(hit_id)
+            hit.download_assignments()
+            after = self._assignment_states(hit_id)
+            new_assignments = [
+                assignment for assignment in after if assignment not in before
+            ]
+            updated_assignments = [
+                assignment
+                for assignment, status in after.items()
+                if assignment in before and before[assignment] != status
+            ]
+
+        self.watch(hit)
+
+        if not changes and not new_assignments and not updated_assignments:
+            return None
+
+        change = HitChange(hit, changes, new_assignments, updated_assignments)
+        logger.debug("Detected %s", change)
+        for callback in self._callbacks:
+            try:
+                callback(change)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Watcher callback %s failed", callback)
+        return change
+
+    def poll_due(self) -> typing.List[HitChange]:
+        """
+        Poll every HIT whose time has come, and return the changes found
+        """
+        if self.discover_interval is not None and (
+            self._last_discovery is None
+            or time.monotonic() - self._last_discovery >= self.discover_interval
+        ):
+            self.discover()
+
+        changes = []
+        while self._schedule and self._schedule[0][0] <= time.monotonic():
+            due, hit_id = heapq.heappop(self._schedule)
+            if self._due.get(hit_id) != due:
+                continue  # unwatched or rescheduled since
+            del self._due[hit_id]
+            try:
+                change = self.poll(hit_id)
+            except botocore.exceptions.ClientError as error:
+                if error.response.get("Error", {}).get("Code") != "RequestError":
+                    self._poll_failed(hit_id)
+                    continue
+                # MTurk doesn't know the HIT anymore, so it was deleted
+                logger.warning("HIT %s no longer exists on MTurk", hit_id)
+                hit = objective_turk.Hit.get_or_none(objective_turk.Hit.id == hit_id)
+                if hit is not None:
+                    hit.mark_deleted()
+                self._failures.pop(hit_id, None)
+                continue
+            except Exception:  # pylint: disable=broad-except
+                self._poll_failed(hit_id)
+                continue
+            self._failures.pop(hit_id, None)
+            if change is not None:
+                changes.append(change)
+        return changes
+
+    def _poll_failed(self, hit_id: str) -> None:
+        # Back off exponentially, so a HIT that keeps failing doesn't take over the watcher
+        failures = self._failures.get(hit_id, 0) + 1
+        self._failures[hit_id] = failures
+        delay = min(self.min_interval * 2 ** (failures - 1), self.max_interval)
+        logger.exception(
+            "Failed to poll HIT %s (%d times); will retry in %.0fs",
+            hit_id,
+            failures,
+            delay,
+        )
+        self._schedule_poll(hit_id, delay)
+
+    def seconds_until_next_poll(self) -> typing.Optional[float]:
+        while self._schedule and self._due.get(self._schedule[0][1]) != (
+            self._schedule[0][0]
+        ):
+            heapq.heappop(self._schedule)
+        if not self._schedule:
+            return None
+        return max(self._schedule[0][0] - time.monotonic(), 0.0)
+
+    def run(self, stop: typing.Optional[threading.Event] = None) -> None:
+        """
+        Keep polling until the stop event is set (or forever)
+        """
+        if stop is None:
+            stop = threading.Event()
+        logger.info("Starting HIT watcher")
+        while not stop.is_set():
+            self.poll_due()
+            wait = self.seconds_until_next_poll()
+            if self.discover_interval is not None:
+                next_discovery = self.discover_interval - (
+                    time.monotonic() - (self._last_discovery or 0)
+                )
+                wait = next_discovery if wait is None else min(wait, next_discovery)
+            stop.wait(max(wait if wait is not None else self.max_interval, 0.0))
+        logger.info("Stopped HIT watcher after %d polls", self.polls)
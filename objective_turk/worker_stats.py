@@ -0,0 +1,327 @@
+"""
+Per-worker statistics, kept up to date as assignments and bonuses are saved
+
+Screening workers means asking the same questions over and over: how many
+assignments did they do, how many were approved, how long do they take?
+Rather than scan every assignment each time, the answers are kept in one row
+per worker, which save hooks update whenever an assignment is saved or
+changes status (through downloads, approve/reject, notifications or bulk
+operations) and whenever a bonus is recorded. rebuild recomputes the whole
+table from scratch, e.g. after importing a database from elsewhere.
+
+Statistics are optional, since they add a write to every assignment saved: enable them
+once for a database (worker_stats.enable(), after init), which computes them from the
+assignments already there, and from then on every session using it keeps them up to date.
+
+Median work times are computed from a histogram with logarithmic buckets,
+so they are approximate (within about 1%), but updating them costs O(1).
+"""
+
+import bisect
+import datetime
+import decimal
+import functools
+import logging
+import math
+import typing
+
+import peewee
+
+from objective_turk import archive
+from objective_turk import objective_turk
+
+logger = logging.getLogger(__name__)
+
+# Each histogram bucket covers work times up to this factor apart
+BUCKET_GROWTH = 1.02
+
+STATUS_FIELDS = {
+    "Submitted": "submitted",
+    "Approved": "approved",
+    "Rejected": "rejected",
+}
+
+
+class WorkerStats(objective_turk.BaseModel):
+    """
+    Statistics about one worker's assignments and bonuses
+
+    Work times are in seconds, from accepting an assignment to submitting it.
+    """
+
+    id = peewee.CharField(max_length=256, primary_key=True, column_name="WorkerId")
+    assignments = peewee.IntegerField(default=0)
+    submitted = peewee.IntegerField(default=0)
+    approved = peewee.IntegerField(default=0)
+    rejected = peewee.IntegerField(default=0)
+    first_seen = peewee.DateTimeField(null=True)
+    last_seen = peewee.DateTimeField(null=True)
+    work_time_count = peewee.IntegerField(default=0)
+    work_time_total = peewee.FloatField(default=0)
+    # Number of work times in each logarithmic bucket (see _bucket)
+    work_time_histogram = objective_turk.SerializableJSONField(default=dict)
+    bonuses = peewee.IntegerField(default=0)
+    bonus_total = peewee.DecimalField(decimal_places=2, auto_round=True, default=0)
+
+    @property
+    def reviewed(self) -> int:
+        return self.approved + self.rejected
+
+    @property
+    def approval_rate(self) -> typing.Optional[float]:
+        if self.reviewed == 0:
+            return None
+        return self.approved / self.reviewed
+
+    @property
+    def mean_work_time(self) -> typing.Optional[float]:
+        if self.work_time_count == 0:
+            return None
+        return self.work_time_total / self.work_time_count
+
+    @property
+    def median_work_time(self) -> typing.Optional[float]:
+        return _histogram_quantile(self.work_time_histogram, 0.5)
+
+
+objective_turk.register_feature("worker_stats", WorkerStats)
+
+
+def enable() -> None:
+    """
+    Start keeping worker statistics in the current session's database (see enable_feature)
+    """
+    objective_turk.enable_feature("worker_stats")
+
+
+def for_worker(worker_id: str) -> WorkerStats:
+    """
+    Return the statistics of the given worker (all zero, for a worker we haven't seen)
+    """
+    objective_turk.require_feature("worker_stats")
+    stats = WorkerStats.get_or_none(WorkerStats.id == worker_id)
+    return stats if stats is not None else WorkerStats(id=worker_id)
+
+
+def _timestamp(value: typing.Any) -> typing.Optional[datetime.datetime]:
+    # Responses contain datetimes, while details loaded from the database contain strings
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+def _work_time(assignment: typing.Dict) -> typing.Optional[float]:
+    accepted = _timestamp(assignment.get("AcceptTime"))
+    submitted = _timestamp(assignment.get("SubmitTime"))
+    if accepted is None or submitted is None:
+        return None
+    return max((submitted - accepted).total_seconds(), 0.0)
+
+
+def _bucket(work_time: float) -> str:
+    # JSON object keys are strings
+    return str(int(math.log1p(work_time) / math.log(BUCKET_GROWTH)))
+
+
+def _bucket_value(bucket: str) -> float:
+    return math.expm1((int(bucket) + 0.5) * math.log(BUCKET_GROWTH))
+
+
+def _histogram_quantile(
+    histogram: typing.Dict[str, int], quantile: float
+) -> typing.Optional[float]:
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+    buckets = sorted(histogram, key=int)
+    cumulative = []
+    running = 0
+    for bucket in buckets:
+        running += histogram[bucket]
+        cumulative.append(running)
+    index = bisect.bisect_left(cumulative, quantile * total)
+    return _bucket_value(buckets[min(index, len(buckets) - 1)])
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    # Responses have times in the local timezone, whose offset changes (e.g., with DST),
+    # while first_seen and last_seen are compared as text, so they're all stored in UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def _apply(
+    stats: WorkerStats, assignment: typing.Dict, sign: int, include_times: bool
+) -> None:
+    """
+    Add (sign=1) or remove (sign=-1) an assignment's contribution to the statistics
+    """
+    field = STATUS_FIELDS.get(assignment.get("AssignmentStatus"))
+    if field is not None:
+        setattr(stats, field, getattr(stats, field) + sign)
+    if not include_times:
+        return
+
+    stats.assignments += sign
+    work_time = _work_time(assignment)
+    if work_time is not None:
+        stats.work_time_count += sign
+        stats.work_time_total += sign * work_time
+        histogram = dict(stats.work_time_histogram or {})
+        bucket = _bucket(work_time)
+        histogram[bucket] = histogram.get(bucket, 0) + sign
+        if histogram[bucket] <= 0:
+            del histogram[bucket]
+        stats.work_time_histogram = histogram
+
+    seen = _timestamp(assignment.get("AcceptTime") or assignment.get("SubmitTime"))
+    if seen is not None and sign > 0:
+        seen = _as_utc(seen)
+        first_seen = _timestamp(stats.first_seen)
+        last_seen = _timestamp(stats.last_seen)
+        if first_seen is None or seen < _as_utc(first_seen):
+            stats.first_seen = seen
+        if last_seen is None or seen > _as_utc(last_seen):
+            stats.last_seen = seen
+
+
+def _load(worker_id: str) -> typing.Tuple[WorkerStats, bool]:
+    stats = WorkerStats.get_or_none(WorkerStats.id == worker_id)
+    if stats is None:
+        return WorkerStats(id=worker_id), True
+    return stats, False
+
+
+def _on_assignment_saved(
+    previous: typing.Optional[typing.Dict], current: typing.Dict
+) -> None:
+    # Each case is a single statement, since this runs for every assignment saved
+    if previous is None:
+        _add_assignment(current)
+        return
+
+    old = STATUS_FIELDS.get(previous.get("AssignmentStatus"))
+    new = STATUS_FIELDS.get(current.get("AssignmentStatus"))
+    if old == new:
+        return  # nothing we count has changed
+    changes = [f'"{old}" = "{old}" - 1'] if old is not None else []
+    if new is not None:
+        changes.append(f'"{new}" = "{new}" + 1')
+    objective_turk.get_database().execute_sql(
+        f'UPDATE "{WorkerStats._meta.table_name}" SET {", ".join(changes)}, '
+        f'"updated_at" = ? WHERE "{WorkerStats.id.column_name}" = ?',
+        (
+            WorkerStats.updated_at.db_value(objective_turk.now_utc()),
+            current["WorkerId"],
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _upsert_sql() -> str:
+    # Written out once, since building it with peewee for every assignment is slow
+    fields = WorkerStats._meta.sorted_fields
+    added = ["assignments", "submitted", "approved", "rejected"]
+    added += ["work_time_count", "work_time_total"]
+    updates = [f'"{name}" = "{name}" + excluded."{name}"' for name in added]
+    # DateTimeFields are stored as ISO 8601 text, which sorts chronologically
+    for name, function in (("first_seen", "MIN"), ("last_seen", "MAX")):
+        updates.append(
+            f'"{name}" = {function}(COALESCE("{name}", excluded."{name}"), '
+            f'COALESCE(excluded."{name}", "{name}"))'
+        )
+    # The first parameter is the JSON path of the work time's bucket (NULL if there is none)
+    histogram = "work_time_histogram"
+    updates.append(
+        f'"{histogram}" = CASE WHEN ?1 IS NULL THEN "{histogram}" '
+        f"ELSE json_set(COALESCE(\"{histogram}\", '{{}}'), ?1, "
+        f'COALESCE(json_extract("{histogram}", ?1), 0) + 1) END'
+    )
+    updates.append('"updated_at" = excluded."updated_at"')
+    columns = ", ".join(f'"{field.column_name}"' for field in fields)
+    values = ", ".join(f"?{number}" for number in range(2, len(fields) + 2))
+    return (
+        f'INSERT INTO "{WorkerStats._meta.table_name}" ({columns}) VALUES ({values}) '
+        f'ON CONFLICT ("{WorkerStats.id.column_name}") DO UPDATE SET {", ".join(updates)}'
+    )
+
+
+def _add_assignment(assignment: typing.Dict) -> None:
+    # The statistics of this assignment alone, added to the worker's (if there are any)
+    stats = WorkerStats(id=assignment["WorkerId"])
+    _apply(stats, assignment, 1, include_times=True)
+    bucket = next(iter(stats.work_time_histogram), None)
+    parameters = [f'$."{bucket}"' if bucket is not None else None]
+    parameters += [
+        field.db_value(getattr(stats, field.name))
+        for field in WorkerStats._meta.sorted_fields
+    ]
+    objective_turk.get_database().execute_sql(_upsert_sql(), parameters)
+
+
+def _on_bonus_saved(
+    previous: typing.Optional[typing.Dict], current: typing.Dict
+) -> None:
+    stats, created = _load(current["WorkerId"])
+    stats.bonuses += 1
+    stats.bonus_total = decimal.Decimal(str(stats.bonus_total)) + decimal.Decimal(
+        str(current["BonusAmount"])
+    )
+    stats.save(force_insert=created)
+
+
+objective_turk.on_save(
+    objective_turk.Assignment,
+    _on_assignment_saved,
+    fields=["AssignmentStatus"],
+    feature="worker_stats",
+)
+objective_turk.on_save(
+    objective_turk.BonusPayment, _on_bonus_saved, fields=[], feature="worker_stats"
+)
+
+
+# Archived HITs and assignments count too
+@archive.including_archived_if_any()
+def rebuild() -> int:
+    """
+    Recompute every worker's statistics from the assignments and bonuses in the database,
+    returning the number of workers
+    """
+    objective_turk.require_feature("worker_stats")
+    Assignment = objective_turk.Assignment
+    BonusPayment = objective_turk.BonusPayment
+
+    stats: typing.Dict[str, WorkerStats] = {}
+    query = Assignment.select(Assignment.worker, Assignment.details).tuples()
+    for worker_id, details in query.iterator():
+        if worker_id not in stats:
+            stats[worker_id] = WorkerStats(id=worker_id)
+        _apply(stats[worker_id], details, 1, include_times=True)
+
+    for worker_id, count, total in (
+        BonusPayment.select(
+            BonusPayment.worker,
+            peewee.fn.COUNT(BonusPayment.id),
+            peewee.fn.SUM(BonusPayment.BonusAmount),
+        )
+        .group_by(BonusPayment.worker)
+        .tuples()
+    ):
+        if worker_id not in stats:
+            stats[worker_id] = WorkerStats(id=worker_id)
+        stats[worker_id].bonuses = count
+        stats[worker_id].bonus_total = decimal.Decimal(str(total))
+
+    rows = list(stats.values())
+    with objective_turk.get_database().atomic():
+        WorkerStats.delete().execute()
+        for start in range(0, len(rows), 100):
+            WorkerStats.bulk_create(rows[start : start + 100])
+    logger.info("Rebuilt statistics for %d workers", len(rows))
+    return len(rows)
+
+
+# Enabling statistics for a database counts the assignments already there
+objective_turk.register_backfill(WorkerStats, rebuild)
@@ -13,21 +13,35 @@ setup(name='objective-turk',
           'colorlog>=4.0',
           'peewee>=3.8'
       ],
+      extras_require={
+          'analytics': ['numpy>=1.17'],
+          'dataframes': ['pyarrow>=8', 'pandas'],
+          'mirror': ['duckdb>=0.9', 'pyarrow>=8'],
+      },
       scripts=[
           'bin/approve_assignments',
+          'bin/archive_hits',
           'bin/assign_qualification',
           'bin/check_balance',
           'bin/create_additional_assignments',
           'bin/create_qualification',
           'bin/delete_qualification',
+          'bin/find_duplicate_answers',
           'bin/get_column_from_csv',
           'bin/intersect',
           'bin/list_hit_assignments',
+          'bin/list_jobs',
           'bin/list_qualification_types',
           'bin/list_workers_with_qualification_type',
+          'bin/mirror_query',
           'bin/really_delete_hit',
+          'bin/rebuild_worker_stats',
           'bin/remove_qualification',
           'bin/print_hit_workers',
           'bin/print_submitted_assignments',
+          'bin/setops',
+          'bin/spend_report',
           'bin/subtract',
+          'bin/sync_qualifications',
+          'bin/teardown_hits',
       ])
@@ -0,0 +1,64 @@
+"""
+Fixtures for tests against the fake MTurk backend (see mturk.fake)
+
+Every test gets its own session, with a fresh database and fake client.
+"""
+
+import typing
+
+import pytest
+
+import objective_turk
+from mturk import fake
+from objective_turk import create_hit
+from objective_turk.objective_turk import Hit
+
+
+@pytest.fixture
+def client() -> fake.FakeMTurkClient:
+    return fake.FakeMTurkClient(fake.FakeConfig(retry_backoff=0))
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch, client) -> typing.Iterator[objective_turk.Session]:
+    monkeypatch.delenv("MTURK_PROJECT", raising=False)
+    session = objective_turk.Session(
+        objective_turk.Environment.sandbox,
+        db_path=str(tmp_path / "turk_sandbox.db"),
+        client=client,
+    )
+    with session.activate():
+        yield session
+    session.close()
+
+
+@pytest.fixture
+def new_hit(session, client) -> typing.Callable[..., Hit]:
+    """
+    Return a function that creates a HIT, has it completed by the given workers
+    (a dictionary of WorkerIds to their answers), and downloads it with its assignments
+    """
+
+    def new_hit(
+        submissions: typing.Optional[typing.Dict[str, typing.Dict[str, str]]] = None,
+        **arguments,
+    ) -> Hit:
+        submissions = submissions or {}
+        arguments = {
+            "Title": "Test",
+            "Description": "A test HIT",
+            "Reward": "0.10",
+            "MaxAssignments": max(len(submissions), 1),
+            "LifetimeInSeconds": 3600,
+            "AssignmentDurationInSeconds": 600,
+            "Question": create_hit.get_external_question("https://example.com"),
+            **arguments,
+        }
+        hit = create_hit.create_hit(**arguments)
+        for worker_id, answers in submissions.items():
+            client.complete(hit.id, worker_id=worker_id, answers=answers)
+        hit = Hit.download(hit.id)
+        hit.download_assignments()
+        return hit
+
+    return new_hit
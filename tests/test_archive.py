@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+
+from objective_turk import Assignment, Hit, archive, bulk, ledger, worker_stats
+
+
+@pytest.fixture
+def hit_ids(new_hit):
+    hit_ids = [
+        new_hit({"W0": {"q1": "first"}, "W1": {"q1": "second"}}).id,
+        new_hit({"W0": {"q1": "third"}}).id,
+    ]
+    bulk.run(
+        bulk.ApproveAssignments(), [assignment.id for assignment in Assignment.select()]
+    )
+    Hit.download_all()
+    return hit_ids
+
+
+def totals():
+    stats = worker_stats.for_worker("W0")
+    return ledger.spent(), stats.assignments, stats.approved
+
+
+def answers():
+    return sorted(assignment.answers["q1"] for assignment in Assignment.select())
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(hit_ids, compress):
+    before = answers()
+
+    result = archive.archive(datetime.timedelta(0), compress=compress)
+    assert (result.hits, result.assignments) == (2, 3)
+    assert Hit.select().count() == 0
+    assert Assignment.select().count() == 0
+    assert archive.archived_details(Hit, hit_ids[0])["HITId"] == hit_ids[0]
+
+    with archive.including_archived():
+        assert sorted(hit.id for hit in Hit.select()) == sorted(hit_ids)
+        assert answers() == before
+        assert Assignment.select().where(Assignment.worker == "W0").count() == 2
+
+
+def test_only_completed_hits_are_archived(hit_ids, new_hit):
+    unfinished = new_hit({"W2": {"q1": "fourth"}}, MaxAssignments=2).id
+
+    assert archive.archive(datetime.timedelta(0)).hits == 2
+    assert [hit.id for hit in Hit.select()] == [unfinished]
+    assert archive.archive(datetime.timedelta(days=1)).hits == 0
+
+
+def test_download_again_does_not_count_twice(hit_ids):
+    worker_stats.enable()
+    before = totals()
+    assert before[0] > 0 and before[1:] == (2, 2)
+
+    archive.archive(datetime.timedelta(0))
+    assert totals() == before
+
+    # Still on MTurk, so it can be downloaded again, into the live tables
+    Hit.download(hit_ids[0]).download_assignments()
+    assert Hit.select().count() == 1
+    assert totals() == before
+
+    ledger.rebuild()
+    worker_stats.rebuild()
+    assert totals() == before
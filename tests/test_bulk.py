@@ -0,0 +1,70 @@
+import pytest
+
+from objective_turk import bulk
+
+
+@pytest.fixture
+def notifications(client, monkeypatch):
+    """
+    Record the WorkerIds of each NotifyWorkers call; workers whose ID ends in X can't be notified
+    """
+    notify_workers = client.notify_workers
+    calls = []
+
+    def notifications(**arguments):
+        calls.append(arguments["WorkerIds"])
+        notify_workers(**arguments)
+        return {
+            "NotifyWorkersFailureStatuses": [
+                {
+                    "NotifyWorkersFailureCode": "HardFailure",
+                    "NotifyWorkersFailureMessage": "Can't notify this worker",
+                    "WorkerId": worker_id,
+                }
+                for worker_id in arguments["WorkerIds"]
+                if worker_id.endswith("X")
+            ]
+        }
+
+    monkeypatch.setattr(client, "notify_workers", notifications)
+    return calls
+
+
+def test_notify_workers_in_batches(session, notifications):
+    worker_ids = [f"W{number}" for number in range(250)] + ["W1X", "W2X"]
+
+    result = bulk.run(bulk.NotifyWorkers("Hello", "A new batch is up"), worker_ids)
+    assert sorted(len(call) for call in notifications) == [52, 100, 100]
+    assert sorted(result.succeeded) == sorted(worker_ids[:250])
+    assert sorted(result.failed) == ["W1X", "W2X"]
+    assert "Can't notify this worker" in result.failed["W1X"]
+
+
+class Flaky(bulk.Operation):
+    """
+    Fails with an error calls aren't expected to raise, for every third item
+    """
+
+    name = "flaky"
+
+    def __init__(self):
+        self.saved = []
+
+    def call(self, item_id, payload):
+        if int(item_id) % 3 == 0:
+            raise KeyError(item_id)
+        return item_id
+
+    def save(self, item_id, outcome):
+        self.saved.append(outcome)
+
+
+def test_unexpected_errors_fail_their_items(session):
+    operation = Flaky()
+    items = [str(number) for number in range(10)]
+
+    result = bulk.run(operation, items)
+    assert sorted(result.failed) == ["0", "3", "6", "9"]
+    assert result.failed["3"] == "KeyError: '3'"
+    assert sorted(result.succeeded) == sorted(operation.saved)
+    assert len(result.succeeded) == 6
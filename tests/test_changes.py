@@ -0,0 +1,68 @@
+import pytest
+
+from objective_turk import Assignment, bulk, changes
+from objective_turk.objective_turk import FeatureNotEnabledError
+
+
+@pytest.fixture
+def consumer(session, new_hit):
+    changes.enable()
+    new_hit({"W0": {"q1": "first"}, "W1": {"q1": "second"}})
+    new_hit({"W2": {"q1": "third"}})
+    return changes.Consumer("export", kinds=["assignment"])
+
+
+def test_disabled(session):
+    with pytest.raises(FeatureNotEnabledError):
+        changes.Consumer("export").position
+
+
+def test_batches_are_acknowledged_when_the_next_is_asked_for(consumer):
+    pending = [change.sequence for change in consumer.pending()]
+    assert len(pending) == 3
+    assert consumer.position == 0
+
+    batches = consumer.batches(2)
+    first = next(batches)
+    assert [change.sequence for change in first] == pending[:2]
+    # Not processed yet, as far as the consumer knows
+    assert consumer.position == 0
+
+    second = next(batches)
+    assert [change.sequence for change in second] == pending[2:]
+    assert consumer.position == pending[1]
+
+    assert list(batches) == []
+    assert consumer.position == pending[2]
+    assert list(consumer.pending()) == []
+
+
+def test_unfinished_batch_is_seen_again(consumer):
+    for batch in consumer.batches(2):
+        break
+    assert [change.sequence for change in consumer.pending(2)] == [
+        change.sequence for change in batch
+    ]
+
+
+def test_new_changes_after_acknowledging(consumer):
+    for _ in consumer.batches():
+        pass
+    approved = Assignment.get(Assignment.worker == "W1").id
+
+    bulk.run(bulk.ApproveAssignments(), [approved])
+    (change,) = consumer.pending()
+    assert change.key == {"AssignmentId": approved}
+    assert change.operation == changes.UPDATE
+    assert (change.previous_status, change.status) == ("Submitted", "Approved")
+
+
+def test_prune_keeps_what_a_consumer_has_not_processed(consumer):
+    changes.Consumer("audit").acknowledge(changes.latest())
+    pending = [change.sequence for change in consumer.pending()]
+    consumer.acknowledge(pending[1])
+    processed = changes.since(0).where(changes.Change.sequence <= pending[1]).count()
+
+    assert changes.prune() == processed
+    assert min(change.sequence for change in changes.since()) > pending[1]
+    assert [change.sequence for change in consumer.pending()] == pending[2:]
@@ -0,0 +1,82 @@
+import pytest
+
+from objective_turk import fingerprints
+from objective_turk.objective_turk import FeatureNotEnabledError
+
+ORIGINAL = (
+    "The task was clear and the instructions were easy to follow, although the "
+    "second part of the survey took much longer than the estimated ten minutes."
+)
+# The same, after normalization
+COPIED = ORIGINAL.upper().replace(",", "") + "!!"
+# Mostly the same
+EDITED = ORIGINAL.replace("much longer", "a bit longer") + " Thanks!"
+UNRELATED = (
+    "I would happily do more of these, as long as the payment reflects how long "
+    "they actually take to complete."
+)
+
+
+def submit(new_hit):
+    new_hit(
+        {
+            "W0": {"comments": ORIGINAL, "rating": "5"},
+            "W1": {"comments": COPIED, "rating": "5"},
+        }
+    )
+    new_hit(
+        {
+            "W2": {"comments": EDITED, "rating": "4"},
+            "W3": {"comments": UNRELATED, "rating": "5"},
+        }
+    )
+
+
+@pytest.fixture
+def submitted(new_hit):
+    submit(new_hit)
+
+
+def clusters(found):
+    return sorted((cluster.question, sorted(cluster.workers)) for cluster in found)
+
+
+def test_disabled(submitted):
+    with pytest.raises(FeatureNotEnabledError):
+        fingerprints.duplicates()
+
+
+@pytest.mark.parametrize("enable_first", [True, False])
+def test_duplicates(new_hit, enable_first):
+    # Answers are indexed as they're saved, or all at once when the feature is enabled
+    if enable_first:
+        fingerprints.enable()
+        submit(new_hit)
+    else:
+        submit(new_hit)
+        fingerprints.enable()
+
+    assert clusters(fingerprints.duplicates()) == [("comments", ["W0", "W1"])]
+    # Short answers (the ratings) only count if asked for
+    assert clusters(fingerprints.duplicates(min_length=0)) == [
+        ("comments", ["W0", "W1"]),
+        ("rating", ["W0", "W1", "W3"]),
+    ]
+    assert fingerprints.duplicates(question="rating") == []
+
+
+def test_similar(submitted):
+    fingerprints.enable()
+
+    assert clusters(fingerprints.similar(0.5)) == [("comments", ["W0", "W1", "W2"])]
+    assert clusters(fingerprints.similar(1.0)) == [("comments", ["W0", "W1"])]
+    assert fingerprints.similar(0.5, question="rating") == []
+
+
+def test_rebuild_matches_indexing_on_save(new_hit):
+    fingerprints.enable()
+    submit(new_hit)
+    indexed = clusters(fingerprints.similar(0.5))
+
+    fingerprints.rebuild()
+    assert clusters(fingerprints.similar(0.5)) == indexed
@@ -0,0 +1,103 @@
+import botocore.exceptions
+import pytest
+
+from objective_turk import Assignment, bulk, jobs
+
+
+@pytest.fixture
+def assignment_ids(new_hit):
+    for number in range(3):
+        new_hit({f"W{number}": {"q1": "an answer"}})
+    return [assignment.id for assignment in Assignment.select().order_by(Assignment.id)]
+
+
+class Approvals:
+    """
+    Stands in for the fake client's approve_assignment, recording what it approves;
+    failures can be set up per assignment
+    """
+
+    def __init__(self, approve_assignment):
+        self.approve_assignment = approve_assignment
+        self.approved = []
+        self.failures = {}
+
+    def __call__(self, **arguments):
+        failure = self.failures.pop(arguments["AssignmentId"], None)
+        if failure is not None:
+            raise failure
+        response = self.approve_assignment(**arguments)
+        self.approved.append(arguments["AssignmentId"])
+        return response
+
+
+@pytest.fixture
+def approvals(client, monkeypatch):
+    approvals = Approvals(client.approve_assignment)
+    monkeypatch.setattr(client, "approve_assignment", approvals)
+    return approvals
+
+
+def statuses():
+    return {
+        assignment.id: assignment.AssignmentStatus for assignment in Assignment.select()
+    }
+
+
+def test_retry_failed(assignment_ids, approvals):
+    failing = assignment_ids[1]
+    approvals.failures[failing] = botocore.exceptions.ClientError(
+        {"Error": {"Code": "ServiceUnavailable", "Message": "Try again"}},
+        "ApproveAssignment",
+    )
+
+    job, result = jobs.run(bulk.ApproveAssignments(), assignment_ids)
+    assert list(result.failed) == [failing]
+    assert job.status == jobs.INCOMPLETE
+    assert job.counts() == {jobs.SUCCEEDED: 2, jobs.FAILED: 1}
+    (dead_letter,) = job.dead_letters()
+    assert dead_letter.item == failing
+    assert "ServiceUnavailable" in dead_letter.error
+    assert statuses()[failing] == "Submitted"
+
+    result = jobs.retry_failed(job)
+    assert result.succeeded == [failing]
+    assert job.status == jobs.FINISHED
+    assert job.counts() == {jobs.SUCCEEDED: 3}
+    assert jobs.JobItem.get(jobs.JobItem.item == failing).attempts == 2
+    assert set(statuses().values()) == {"Approved"}
+    assert sorted(approvals.approved) == sorted(assignment_ids)
+
+
+def test_resume_after_interruption(assignment_ids, approvals):
+    interrupted = assignment_ids[1]
+    approvals.failures[interrupted] = KeyboardInterrupt()
+
+    job = jobs.create(bulk.ApproveAssignments(), assignment_ids)
+    with pytest.raises(KeyboardInterrupt):
+        jobs.resume(job, max_workers=1)
+
+    # What took effect before the interruption was saved; the rest is still pending
+    counts = job.counts()
+    assert counts[jobs.PENDING] >= 1
+    assert counts.get(jobs.FAILED, 0) == 0
+    assert jobs.JobItem.get(jobs.JobItem.item == interrupted).status == jobs.PENDING
+    for assignment_id in approvals.approved:
+        assert statuses()[assignment_id] == "Approved"
+
+    jobs.resume(job)
+    assert job.status == jobs.FINISHED
+    assert job.counts() == {jobs.SUCCEEDED: 3}
+    assert set(statuses().values()) == {"Approved"}
+    # Nothing was approved twice, and nothing was left out
+    assert sorted(approvals.approved) == sorted(assignment_ids)
+
+
+def test_resume_skips_what_was_done_elsewhere(assignment_ids, approvals):
+    job = jobs.create(bulk.ApproveAssignments(), assignment_ids)
+    bulk.run(bulk.ApproveAssignments(), assignment_ids[:1])
+
+    result = jobs.resume(job)
+    assert list(result.skipped) == assignment_ids[:1]
+    assert job.counts() == {jobs.SKIPPED: 1, jobs.SUCCEEDED: 2}
+    assert sorted(approvals.approved) == sorted(assignment_ids)
@@ -0,0 +1,63 @@
+import decimal
+
+import pytest
+
+from objective_turk import Assignment, BonusPayment, bulk, jobs, ledger
+
+BONUS = decimal.Decimal("1.00") + ledger.bonus_fee("1.00")
+
+
+@pytest.fixture
+def assignment_ids(new_hit):
+    new_hit({f"W{number}": {"q1": "an answer"} for number in range(4)})
+    return [assignment.id for assignment in Assignment.select().order_by(Assignment.id)]
+
+
+def bonus():
+    return bulk.SendBonus(amount="1.00", reason="Thanks")
+
+
+def paid():
+    return sorted(payment.assignment for payment in BonusPayment.select())
+
+
+def test_hits_and_bonuses_are_recorded(assignment_ids):
+    hits = decimal.Decimal("0.40") + ledger.reward_fee("0.10", 4)
+    assert ledger.spent() == hits
+
+    bulk.run(bonus(), assignment_ids[:2])
+    assert ledger.spent() == hits + 2 * BONUS
+
+
+@pytest.mark.parametrize("batch_size", [1, 100])
+def test_budget_stops_the_run(assignment_ids, batch_size):
+    budget = ledger.Budget(ledger.spent() + 2 * BONUS + decimal.Decimal("0.50"))
+
+    result = bulk.run(bonus(), assignment_ids, batch_size=batch_size, budget=budget)
+    assert sorted(result.succeeded) == sorted(assignment_ids[:2])
+    assert sorted(result.failed) == sorted(assignment_ids[2:])
+    assert all("BudgetExceeded" in error for error in result.failed.values())
+    assert paid() == sorted(assignment_ids[:2])
+    assert budget.remaining() == decimal.Decimal("0.50")
+
+
+def test_budget_of_another_project(assignment_ids):
+    budget = ledger.Budget("1.50", project="another")
+
+    result = bulk.run(bonus(), assignment_ids[:1], budget=budget)
+    assert result.succeeded == assignment_ids[:1]
+    assert budget.spent() == 0
+
+
+def test_resume_with_a_larger_budget(assignment_ids):
+    job, result = jobs.run(
+        bonus(), assignment_ids, budget=ledger.Budget(ledger.spent() + BONUS)
+    )
+    assert result.succeeded == assignment_ids[:1]
+    assert job.status == jobs.INCOMPLETE
+    assert job.counts() == {jobs.SUCCEEDED: 1, jobs.FAILED: 3}
+
+    result = jobs.retry_failed(job, budget=ledger.Budget(ledger.spent() + 3 * BONUS))
+    assert sorted(result.succeeded) == sorted(assignment_ids[1:])
+    assert job.status == jobs.FINISHED
+    assert paid() == sorted(assignment_ids)
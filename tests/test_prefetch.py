@@ -0,0 +1,59 @@
+import pytest
+
+from objective_turk import Assignment, Hit, instrumentation
+
+
+@pytest.fixture
+def hits(new_hit):
+    for number in range(3):
+        new_hit({f"W{number}": {"q1": "an answer"}, "W9": {"q1": "another answer"}})
+
+
+def walk(hits):
+    return sorted(
+        (hit.id, assignment.id, assignment.worker.id)
+        for hit in hits
+        for assignment in hit.assignments
+    )
+
+
+def selects(function):
+    with instrumentation.profile() as metrics:
+        result = function()
+    return result, metrics.sql_queries.get("SELECT", 0)
+
+
+def test_with_related_runs_one_query_per_model(hits):
+    expected, row_by_row = selects(lambda: walk(Hit.select()))
+    assert len(expected) == 6
+    # One for the HITs, one for each HIT's assignments, one for each assignment's worker
+    assert row_by_row == 1 + 3 + 6
+
+    found, prefetched = selects(
+        lambda: walk(Hit.select().with_assignments().with_workers())
+    )
+    assert found == expected
+    assert prefetched == 3
+
+
+def test_with_related_query(hits):
+    query = Hit.select().with_related(
+        Assignment.select().where(Assignment.worker == "W9")
+    )
+    found, count = selects(lambda: walk(query))
+    assert [worker_id for _, _, worker_id in found] == ["W9"] * 3
+    # The workers weren't loaded with them, so they're looked up one by one
+    assert count == 2 + 3
+
+
+def test_related_rows_of_filtered_results(hits):
+    hit = Hit.select().first()
+    query = Assignment.select().where(Assignment.hit == hit).with_hits().with_workers()
+
+    found, count = selects(
+        lambda: sorted(
+            (assignment.hit.id, assignment.worker.id) for assignment in query
+        )
+    )
+    assert found == sorted((hit.id, worker_id) for worker_id in ["W0", "W9"])
+    assert count == 3
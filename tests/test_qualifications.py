@@ -0,0 +1,63 @@
+import pytest
+
+from objective_turk import Qualification, QualificationType
+
+
+@pytest.fixture
+def qualification_type(session, client):
+    QualificationType.create_qualification_type("Test", "A test qualification")
+    qualification_type = QualificationType.get()
+    for worker_id in ["W0", "W1", "W2"]:
+        client.associate_qualification_with_worker(
+            QualificationTypeId=qualification_type.id, WorkerId=worker_id
+        )
+    return qualification_type
+
+
+def local_values(qualification_type):
+    return {
+        qualification.details["WorkerId"]: qualification.details["IntegerValue"]
+        for qualification in Qualification.select().where(
+            Qualification.qualification_type == qualification_type.id
+        )
+    }
+
+
+def test_sync_inserts_updates_and_deletes(qualification_type, client):
+    diff = Qualification.sync_qualification_type(qualification_type)
+    assert sorted(diff.inserted) == ["W0", "W1", "W2"]
+    assert (diff.updated, diff.deleted, diff.unchanged) == ([], [], 0)
+    assert local_values(qualification_type) == {"W0": 1, "W1": 1, "W2": 1}
+
+    client.disassociate_qualification_from_worker(
+        QualificationTypeId=qualification_type.id, WorkerId="W1"
+    )
+    client.associate_qualification_with_worker(
+        QualificationTypeId=qualification_type.id, WorkerId="W2", IntegerValue=5
+    )
+    diff = Qualification.sync_qualification_type(qualification_type)
+    assert (diff.inserted, diff.updated, diff.deleted) == ([], ["W2"], ["W1"])
+    assert diff.unchanged == 1
+    assert local_values(qualification_type) == {"W0": 1, "W2": 5}
+
+    diff = Qualification.sync_qualification_type(qualification_type)
+    assert (diff.inserted, diff.updated, diff.deleted) == ([], [], [])
+    assert diff.unchanged == 2
+
+
+def test_sync_deletes_only_the_given_type(qualification_type, client):
+    QualificationType.create_qualification_type("Other", "Another qualification")
+    other = QualificationType.get(QualificationType.id != qualification_type.id)
+    client.associate_qualification_with_worker(
+        QualificationTypeId=other.id, WorkerId="W1"
+    )
+    Qualification.sync_qualification_types()
+
+    for worker_id in ["W0", "W1", "W2"]:
+        client.disassociate_qualification_from_worker(
+            QualificationTypeId=qualification_type.id, WorkerId=worker_id
+        )
+    diff = Qualification.sync_qualification_type(qualification_type)
+    assert sorted(diff.deleted) == ["W0", "W1", "W2"]
+    assert local_values(qualification_type) == {}
+    assert local_values(other) == {"W1": 1}